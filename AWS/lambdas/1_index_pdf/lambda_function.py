@@ -1,68 +1,82 @@
-import boto3
 import json
 import os
+import time
 from io import BytesIO
 from urllib.parse import unquote_plus
-from pypdf import PdfReader
 
-# AWS clients
-s3 = boto3.client("s3")
-lambda_client = boto3.client("lambda")
+from paper_common import artifacts, clients, jobs, keys, metrics
+from paper_common.failures import DEFAULT_MAX_ATTEMPTS, handle_stage_failure
+from paper_common.retry import call_with_retry
+
+# AWS clients (built on first use, see paper_common.clients)
+s3 = clients.lazy("s3")
+lambda_client = clients.lazy("lambda")
 
 # Environment variables
 TEXT_BUCKET = os.environ.get("TEXT_BUCKET", "paper-texts")
+# "artifact": compressed pages + chunk index (paper_common.artifacts);
+# "text": the plain .txt older readers expect.
+TEXT_FORMAT = os.environ.get("TEXT_FORMAT", "artifact")
 CHUNK_EMBED_LAMBDA_ARN = os.environ.get("CHUNK_EMBED_LAMBDA_ARN")
+METADATA_TABLE = os.environ.get("METADATA_TABLE")  # optional: enables status tracking
+MAX_ATTEMPTS = int(os.environ.get("MAX_ATTEMPTS", str(DEFAULT_MAX_ATTEMPTS)))  # per event, incl. re-queues
 
+metadata_table = clients.lazy_table(METADATA_TABLE) if METADATA_TABLE else None
 
-def extract_text_from_pdf(pdf_bytes: bytes) -> str:
+METRICS = metrics.MetricsLogger("IndexPdfLambda")
+
+
+def extract_pages_from_pdf(pdf_bytes: bytes):
     """
-    Convert raw PDF bytes -> concatenated plain text from all pages.
+    Convert raw PDF bytes -> plain text of each page, one page at a time.
     """
+    from pypdf import PdfReader  # imported on first use to keep cold starts short
+
     reader = PdfReader(BytesIO(pdf_bytes))
-    text_parts = []
-    for i, page in enumerate(reader.pages):
-        page_text = page.extract_text() or ""
-        text_parts.append(page_text)
-    return "\n".join(text_parts)
+    for page in reader.pages:
+        yield page.extract_text() or ""
 
 
-def _derive_ids_from_key(decoded_key: str):
+def extract_text_from_pdf(pdf_bytes: bytes) -> str:
     """
-    Try to infer user_id and paper_id from the S3 object key.
-
-    Supports:
-      1) "user/<user_id>/papers/<paper_id>.pdf"
-      2) "<filename>.pdf"  (fallback: user_id = 'dev-user')
+    Convert raw PDF bytes -> concatenated plain text from all pages.
     """
-    parts = decoded_key.split("/")
+    return "\n".join(extract_pages_from_pdf(pdf_bytes))
 
-    # Case 1: key like "user/<user_id>/papers/<paper_id>.pdf"
-    if len(parts) >= 4 and parts[0] == "user" and parts[2] == "papers":
-        user_id = parts[1]
-        filename = parts[3]
-        paper_id = filename.rsplit(".", 1)[0]
-        return user_id, paper_id
 
-    # Case 2: anything else -> fallback
-    filename = parts[-1]
-    paper_id = filename.rsplit(".", 1)[0]
-    user_id = "dev-user"  # simple default for now
-    return user_id, paper_id
+def build_text_object(pdf_bytes: bytes) -> tuple[bytes, int]:
+    """
+    (object body, characters of text) for TEXT_BUCKET in TEXT_FORMAT. The
+    artifact is written page by page as pypdf extracts them.
+    """
+    if TEXT_FORMAT == "text":
+        text = extract_text_from_pdf(pdf_bytes)
+        return text.encode("utf-8"), len(text.strip())
+    out = BytesIO()
+    writer = artifacts.ArtifactWriter(out)
+    chars = 0
+    for page_text in extract_pages_from_pdf(pdf_bytes):
+        writer.add_page(page_text)
+        chars += len(page_text.strip())
+    writer.close()
+    return out.getvalue(), chars
+
+
+def _parse_event(event):
+    """
+    Accept either an S3 ObjectCreated event or a direct job payload from the
+    API's job queue:
 
+      {"document_id": "...", "user_id": "...", "pdf_s3_bucket": "...",
+       "pdf_s3_key": "...", "wait": true}
 
-def lambda_handler(event, context):
-    """
-    Entry point for IndexPdfLambda.
-    Triggered by S3 ObjectCreated events on the PDF bucket.
-    Steps:
-      1) Read bucket + key from S3 event (decode key for spaces)
-      2) Download PDF from S3
-      3) Extract text using pypdf
-      4) Save text to TEXT_BUCKET as user/<user_id>/papers/<paper_id>.txt
-      5) Invoke ChunkAndEmbedLambda with metadata
+    Returns (bucket, key, user_id, paper_id, wait).
     """
+    if "Records" not in event:
+        user_id = event["user_id"]
+        paper_id = event["document_id"]
+        return event["pdf_s3_bucket"], event["pdf_s3_key"], user_id, paper_id, bool(event.get("wait"))
 
-    # 1. Parse S3 event
     record = event["Records"][0]
     bucket = record["s3"]["bucket"]["name"]
 
@@ -71,45 +85,134 @@ def lambda_handler(event, context):
 
     print(f"[IndexPdfLambda] Received S3 event for bucket={bucket}, raw_key={raw_key}, decoded_key={key}")
 
-    # 1.1 Derive user_id and paper_id
-    user_id, paper_id = _derive_ids_from_key(key)
-    print(f"[IndexPdfLambda] Using user_id={user_id}, paper_id={paper_id}")
+    user_id, paper_id = keys.ids_from_pdf_key(key)
+    return bucket, key, user_id, paper_id, False
+
 
-    # 2. Download PDF
-    obj = s3.get_object(Bucket=bucket, Key=key)
-    pdf_bytes = obj["Body"].read()
+def _deadline(context, margin_s: float = 10.0):
+    """Monotonic time after which no new retry should start."""
+    if context is None or not hasattr(context, "get_remaining_time_in_millis"):
+        return None
+    return time.monotonic() + context.get_remaining_time_in_millis() / 1000 - margin_s
 
-    # 3. Extract text
-    extracted_text = extract_text_from_pdf(pdf_bytes)
-    if not extracted_text.strip():
-        print("[IndexPdfLambda] WARNING: Extracted text is empty or whitespace")
 
-    # 4. Save extracted text to TEXT_BUCKET
-    text_key = f"user/{user_id}/papers/{paper_id}.txt"
+@METRICS.flush_after
+def lambda_handler(event, context):
+    """
+    Entry point for IndexPdfLambda.
+    Triggered by S3 ObjectCreated events on the PDF bucket, or invoked
+    directly by the API job queue.
+    Steps:
+      1) Read bucket + key from the event (decode key for spaces)
+      2) Download PDF from S3
+      3) Extract text using pypdf
+      4) Save text to TEXT_BUCKET as user/<user_id>/papers/<paper_id>.pta
+         (compressed pages + chunk index; .txt with TEXT_FORMAT=text)
+      5) Invoke ChunkAndEmbedLambda with metadata
+         (synchronously when the job queue asked to "wait", so it can hold
+         its concurrency slot until the whole pipeline is done)
 
-    s3.put_object(
-        Bucket=TEXT_BUCKET,
-        Key=text_key,
-        Body=extracted_text.encode("utf-8"),
-    )
+    S3 calls retry transient errors with backoff. If the stage still fails,
+    the event is re-queued (transient) or parked on the metadata item
+    (permanent) - see paper_common.failures.
+
+    A ``{"warmup": true}`` event only builds the clients and returns.
+    """
+    if clients.is_warmup(event):
+        clients.warm_up(s3, lambda_client, metadata_table)
+        return {"statusCode": 200, "warmup": True}
+
+    # 1. Parse event and derive user_id and paper_id
+    bucket, key, user_id, paper_id, wait = _parse_event(event)
+    print(f"[IndexPdfLambda] Using user_id={user_id}, paper_id={paper_id}")
+
+    status = jobs.StatusRecorder(metadata_table, paper_id)
+    text_key = keys.text_key(user_id, paper_id) if TEXT_FORMAT == "text" else keys.artifact_key(user_id, paper_id)
+    deadline = _deadline(context)
+
+    try:
+        with status.stage(jobs.EXTRACTING):
+            # 2. Download PDF
+            with METRICS.timed("s3_get_object"):
+                obj = call_with_retry(s3.get_object, Bucket=bucket, Key=key, deadline=deadline)
+                pdf_bytes = obj["Body"].read()
+            METRICS.put("pdf_bytes", len(pdf_bytes), metrics.BYTES)
+
+            # 3. Extract text (parse errors are permanent and not retried)
+            with METRICS.timed("pdf_parse"):
+                text_bytes, text_chars = build_text_object(pdf_bytes)
+            if not text_chars:
+                print("[IndexPdfLambda] WARNING: Extracted text is empty or whitespace")
+
+            # 4. Save extracted text to TEXT_BUCKET
+            METRICS.put("text_bytes", len(text_bytes), metrics.BYTES)
+            with METRICS.timed("s3_put_object"):
+                call_with_retry(
+                    s3.put_object,
+                    Bucket=TEXT_BUCKET,
+                    Key=text_key,
+                    Body=text_bytes,
+                    ContentType="text/plain; charset=utf-8" if TEXT_FORMAT == "text" else artifacts.CONTENT_TYPE,
+                    deadline=deadline,
+                )
+    except Exception as e:
+        # Re-queues carry the normalized payload so the retry does not depend
+        # on the original S3 event shape.
+        retry_event = {
+            "document_id": paper_id,
+            "user_id": user_id,
+            "pdf_s3_bucket": bucket,
+            "pdf_s3_key": key,
+            "attempt": event.get("attempt", 0),
+        }
+        return handle_stage_failure(
+            e,
+            recorder=status,
+            event=retry_event,
+            lambda_client=lambda_client,
+            function_name=getattr(context, "invoked_function_arn", None),
+            max_attempts=MAX_ATTEMPTS,
+        )
 
     print(f"[IndexPdfLambda] Extracted text stored at: s3://{TEXT_BUCKET}/{text_key}")
 
     # 5. Invoke ChunkAndEmbedLambda (optional if ARN is configured)
+    chunk_embed_result = None
     if CHUNK_EMBED_LAMBDA_ARN:
         payload = {
+            "document_id": paper_id,
             "user_id": user_id,
             "paper_id": paper_id,
             "text_s3_bucket": TEXT_BUCKET,
             "text_s3_key": text_key,
+            "wait": wait,
         }
 
-        lambda_client.invoke(
-            FunctionName=CHUNK_EMBED_LAMBDA_ARN,
-            InvocationType="Event",  # async / fire-and-forget
-            Payload=json.dumps(payload),
-        )
+        with METRICS.timed("invoke_chunk_embed"):
+            resp = call_with_retry(
+                lambda_client.invoke,
+                FunctionName=CHUNK_EMBED_LAMBDA_ARN,
+                InvocationType="RequestResponse" if wait else "Event",
+                Payload=json.dumps(payload),
+                deadline=deadline,
+            )
         print(f"[IndexPdfLambda] Invoked ChunkAndEmbedLambda: {CHUNK_EMBED_LAMBDA_ARN}")
+
+        if wait:
+            chunk_embed_result = json.loads(resp["Payload"].read().decode("utf-8") or "{}")
+            # A parked failure comes back as a result, not as a FunctionError.
+            if resp.get("FunctionError") or chunk_embed_result.get("status") == jobs.FAILED:
+                raise RuntimeError(f"ChunkAndEmbedLambda failed: {chunk_embed_result}")
+            if chunk_embed_result.get("statusCode") == 202:
+                # Re-queued or continued asynchronously: not indexed yet.
+                return {
+                    "statusCode": 202,
+                    "status": chunk_embed_result.get("status"),
+                    "user_id": user_id,
+                    "paper_id": paper_id,
+                    "text_s3_key": text_key,
+                    "chunk_embed_result": chunk_embed_result,
+                }
     else:
         print("[IndexPdfLambda] CHUNK_EMBED_LAMBDA_ARN not set; skipping next step invoke")
 
@@ -119,4 +222,5 @@ def lambda_handler(event, context):
         "user_id": user_id,
         "paper_id": paper_id,
         "text_s3_key": text_key,
+        "chunk_embed_result": chunk_embed_result,
     }
\ No newline at end of file
@@ -1,90 +1,106 @@
-import boto3
 import json
 import os
-import uuid
+import time
+
+from paper_common import artifacts, clients, embeddings, generations, jobs, keys, metrics, partitions
+from paper_common.failures import DEFAULT_MAX_ATTEMPTS, handle_stage_failure
+from paper_common.retry import AdaptivePacer, call_with_retry
+
+# AWS clients are built on first use (see paper_common.clients)
 
 # S3 client for reading text files
-s3 = boto3.client("s3")
+s3 = clients.lazy("s3")
 
 # S3 Vectors client for storing embeddings
-s3v = boto3.client("s3vectors")
+s3v = clients.lazy("s3vectors")
+
+# Lambda client for re-queueing unfinished work to ourselves
+lambda_client = clients.lazy("lambda")
 
 VECTOR_BUCKET = os.environ.get("VECTOR_BUCKET")
 VECTOR_INDEX = os.environ.get("VECTOR_INDEX")
 BEDROCK_REGION = os.environ.get("BEDROCK_REGION", "us-east-1")
+BEDROCK_MODEL_ID = os.environ.get("BEDROCK_MODEL_ID", embeddings.DEFAULT_MODEL_ID)
+EMBED_DIMS = int(os.environ.get("EMBED_DIMS", str(embeddings.DEFAULT_DIMS)))
 
-# Bedrock runtime client for embeddings
-bedrock = boto3.client("bedrock-runtime", region_name=BEDROCK_REGION)
+# Bedrock runtime client for embeddings. Retries are handled by
+# call_with_retry + AdaptivePacer, so keep botocore's own retries short.
+bedrock = clients.lazy(
+    "bedrock-runtime",
+    region_name=BEDROCK_REGION,
+    config={"retries": {"mode": "standard", "max_attempts": 2}},
+)
 
+# Metadata table for job status tracking (optional)
+METADATA_TABLE = os.environ.get("METADATA_TABLE")
+metadata_table = clients.lazy_table(METADATA_TABLE) if METADATA_TABLE else None
 
-def chunk_text(text: str, max_chars: int = 200):
-    """
-    Split text into chunks of ~max_chars characters, without breaking words.
-    """
-    words = text.split()
-    chunks = []
-    current_words = []
-    current_len = 0
+# Index generations to write to: the VECTOR_MANIFEST_BUCKET manifest when
+# configured (active + staging + previous), else just VECTOR_INDEX.
+generation_source = generations.from_env(s3, os.environ, BEDROCK_MODEL_ID, EMBED_DIMS)
+# Which partition (index) of each generation a user's vectors go to
+# (VECTOR_PARTITIONS_BUCKET routing table; without it, the generation's index).
+routing_source = partitions.from_env(s3, os.environ)
 
-    for word in words:
-        extra_len = len(word) if current_len == 0 else len(word) + 1
+MAX_ATTEMPTS = int(os.environ.get("MAX_ATTEMPTS", str(DEFAULT_MAX_ATTEMPTS)))  # per event, incl. re-queues
+PUT_BATCH_SIZE = 100        # vectors per put_vectors call (also the resume checkpoint granularity)
+TIME_MARGIN_S = 30          # hand off to a fresh invocation when less time than this is left
 
-        if current_len + extra_len > max_chars and current_words:
-            chunks.append(" ".join(current_words))
-            current_words = [word]
-            current_len = len(word)
-        else:
-            if current_len == 0:
-                current_words.append(word)
-                current_len = len(word)
-            else:
-                current_words.append(word)
-                current_len += len(word) + 1
+METRICS = metrics.MetricsLogger("ChunkAndEmbedLambda")
 
-    if current_words:
-        chunks.append(" ".join(current_words))
 
-    return chunks
-
-
-def embed_text(text: str, dims: int = 256) -> list[float]:
+def embed_text(text: str, model_id: str = BEDROCK_MODEL_ID, dims: int = EMBED_DIMS) -> list[float]:
     """
-    Call Amazon Titan Embeddings (v2) on a single text chunk and return the vector.
+    Call Amazon Titan Embeddings on a single text chunk and return the vector.
+    Each attempt is timed separately, so throttled retries show up as errors.
     """
-    body = {
-        "inputText": text,
-        "dimensions": dims,
-        "normalize": True,
-    }
+    with METRICS.timed("embed"):
+        return embeddings.embed_text(bedrock, text, model_id=model_id, dims=dims)
 
-    response = bedrock.invoke_model(
-        modelId="amazon.titan-embed-text-v2:0",
-        contentType="application/json",
-        accept="application/json",
-        body=json.dumps(body),
-    )
 
-    payload = json.loads(response["body"].read())
-    embedding = (
-        payload.get("embedding")
-        or payload.get("embeddings")
-        or payload.get("vector")
-    )
+def _remaining_s(context) -> float:
+    if context is None or not hasattr(context, "get_remaining_time_in_millis"):
+        return float("inf")
+    return context.get_remaining_time_in_millis() / 1000
 
-    if embedding is None:
-        raise RuntimeError(f"Unexpected embedding response format: {payload}")
 
-    return embedding
+def _put_batches(batches: dict[str, list[dict]], deadline: float | None) -> None:
+    for index_name, vector_items in batches.items():
+        with METRICS.timed("put_vectors"):
+            call_with_retry(
+                s3v.put_vectors,
+                vectorBucketName=VECTOR_BUCKET,
+                indexName=index_name,
+                vectors=vector_items,
+                deadline=deadline,
+            )
+        METRICS.put("put_vectors_batch_size", len(vector_items))
+        vector_items.clear()
 
 
+@METRICS.flush_after
 def lambda_handler(event, context):
     """
     Behaviour now:
-      - Read text file from S3
-      - Chunk into ~1000-char segments
-      - For each chunk, call Titan embeddings
-      - Store (embedding + source_text + metadata) into S3 Vectors
+      - Read the text from S3 (a paper_common.artifacts artifact or a .txt)
+      - Chunk into ~1000-char segments (read from the artifact's chunk table)
+      - For each chunk, call Titan embeddings (paced + retried on throttling)
+      - Store (embedding + source_text + metadata) into S3 Vectors in batches,
+        under deterministic keys so re-runs overwrite instead of duplicating,
+        into every write target of the index generation manifest (in the
+        user's partition of each, see paper_common.partitions)
+      - Record chunking/embedding/indexed status in the metadata table
+
+    ``resume_from`` in the event skips chunks already written by an earlier
+    attempt. When the invocation runs low on time, or a transient error
+    outlasts the in-process retries, the remaining work is re-queued from
+    the last written batch instead of being lost.
+
+    A ``{"warmup": true}`` event only builds the clients and returns.
     """
+    if clients.is_warmup(event):
+        clients.warm_up(s3, s3v, bedrock, lambda_client, metadata_table)
+        return {"statusCode": 200, "warmup": True}
 
     print("[ChunkAndEmbedLambda] Event received:")
     print(json.dumps(event))
@@ -99,89 +115,137 @@ def lambda_handler(event, context):
         print(f"[ChunkAndEmbedLambda] ERROR: Missing expected key in event: {e}")
         raise
 
-    print(f"[ChunkAndEmbedLambda] user_id={user_id}, paper_id={paper_id}")
+    resume_from = int(event.get("resume_from", 0))
+    status = jobs.StatusRecorder(metadata_table, event.get("document_id", paper_id))
+    function_name = getattr(context, "invoked_function_arn", None)
+    deadline = time.monotonic() + _remaining_s(context) - TIME_MARGIN_S / 2
+    written_upto = resume_from
+
+    print(f"[ChunkAndEmbedLambda] user_id={user_id}, paper_id={paper_id}, resume_from={resume_from}")
     print(f"[ChunkAndEmbedLambda] Reading text from s3://{text_bucket}/{text_key}")
 
-    # 2. Download the extracted text from S3
-    obj = s3.get_object(Bucket=text_bucket, Key=text_key)
-    text_bytes = obj["Body"].read()
-    text = text_bytes.decode("utf-8", errors="replace")
-
-    text_length = len(text)
-    print(f"[ChunkAndEmbedLambda] Full text length: {text_length} characters")
-
-    # 3. Chunk the text
-    chunks = chunk_text(text, max_chars=1000)
-    num_chunks = len(chunks)
-    print(f"[ChunkAndEmbedLambda] Number of chunks: {num_chunks}")
-
-    if num_chunks == 0:
-        print("[ChunkAndEmbedLambda] WARNING: No chunks produced; nothing to embed.")
-        return {
-            "statusCode": 200,
-            "message": "No text to embed",
-            "user_id": user_id,
-            "paper_id": paper_id,
-            "text_length": text_length,
-            "num_chunks": 0,
-            "vectors_written": 0,
-        }
-
-    if not VECTOR_BUCKET or not VECTOR_INDEX:
-        print(
-            "[ChunkAndEmbedLambda] ERROR: VECTOR_BUCKET or VECTOR_INDEX env vars "
-            "not set; cannot write to S3 Vectors."
-        )
-        raise RuntimeError("Missing VECTOR_BUCKET or VECTOR_INDEX env vars")
+    try:
+        with status.stage(jobs.CHUNKING):
+            # 2. Download the extracted text from S3
+            with METRICS.timed("s3_get_object"):
+                obj = call_with_retry(s3.get_object, Bucket=text_bucket, Key=text_key, deadline=deadline)
+                text_bytes = obj["Body"].read()
+            METRICS.put("text_bytes", len(text_bytes), metrics.BYTES)
+
+            # 3. Chunk the text (an artifact already carries its chunk table)
+            with METRICS.timed("chunking"):
+                chunks, text_length = artifacts.load_chunks(text_bytes, max_chars=1000)
+            num_chunks = len(chunks)
+            METRICS.put("num_chunks", num_chunks)
+            print(f"[ChunkAndEmbedLambda] Text length: {text_length} characters, {num_chunks} chunks")
+
+        if num_chunks == 0:
+            print("[ChunkAndEmbedLambda] WARNING: No chunks produced; nothing to embed.")
+            status.set_status(jobs.INDEXED, num_chunks=0)
+            return {
+                "statusCode": 200,
+                "message": "No text to embed",
+                "user_id": user_id,
+                "paper_id": paper_id,
+                "text_length": text_length,
+                "num_chunks": 0,
+                "vectors_written": 0,
+            }
+
+        with status.stage(jobs.EMBEDDING):
+            if not VECTOR_BUCKET or generation_source is None:
+                print(
+                    "[ChunkAndEmbedLambda] ERROR: VECTOR_BUCKET and VECTOR_INDEX (or "
+                    "VECTOR_MANIFEST_BUCKET) env vars not set; cannot write to S3 Vectors."
+                )
+                raise RuntimeError("Missing VECTOR_BUCKET or VECTOR_INDEX env vars")
+
+            # Generations being written may use different models/dims:
+            # embed once per distinct (model_id, dims) pair. Each is written
+            # to the user's partition(s) of it (two while the user is moved).
+            routing = routing_source.get()
+            targets = [
+                {**t, "index": partitions.index_name(t["index"], partition)}
+                for t in generation_source.write_targets()
+                for partition in partitions.write_partitions(routing, user_id)
+            ]
+            models = sorted({(t["model_id"], t["dims"]) for t in targets})
+            batches = {t["index"]: [] for t in targets}
+
+            # 4. Embed each chunk with Titan and 5. write to S3 Vectors in batches
+            pacer = AdaptivePacer()
+            embedding_dim = 0
+            pending_upto = resume_from
+            for idx in range(resume_from, num_chunks):
+                if _remaining_s(context) < TIME_MARGIN_S and function_name:
+                    break
+
+                chunk = chunks[idx]
+                vectors = {
+                    (model_id, dims): call_with_retry(
+                        embed_text, chunk, model_id=model_id, dims=dims, pacer=pacer, deadline=deadline
+                    )
+                    for model_id, dims in models
+                }
+                embedding_dim = len(vectors[models[0]])
+                for target in targets:
+                    batches[target["index"]].append(
+                        {
+                            "key": keys.vector_key(user_id, paper_id, idx),
+                            "data": {"float32": vectors[(target["model_id"], target["dims"])]},
+                            "metadata": {
+                                "source_text": chunk,   # non-filterable key configured in index
+                                "user_id": user_id,
+                                "paper_id": paper_id,
+                                "chunk_index": idx,
+                            },
+                        }
+                    )
+                pending_upto = idx + 1
+
+                if pending_upto - written_upto >= PUT_BATCH_SIZE:
+                    _put_batches(batches, deadline)
+                    written_upto = pending_upto
+
+            if pending_upto > written_upto:
+                _put_batches(batches, deadline)
+                written_upto = pending_upto
 
-    # 4. Embed each chunk with Titan
-    embeddings = []
-    for idx, chunk in enumerate(chunks):
-        print(
-            f"[ChunkAndEmbedLambda] Embedding chunk {idx+1}/{num_chunks} "
-            f"(length={len(chunk)})"
-        )
-        embedding = embed_text(chunk)
-        emb_len = len(embedding)
         print(
-            f"[ChunkAndEmbedLambda] Got embedding of length {emb_len} "
-            f"for chunk {idx+1}"
+            f"[ChunkAndEmbedLambda] Embedded and wrote vectors {resume_from}..{written_upto - 1} "
+            f"(dim={embedding_dim}) to S3 Vectors bucket={VECTOR_BUCKET}, indexes={list(batches)}"
         )
-        embeddings.append(embedding)
-
-    # 5. Prepare vectors for S3 Vectors
-    vector_items = []
-    for idx, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-        vec_key = f"{user_id}:{paper_id}:{idx}:{uuid.uuid4()}"
-        vector_items.append(
-            {
-                "key": vec_key,
-                "data": {"float32": embedding},
-                "metadata": {
-                    "source_text": chunk,   # non-filterable key configured in index
-                    "user_id": user_id,
-                    "paper_id": paper_id,
-                    "chunk_index": idx,
-                },
+
+        if written_upto < num_chunks:
+            # Out of time: continue in a fresh invocation from the checkpoint.
+            lambda_client.invoke(
+                FunctionName=function_name,
+                InvocationType="Event",
+                Payload=json.dumps({**event, "resume_from": written_upto, "wait": False}),
+            )
+            print(f"[ChunkAndEmbedLambda] Continuing from chunk {written_upto} in a new invocation")
+            return {
+                "statusCode": 202,
+                "status": "continued",
+                "user_id": user_id,
+                "paper_id": paper_id,
+                "num_chunks": num_chunks,
+                "resume_from": written_upto,
             }
+    except Exception as e:
+        return handle_stage_failure(
+            e,
+            recorder=status,
+            event=event,
+            requeue_event={**event, "resume_from": written_upto},
+            lambda_client=lambda_client,
+            function_name=function_name,
+            max_attempts=MAX_ATTEMPTS,
         )
 
-    print(
-        f"[ChunkAndEmbedLambda] Writing {len(vector_items)} vectors to "
-        f"S3 Vectors bucket={VECTOR_BUCKET}, index={VECTOR_INDEX}"
-    )
-
-    # 6. Write to S3 Vectors
-    resp = s3v.put_vectors(
-        vectorBucketName=VECTOR_BUCKET,
-        indexName=VECTOR_INDEX,
-        vectors=vector_items,
-    )
-
-    print("[ChunkAndEmbedLambda] S3 Vectors put_vectors response:")
-    print(json.dumps(resp, default=str))
+    status.set_status(jobs.INDEXED, num_chunks=num_chunks)
 
-    # 7. Return basic info for testing
+    # 6. Return basic info for testing
     return {
         "statusCode": 200,
         "message": "Text loaded, chunked, embedded, and stored successfully",
@@ -189,6 +253,6 @@ def lambda_handler(event, context):
         "paper_id": paper_id,
         "text_length": text_length,
         "num_chunks": num_chunks,
-        "embedding_dim": len(embeddings[0]) if embeddings else 0,
-        "vectors_written": len(vector_items),
+        "embedding_dim": embedding_dim,
+        "vectors_written": written_upto - resume_from,
     }
\ No newline at end of file
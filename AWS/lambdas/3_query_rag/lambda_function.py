@@ -1,15 +1,24 @@
 import json
 import os
-import boto3
+from concurrent.futures import ThreadPoolExecutor
+
+from paper_common import artifacts, clients, embeddings, generations, keys, metrics, partitions, sessions
+from paper_common.retry import error_code
 
 """
 QueryRagLambda
 
 Responsibilities:
 1. Receive a natural-language question + user/paper context.
-2. Embed the question using the SAME Titan embeddings model as indexing.
-3. Query S3 Vectors (paper-vectors bucket, paper-chunks index) for top-K similar chunks.
-4. Return those chunks, and optionally:
+2. Resolve the active vector index generation (manifest, cached with a TTL).
+3. Embed the question using the SAME Titan model + dims as that generation.
+4. Query S3 Vectors (paper-vectors bucket, active generation) for top-K similar chunks: in the
+   user's partition (paper_common.partitions), or in every partition, merged, without a user.
+   With a conversation_id, the conversation's working set of earlier chunks is scored first and
+   the vector store is only queried when it does not answer well enough (paper_common.sessions).
+5. Optionally attach each hit's neighbouring chunks, read with ranged GETs
+   from the paper's text artifact in TEXT_BUCKET.
+6. Return those chunks, and optionally:
    - Invoke GeminiLambda with {question, chunks} to get a final answer.
 
 Expected event shape:
@@ -19,6 +28,8 @@ Expected event shape:
   "paper_ids": ["History_of_ML"],          # optional
   "question": "What is machine learning?",
   "top_k": 5,                              # optional, overrides default
+  "context_window": 1,                     # optional: also return chunks index-n .. index+n
+  "conversation_id": "chat-123",           # optional (with user_id): reuse this chat's retrieved chunks
   "invoke_gemini": true                    # optional (default: true if GEMINI_LAMBDA_ARN set)
 }
 
@@ -33,60 +44,67 @@ Response shape:
       "text": "...",
       "user_id": "dev-user",
       "paper_id": "History_of_ML",
-      "chunk_index": 0
+      "chunk_index": 0,
+      "context": [                         # only with context_window
+        {"chunk_index": 1, "text": "..."}
+      ]
     },
     ...
   ],
-  "answer": "...."                         # present only if GeminiLambda invoked
+  "answer": "....",                        # present only if GeminiLambda invoked
+  "index": "paper-chunks-g3",              # generation that served the query
+  "partitions": ["paper-chunks-g3-s1"],    # indexes queried
+  "retrieval": "vector_store"              # or "session" (answered from the conversation's working set)
 }
 """
 
-# ---- AWS clients ----
-bedrock = boto3.client("bedrock-runtime")
-s3v = boto3.client("s3vectors")
-lambda_client = boto3.client("lambda")
+# ---- AWS clients (built on first use, see paper_common.clients) ----
+bedrock = clients.lazy("bedrock-runtime")
+s3v = clients.lazy("s3vectors")
+s3 = clients.lazy("s3")
+lambda_client = clients.lazy("lambda")
 
 # ---- Environment variables ----
 VECTOR_BUCKET = os.environ["VECTOR_BUCKET"]          # e.g. "paper-vectors-rohan-dev"
-VECTOR_INDEX = os.environ["VECTOR_INDEX"]            # e.g. "paper-chunks"
+VECTOR_INDEX = os.environ.get("VECTOR_INDEX")        # e.g. "paper-chunks" (fallback when no manifest)
 BEDROCK_MODEL_ID = os.environ.get(
     "BEDROCK_MODEL_ID", "amazon.titan-embed-text-v2:0"
 )
+EMBED_DIMS = int(os.environ.get("EMBED_DIMS", "256"))
 DEFAULT_TOP_K = int(os.environ.get("DEFAULT_TOP_K", "2"))
+MAX_FAN_OUT = int(os.environ.get("MAX_FAN_OUT", "16"))      # parallel partition queries without a user_id
+TEXT_BUCKET = os.environ.get("TEXT_BUCKET", "paper-texts")   # text artifacts, for context_window
+MAX_CONTEXT_WINDOW = int(os.environ.get("MAX_CONTEXT_WINDOW", "3"))
+# Conversation working sets (conversation_id in the event). SESSION_TABLE is
+# optional: without it, a conversation is only continued by the same warm container.
+SESSION_TABLE = os.environ.get("SESSION_TABLE")
+SESSION_TTL = int(os.environ.get("SESSION_TTL", str(sessions.DEFAULT_TTL_SECONDS)))
+SESSION_MAX_CHUNKS = int(os.environ.get("SESSION_MAX_CHUNKS", str(sessions.DEFAULT_MAX_CHUNKS)))
+SESSION_MIN_SIMILARITY = float(os.environ.get("SESSION_MIN_SIMILARITY", "0.5"))
+SESSION_NEIGHBOURS = int(os.environ.get("SESSION_NEIGHBOURS", "1"))   # prefetched around each remote hit
 
 GEMINI_LAMBDA_ARN = os.environ.get("GEMINI_LAMBDA_ARN")  # optional
 
+# Active index generation (VECTOR_MANIFEST_BUCKET manifest, else VECTOR_INDEX).
+# Module-level so the TTL cache survives across warm invocations.
+generation_source = generations.from_env(s3, os.environ, BEDROCK_MODEL_ID, EMBED_DIMS)
+# User -> partition routing table (VECTOR_PARTITIONS_BUCKET), same TTL caching.
+routing_source = partitions.from_env(s3, os.environ)
+session_store = sessions.SessionStore(
+    clients.lazy_table(SESSION_TABLE) if SESSION_TABLE else None,
+    ttl_seconds=SESSION_TTL, max_chunks=SESSION_MAX_CHUNKS,
+)
+
+METRICS = metrics.MetricsLogger("QueryRagLambda")
 
-def embed_text(text: str, dims: int = 256) -> list[float]:
+
+def embed_text(text: str, model_id: str = BEDROCK_MODEL_ID, dims: int = EMBED_DIMS) -> list[float]:
     """
     Call Amazon Titan Text Embeddings V2 via Bedrock and return the vector.
-    Must match the embedding model+dims used in ChunkAndEmbedLambda.
+    Must match the embedding model+dims of the generation being queried.
     """
-    body = {
-        "inputText": text,
-        "dimensions": dims,
-        "normalize": True,
-    }
-
-    response = bedrock.invoke_model(
-        modelId=BEDROCK_MODEL_ID,
-        contentType="application/json",
-        accept="application/json",
-        body=json.dumps(body),
-    )
-
-    payload = json.loads(response["body"].read())
-
-    embedding = (
-        payload.get("embedding")
-        or payload.get("embeddings")
-        or payload.get("vector")
-    )
-
-    if embedding is None:
-        raise RuntimeError(f"Unexpected embedding response format: {payload}")
-
-    return embedding
+    with METRICS.timed("embed"):
+        return embeddings.embed_text(bedrock, text, model_id=model_id, dims=dims)
 
 
 def _build_filter(user_id: str | None, paper_ids: list[str] | None) -> dict | None:
@@ -114,60 +132,213 @@ def _build_filter(user_id: str | None, paper_ids: list[str] | None) -> dict | No
     return {"paper_id": {"$in": paper_ids}}
 
 
-def lambda_handler(event, context):
-    """
-    Main entrypoint for QueryRagLambda.
-    """
-    print("[QueryRagLambda] Event:", json.dumps(event))
-
-    question = event["question"]
-    user_id = event.get("user_id")
-    paper_ids = event.get("paper_ids")
-    top_k = int(event.get("top_k", DEFAULT_TOP_K))
-    invoke_gemini = bool(event.get("invoke_gemini", True))
-
-    # ---- 1. Embed the question ----
-    q_embedding = embed_text(question)
-
-    # ---- 2. Build filter (optional) ----
-    filter_obj = _build_filter(user_id, paper_ids)
-
-    # ---- 3. Query S3 Vectors ----
+def _query(index: str, q_embedding: list[float], top_k: int, filter_obj: dict | None) -> list[dict]:
     query_kwargs = {
         "vectorBucketName": VECTOR_BUCKET,
-        "indexName": VECTOR_INDEX,
+        "indexName": index,
         "queryVector": {"float32": q_embedding},
         "topK": top_k,
         "returnMetadata": True,
         "returnDistance": True,
     }
-
     # Only include filter if we actually built one (None will cause ValidationException)
     if filter_obj is not None:
         query_kwargs["filter"] = filter_obj
+    try:
+        return s3v.query_vectors(**query_kwargs).get("vectors", [])
+    except s3v.exceptions.NotFoundException:
+        # A partition whose index is not created for this generation yet is empty.
+        print(f"[QueryRagLambda] Index {index} not found; treating as empty")
+        return []
 
-    print(f"[QueryRagLambda] Querying S3 Vectors with topK={top_k}, filter={filter_obj}")
-    resp = s3v.query_vectors(**query_kwargs)
-
-    hits = resp.get("vectors", [])
-    print(f"[QueryRagLambda] Received {len(hits)} hits from S3 Vectors.")
 
-    # ---- 4. Convert hits into chunk objects ----
-    top_k_chunks: list[dict] = []
-    for rank, v in enumerate(hits, start=1):
+def _prefetch(working_set: sessions.WorkingSet, index: str, hits: list[dict], window: int) -> int:
+    """
+    Adds the hits and their neighbours (chunk_index +/- window) to the
+    working set, with embeddings, fetching the ones it does not hold yet in
+    GetVectors calls of up to 100 keys. Returns how many were fetched.
+    """
+    hit_keys, wanted = [], []
+    for hit in hits:
+        md = hit.get("metadata", {}) or {}
+        if md.get("chunk_index") is None:
+            continue
+        hit_index = int(md["chunk_index"])
+        hit_keys.append(keys.vector_key(working_set.user_id, md["paper_id"], hit_index))
+        for i in range(max(hit_index - window, 0), hit_index + window + 1):
+            key = keys.vector_key(working_set.user_id, md["paper_id"], i)
+            if key not in wanted and key not in working_set.chunks:
+                wanted.append(key)
+    fetched = {}
+    for start in range(0, len(wanted), 100):
+        response = s3v.get_vectors(
+            vectorBucketName=VECTOR_BUCKET, indexName=index, keys=wanted[start:start + 100],
+            returnData=True, returnMetadata=True,
+        )
+        fetched.update((v["key"], v) for v in response.get("vectors", []))
+    # Neighbours first, hits last: the hits are the most recently used.
+    for key in sorted(wanted, key=lambda k: k in hit_keys):
+        v = fetched.get(key)
+        if v is None:                       # past the paper's last chunk
+            continue
         md = v.get("metadata", {}) or {}
-        dist = v.get("distance", 0.0)
-        similarity = 1.0 - float(dist)
-
-        chunk = {
-            "rank": rank,
-            "similarity": similarity,
+        working_set.add({
+            "key": key,
+            "embedding": v["data"]["float32"],
             "text": md.get("source_text", ""),
-            "user_id": md.get("user_id"),
             "paper_id": md.get("paper_id"),
             "chunk_index": md.get("chunk_index"),
-        }
-        top_k_chunks.append(chunk)
+        })
+    for key in hit_keys:
+        if key in working_set.chunks and key not in fetched:
+            working_set.add(working_set.chunks[key])
+    return len(fetched)
+
+
+def _paper_context(paper: tuple[str, str], chunks: list[dict], window: int) -> int:
+    """Set ``context`` on ``chunks`` (hits in one paper); returns the ranged reads made."""
+    try:
+        with METRICS.timed("artifact_open"):
+            reader = artifacts.ArtifactReader.from_s3(s3, TEXT_BUCKET, keys.artifact_key(*paper))
+    except Exception as e:
+        if error_code(e) not in ("NoSuchKey", "404") and not isinstance(e, artifacts.ArtifactError):
+            raise
+        print(f"[QueryRagLambda] No text artifact for {paper}: {e}")
+        return 0
+    indices = {int(c["chunk_index"]) for c in chunks}
+    with METRICS.timed("artifact_read"):
+        texts = reader.chunks(i + d for i in indices for d in range(-window, window + 1))
+    for chunk in chunks:
+        index = int(chunk["chunk_index"])
+        chunk["context"] = [
+            {"chunk_index": i, "text": texts[i]}
+            for i in range(index - window, index + window + 1) if i != index and i in texts
+        ]
+    return reader.reads
+
+
+def _add_context(chunks: list[dict], window: int) -> None:
+    """
+    Set ``context`` on each chunk to its neighbours within ``window`` in the
+    same paper. Papers are read in parallel, each artifact opened once (one
+    ranged GET for its index, then one per run of pages the neighbours
+    span); papers without an artifact (indexed as .txt) get no context.
+    """
+    by_paper: dict[tuple[str, str], list[dict]] = {}
+    for chunk in chunks:
+        if chunk["chunk_index"] is not None:
+            by_paper.setdefault((chunk["user_id"], chunk["paper_id"]), []).append(chunk)
+    if not by_paper:
+        return
+    with ThreadPoolExecutor(max_workers=len(by_paper)) as pool:
+        reads = list(pool.map(lambda item: _paper_context(*item, window), by_paper.items()))
+    METRICS.put("artifact_reads", sum(reads))
+
+
+@METRICS.flush_after
+def lambda_handler(event, context):
+    """
+    Main entrypoint for QueryRagLambda.
+
+    A ``{"warmup": true}`` event builds the clients and loads the index
+    manifest and routing table, then returns.
+    """
+    if clients.is_warmup(event):
+        clients.warm_up(bedrock, s3v, lambda_client)
+        if generation_source is not None:
+            generation_source.active()
+        routing_source.get()
+        return {"warmup": True}
+    print("[QueryRagLambda] Event:", json.dumps(event))
+
+    question = event["question"]
+    user_id = event.get("user_id")
+    paper_ids = event.get("paper_ids")
+    top_k = int(event.get("top_k", DEFAULT_TOP_K))
+    invoke_gemini = bool(event.get("invoke_gemini", True))
+    context_window = min(max(int(event.get("context_window", 0)), 0), MAX_CONTEXT_WINDOW)
+
+    # ---- 1. Resolve the active generation and embed the question ----
+    if generation_source is None:
+        raise RuntimeError("Missing VECTOR_INDEX or VECTOR_MANIFEST_BUCKET env vars")
+    generation = generation_source.active()
+    q_embedding = embed_text(question, model_id=generation["model_id"], dims=generation["dims"])
+
+    # ---- 2. Pick the partition(s) and build the filter (optional) ----
+    routing = routing_source.get()
+    if user_id:
+        partition = partitions.read_partition(routing, user_id)
+        targets = [partitions.index_name(generation["index"], partition)]
+        # A dedicated partition holds only this user's vectors.
+        filter_obj = _build_filter(None if partitions.is_dedicated(partition) else user_id, paper_ids)
+    else:
+        targets = [partitions.index_name(generation["index"], p) for p in partitions.layout_partitions(routing["current"])]
+        filter_obj = _build_filter(None, paper_ids)
+
+    # ---- 3. Score the conversation's working set, else query S3 Vectors ----
+    conversation_id = event.get("conversation_id")
+    working_set = None
+    local_hits: list[tuple[float, dict]] = []
+    if conversation_id and user_id:
+        working_set = session_store.get(conversation_id, user_id, generation["index"])
+        local_hits = working_set.search(q_embedding, top_k, paper_ids)
+
+    top_k_chunks: list[dict] = []
+    if working_set is not None and len(local_hits) == top_k and local_hits[-1][0] >= SESSION_MIN_SIMILARITY:
+        retrieval = "session"
+        print(f"[QueryRagLambda] Answered from conversation {conversation_id} "
+              f"({len(working_set)} chunks, similarity >= {local_hits[-1][0]:.3f})")
+        for rank, (similarity, c) in enumerate(local_hits, start=1):
+            top_k_chunks.append({
+                "rank": rank,
+                "similarity": similarity,
+                "text": c["text"],
+                "user_id": user_id,
+                "paper_id": c["paper_id"],
+                "chunk_index": c["chunk_index"],
+            })
+    else:
+        retrieval = "vector_store"
+        print(f"[QueryRagLambda] Querying S3 Vectors indexes={targets} with topK={top_k}, filter={filter_obj}")
+        with METRICS.timed("query_vectors"):
+            if len(targets) == 1:
+                hits = _query(targets[0], q_embedding, top_k, filter_obj)
+            else:
+                with ThreadPoolExecutor(max_workers=min(len(targets), MAX_FAN_OUT)) as pool:
+                    results = pool.map(lambda index: _query(index, q_embedding, top_k, filter_obj), targets)
+                    hits = sorted((h for r in results for h in r), key=lambda h: h.get("distance", 0.0))[:top_k]
+        METRICS.put("query_partitions", len(targets))
+
+        METRICS.put("query_hits", len(hits))
+        print(f"[QueryRagLambda] Received {len(hits)} hits from S3 Vectors.")
+
+        # ---- 4. Convert hits into chunk objects ----
+        for rank, v in enumerate(hits, start=1):
+            md = v.get("metadata", {}) or {}
+            dist = v.get("distance", 0.0)
+            similarity = 1.0 - float(dist)
+
+            chunk = {
+                "rank": rank,
+                "similarity": similarity,
+                "text": md.get("source_text", ""),
+                "user_id": md.get("user_id"),
+                "paper_id": md.get("paper_id"),
+                "chunk_index": md.get("chunk_index"),
+            }
+            top_k_chunks.append(chunk)
+
+        if working_set is not None and hits:
+            with METRICS.timed("session_prefetch"):
+                METRICS.put("session_prefetched", _prefetch(working_set, targets[0], hits, SESSION_NEIGHBOURS))
+
+    if working_set is not None:
+        METRICS.put("session_hit", 1 if retrieval == "session" else 0)
+        with METRICS.timed("session_save"):
+            session_store.put(conversation_id, working_set)
+
+    if context_window:
+        _add_context(top_k_chunks, context_window)
 
     # If we don't want Gemini or ARN not set, just return chunks
     if not GEMINI_LAMBDA_ARN or not invoke_gemini:
@@ -176,6 +347,9 @@ def lambda_handler(event, context):
             "question": question,
             "top_k_chunks": top_k_chunks,
             "answer": None,
+            "index": generation["index"],
+            "partitions": targets,
+            "retrieval": retrieval,
         }
 
     # ---- 5. Invoke GeminiLambda for final answer ----
@@ -185,13 +359,15 @@ def lambda_handler(event, context):
     }
 
     print(f"[QueryRagLambda] Invoking GeminiLambda: {GEMINI_LAMBDA_ARN}")
-    gem_resp = lambda_client.invoke(
-        FunctionName=GEMINI_LAMBDA_ARN,
-        InvocationType="RequestResponse",
-        Payload=json.dumps(gemini_payload),
-    )
-
-    gem_body_raw = gem_resp["Payload"].read().decode("utf-8") or "{}"
+    gemini_body = json.dumps(gemini_payload)
+    METRICS.put("llm_request_bytes", len(gemini_body), metrics.BYTES)
+    with METRICS.timed("invoke_gemini"):
+        gem_resp = lambda_client.invoke(
+            FunctionName=GEMINI_LAMBDA_ARN,
+            InvocationType="RequestResponse",
+            Payload=gemini_body,
+        )
+        gem_body_raw = gem_resp["Payload"].read().decode("utf-8") or "{}"
     print(f"[QueryRagLambda] GeminiLambda raw response: {gem_body_raw}")
     gem_result = json.loads(gem_body_raw)
 
@@ -201,4 +377,7 @@ def lambda_handler(event, context):
         "question": question,
         "top_k_chunks": top_k_chunks,
         "answer": answer,
+        "index": generation["index"],
+        "partitions": targets,
+        "retrieval": retrieval,
     }
\ No newline at end of file
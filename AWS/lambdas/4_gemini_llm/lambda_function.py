@@ -1,18 +1,39 @@
 import json
 import os
-import boto3
+import time
 import urllib.request
 import urllib.error
 
-secrets_client = boto3.client("secretsmanager")
+from paper_common import clients, metrics
+
+# Only built when the cached API key is missing or expired.
+secrets_client = clients.lazy("secretsmanager")
 
 GEMINI_SECRET_NAME = os.environ.get("GEMINI_SECRET_NAME", "gemini/api-key/dev")
 GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-2.5-flash")
+# How long a warm container reuses the API key before re-reading the secret
+# (picks up rotations without a redeploy).
+GEMINI_SECRET_TTL = float(os.environ.get("GEMINI_SECRET_TTL", "900"))
+
+_api_key_cache = {"value": None, "loaded_at": 0.0}
+
+METRICS = metrics.MetricsLogger("GeminiLambda")
 
 
 def get_gemini_api_key() -> str:
+    """Gemini API key, cached for GEMINI_SECRET_TTL seconds per container."""
+    now = time.monotonic()
+    if _api_key_cache["value"] and now - _api_key_cache["loaded_at"] < GEMINI_SECRET_TTL:
+        return _api_key_cache["value"]
+    api_key = _load_gemini_api_key()
+    _api_key_cache.update(value=api_key, loaded_at=now)
+    return api_key
+
+
+def _load_gemini_api_key() -> str:
     """Load Gemini API key from Secrets Manager."""
-    resp = secrets_client.get_secret_value(SecretId=GEMINI_SECRET_NAME)
+    with METRICS.timed("get_secret"):
+        resp = secrets_client.get_secret_value(SecretId=GEMINI_SECRET_NAME)
     secret_str = resp["SecretString"]
 
     try:
@@ -32,6 +53,10 @@ def build_prompt(question: str, chunks: list[dict]) -> str:
     for c in chunks:
         rank = c.get("rank")
         text = c.get("text", "")
+        if c.get("context"):
+            # Neighbouring chunks (QueryRagLambda context_window), in reading order.
+            pieces = [(c.get("chunk_index") or 0, text)] + [(n["chunk_index"], n["text"]) for n in c["context"]]
+            text = "\n".join(t for _, t in sorted(pieces, key=lambda p: p[0]))
         context_blocks.append(f"[CHUNK {rank}]\n{text}")
 
     context_text = "\n\n".join(context_blocks) if context_blocks else "(no context provided)"
@@ -69,13 +94,16 @@ def call_gemini(prompt: str) -> str:
     }
 
     data = json.dumps(body).encode("utf-8")
+    METRICS.put("llm_request_bytes", len(data), metrics.BYTES)
     headers = {"Content-Type": "application/json"}
 
     req = urllib.request.Request(url, data=data, headers=headers, method="POST")
 
     try:
-        with urllib.request.urlopen(req, timeout=30) as resp:
-            resp_body = resp.read().decode("utf-8")
+        with METRICS.timed("gemini_generate"):
+            with urllib.request.urlopen(req, timeout=30) as resp:
+                resp_body = resp.read().decode("utf-8")
+        METRICS.put("llm_response_bytes", len(resp_body), metrics.BYTES)
     except urllib.error.HTTPError as e:
         err_body = e.read().decode("utf-8", errors="ignore")
         print("[GeminiLambda] HTTPError:", e.code, err_body)
@@ -103,7 +131,13 @@ def call_gemini(prompt: str) -> str:
         return "Failed to parse model response."
 
 
+@METRICS.flush_after
 def lambda_handler(event, context):
+    if clients.is_warmup(event):
+        # Fetch the secret now so the first real question skips Secrets Manager.
+        get_gemini_api_key()
+        return {"warmup": True}
+
     print("[GeminiLambda] Event:", json.dumps(event))
 
     question = event["question"]
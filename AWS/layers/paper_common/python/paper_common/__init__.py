@@ -0,0 +1,7 @@
+"""
+Code shared by the indexing Lambdas and the FastAPI backend.
+
+Packaged as a Lambda layer (``AWS/layers/paper_common``) and installed in
+editable mode for the backend, so both sides agree on key layouts, job
+states and the chunker.
+"""
@@ -0,0 +1,298 @@
+"""
+Compressed, chunk-addressable text artifacts.
+
+IndexPdfLambda stores a paper's extracted text as one artifact
+(``keys.artifact_key``) instead of a plain ``.txt``:
+
+    [page 0][page 1] ... [page n-1][index][trailer]
+
+* Every page is compressed on its own - zstd when a zstd module is
+  available (``compression.zstd`` on Python 3.14+, else the ``zstandard``
+  package), zlib otherwise - so single pages can be fetched with ranged
+  GETs and decoded.
+* The index (zlib-compressed JSON) holds each page's offset and length, the
+  codec, and the chunk table: for each chunk ``chunking.chunk_text`` makes
+  at the recorded ``max_chars``, the (page, word) where it starts and ends.
+  chunk_text joins whitespace-separated words with single spaces and pages
+  are separated by whitespace, so a chunk is rebuilt exactly from the pages
+  it spans; chunk text is not stored twice.
+* The 16-byte trailer is the index length and a magic number. A reader
+  fetches the tail of the object once (``TAIL_BYTES`` usually covers the
+  index too), then one ranged GET per run of adjacent pages it needs.
+
+``ArtifactWriter`` streams: each page is compressed and written as it is
+added, and chunk boundaries are tracked as words go by.
+``ArtifactReader`` reads from bytes or from S3.
+"""
+import json
+import struct
+import zlib
+from typing import Callable, Iterable
+
+from .chunking import DEFAULT_MAX_CHARS, chunk_text
+
+MAGIC = b"PTXTART1"
+TRAILER = struct.Struct("<Q8s")         # index length, magic
+VERSION = 1
+TAIL_BYTES = 64 * 1024                  # first ranged read: trailer + index, usually
+CONTENT_TYPE = "application/x-paper-text"
+
+
+class ArtifactError(Exception):
+    """Not an artifact, an unknown version, or a codec that is not installed."""
+
+
+# ---- codecs ----
+
+def _zstd() -> tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]] | None:
+    try:
+        from compression import zstd            # Python 3.14+
+        return (lambda data: zstd.compress(data, level=9)), zstd.decompress
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    # Frames carry their content size, so one-shot decompression works.
+    return zstandard.ZstdCompressor(level=9).compress, zstandard.ZstdDecompressor().decompress
+
+
+_codecs: dict[str, tuple[Callable, Callable] | None] = {"zlib": (lambda data: zlib.compress(data, 6), zlib.decompress)}
+
+
+def _codec(name: str) -> tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]:
+    if name not in _codecs:
+        _codecs[name] = _zstd() if name == "zstd" else None
+    if _codecs[name] is None:
+        raise ArtifactError(f"codec {name!r} is not available (zstd needs the zstandard package)")
+    return _codecs[name]
+
+
+def default_codec() -> str:
+    try:
+        _codec("zstd")
+        return "zstd"
+    except ArtifactError:
+        return "zlib"
+
+
+# ---- writing ----
+
+class ArtifactWriter:
+    """
+    Writes an artifact to ``out`` (anything with ``write(bytes)``), one
+    ``add_page`` at a time; ``close`` writes the index and trailer.
+    """
+
+    def __init__(self, out, codec: str | None = None, max_chars: int = DEFAULT_MAX_CHARS):
+        self.out = out
+        self.codec = codec or default_codec()
+        self.max_chars = max_chars
+        self._compress = _codec(self.codec)[0]
+        self._offset = 0
+        self._pages: list[list[int]] = []       # [offset, length, chars]
+        self._chunks: list[list[int]] = []      # [first page, first word, last page, end word]
+        self._start: tuple[int, int] | None = None
+        self._end: tuple[int, int] = (0, 0)
+        self._chunk_len = 0
+
+    def add_page(self, text: str) -> None:
+        page = len(self._pages)
+        data = self._compress(text.encode("utf-8"))
+        self.out.write(data)
+        self._pages.append([self._offset, len(data), len(text)])
+        self._offset += len(data)
+        # Same decisions as chunking.chunk_text, word by word.
+        for w, word in enumerate(text.split()):
+            extra = len(word) if self._start is None else len(word) + 1
+            if self._start is not None and self._chunk_len + extra > self.max_chars:
+                self._chunks.append([*self._start, *self._end])
+                self._start, self._chunk_len = (page, w), len(word)
+            else:
+                if self._start is None:
+                    self._start = (page, w)
+                self._chunk_len += extra
+            self._end = (page, w + 1)
+
+    def close(self) -> dict:
+        """Finish the artifact; returns its page / chunk counts and size."""
+        if self._start is not None:
+            self._chunks.append([*self._start, *self._end])
+            self._start = None
+        index = zlib.compress(json.dumps({
+            "version": VERSION,
+            "codec": self.codec,
+            "max_chars": self.max_chars,
+            "pages": self._pages,
+            "chunks": self._chunks,
+        }, separators=(",", ":")).encode("utf-8"))
+        self.out.write(index)
+        self.out.write(TRAILER.pack(len(index), MAGIC))
+        size = self._offset + len(index) + TRAILER.size
+        return {"pages": len(self._pages), "chunks": len(self._chunks), "bytes": size, "codec": self.codec}
+
+
+def write_artifact(pages: Iterable[str], codec: str | None = None, max_chars: int = DEFAULT_MAX_CHARS) -> bytes:
+    """The artifact of ``pages``, in memory."""
+    import io
+
+    out = io.BytesIO()
+    writer = ArtifactWriter(out, codec=codec, max_chars=max_chars)
+    for page in pages:
+        writer.add_page(page)
+    writer.close()
+    return out.getvalue()
+
+
+def is_artifact(data: bytes) -> bool:
+    return len(data) >= TRAILER.size and data[-len(MAGIC):] == MAGIC
+
+
+# ---- reading ----
+
+class ArtifactReader:
+    """
+    Random access to an artifact's pages and chunks. ``read(start, end)``
+    returns bytes ``[start, end)`` of the artifact; ``tail`` is its last
+    bytes, already fetched (the whole artifact when it is that small).
+    Decoded pages are kept for the reader's lifetime.
+    """
+
+    def __init__(self, read: Callable[[int, int], bytes], size: int, tail: bytes):
+        self._read = read
+        self.size = size
+        self._tail = tail
+        self._tail_start = size - len(tail)
+        self.reads = 0                          # ranged reads after the tail
+        self._decoded: dict[int, str] = {}
+
+        if not is_artifact(tail):
+            raise ArtifactError("not a text artifact (bad trailer)")
+        index_len, _ = TRAILER.unpack(tail[-TRAILER.size:])
+        index_start = size - TRAILER.size - index_len
+        index = json.loads(zlib.decompress(self._bytes(index_start, size - TRAILER.size)))
+        if index.get("version") != VERSION:
+            raise ArtifactError(f"unsupported artifact version {index.get('version')}")
+        self.codec: str = index["codec"]
+        self.max_chars: int = index["max_chars"]
+        self._pages: list[list[int]] = index["pages"]
+        self._chunks: list[list[int]] = index["chunks"]
+        self._decompress = _codec(self.codec)[1]
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "ArtifactReader":
+        return cls(lambda start, end: data[start:end], len(data), data)
+
+    @classmethod
+    def from_s3(cls, s3, bucket: str, key: str, tail_bytes: int = TAIL_BYTES,
+                get_object: Callable[..., dict] | None = None) -> "ArtifactReader":
+        """
+        Reader over an S3 object. ``get_object`` defaults to
+        ``s3.get_object``; pass a wrapper to add retries or timing.
+        """
+        get_object = get_object or s3.get_object
+        response = get_object(Bucket=bucket, Key=key, Range=f"bytes=-{tail_bytes}")
+        tail = response["Body"].read()
+        content_range = response.get("ContentRange")        # "bytes 1000-66535/66536"
+        size = int(content_range.rsplit("/", 1)[1]) if content_range else len(tail)
+
+        def read(start: int, end: int) -> bytes:
+            return get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end - 1}")["Body"].read()
+        return cls(read, size, tail)
+
+    def _bytes(self, start: int, end: int) -> bytes:
+        if start >= self._tail_start:
+            return self._tail[start - self._tail_start:end - self._tail_start]
+        self.reads += 1
+        return self._read(start, end)
+
+    # ---- pages ----
+
+    @property
+    def num_pages(self) -> int:
+        return len(self._pages)
+
+    @property
+    def text_length(self) -> int:
+        """Characters of ``text()``."""
+        return sum(chars for _, _, chars in self._pages) + max(0, len(self._pages) - 1)
+
+    def _load(self, pages: Iterable[int]) -> None:
+        """Decodes ``pages``, one read per run of adjacent pages not decoded yet."""
+        missing = sorted(p for p in set(pages) if p not in self._decoded)
+        runs: list[list[int]] = []
+        for p in missing:
+            if runs and runs[-1][1] == p - 1:
+                runs[-1][1] = p
+            else:
+                runs.append([p, p])
+        for first, last in runs:
+            start = self._pages[first][0]
+            data = self._bytes(start, self._pages[last][0] + self._pages[last][1])
+            for p in range(first, last + 1):
+                offset, length, _ = self._pages[p]
+                self._decoded[p] = self._decompress(data[offset - start:offset - start + length]).decode("utf-8")
+
+    def pages(self, first: int = 0, last: int | None = None) -> list[str]:
+        """Pages ``first`` .. ``last`` (inclusive; default: to the end)."""
+        last = self.num_pages - 1 if last is None else min(last, self.num_pages - 1)
+        self._load(range(first, last + 1))
+        return [self._decoded[p] for p in range(first, last + 1)]
+
+    def page(self, number: int) -> str:
+        return self.pages(number, number)[0]
+
+    def text(self) -> str:
+        """The whole text, as the plain ``.txt`` used to hold it."""
+        return "\n".join(self.pages())
+
+    # ---- chunks ----
+
+    @property
+    def num_chunks(self) -> int:
+        return len(self._chunks)
+
+    def chunks(self, indices: Iterable[int] | None = None) -> dict[int, str]:
+        """Chunk index -> text for ``indices`` (all chunks by default; out-of-range ones are skipped)."""
+        wanted = range(self.num_chunks) if indices is None else sorted(
+            {i for i in indices if 0 <= i < self.num_chunks}
+        )
+        self._load(p for i in wanted for p in range(self._chunks[i][0], self._chunks[i][2] + 1))
+        words: dict[int, list[str]] = {}
+        out = {}
+        for i in wanted:
+            first_page, first_word, last_page, end_word = self._chunks[i]
+            for p in range(first_page, last_page + 1):
+                if p not in words:
+                    words[p] = self._decoded[p].split()
+            if first_page == last_page:
+                span = words[first_page][first_word:end_word]
+            else:
+                span = words[first_page][first_word:]
+                for p in range(first_page + 1, last_page):
+                    span += words[p]
+                span += words[last_page][:end_word]
+            out[i] = " ".join(span)
+        return out
+
+    def chunk(self, index: int) -> str:
+        return self.chunks([index])[index]
+
+    def neighbours(self, index: int, window: int) -> dict[int, str]:
+        """Chunks ``index - window`` .. ``index + window``."""
+        return self.chunks(range(index - window, index + window + 1))
+
+
+def load_chunks(data: bytes, max_chars: int = DEFAULT_MAX_CHARS) -> tuple[list[str], int]:
+    """
+    (chunks, text length) of a stored text, artifact or legacy ``.txt``.
+    An artifact chunked at ``max_chars`` is not re-split.
+    """
+    if not is_artifact(data):
+        text = data.decode("utf-8", errors="replace")
+        return chunk_text(text, max_chars=max_chars), len(text)
+    reader = ArtifactReader.from_bytes(data)
+    if reader.max_chars == max_chars:
+        return list(reader.chunks().values()), reader.text_length
+    return chunk_text(reader.text(), max_chars=max_chars), reader.text_length
@@ -0,0 +1,38 @@
+"""
+Text chunker used at indexing time.
+
+Lives in the shared layer so every code path that produces vectors
+(ChunkAndEmbedLambda, the backend's local runner) splits text identically.
+"""
+
+DEFAULT_MAX_CHARS = 1000
+
+
+def chunk_text(text: str, max_chars: int = DEFAULT_MAX_CHARS) -> list[str]:
+    """
+    Split text into chunks of ~max_chars characters, without breaking words.
+    """
+    words = text.split()
+    chunks = []
+    current_words = []
+    current_len = 0
+
+    for word in words:
+        extra_len = len(word) if current_len == 0 else len(word) + 1
+
+        if current_len + extra_len > max_chars and current_words:
+            chunks.append(" ".join(current_words))
+            current_words = [word]
+            current_len = len(word)
+        else:
+            if current_len == 0:
+                current_words.append(word)
+                current_len = len(word)
+            else:
+                current_words.append(word)
+                current_len += len(word) + 1
+
+    if current_words:
+        chunks.append(" ".join(current_words))
+
+    return chunks
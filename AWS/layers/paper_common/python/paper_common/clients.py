@@ -0,0 +1,131 @@
+"""
+On-first-use AWS clients shared by the Lambdas, the API and the CLIs.
+
+Importing boto3 and building a client costs tens of milliseconds each, and
+most invocations only touch some of a module's clients. Modules therefore
+declare their clients as lazy proxies:
+
+    s3 = clients.lazy("s3")
+    metadata_table = clients.lazy_table(METADATA_TABLE) if METADATA_TABLE else None
+
+The proxy imports boto3 and builds the client on the first attribute access
+(``s3.get_object``, ``s3.exceptions``), and clients are cached per process
+by (service, settings), so every module asking for the same client shares
+one instance and one connection pool. ``warm_up`` builds them ahead of the
+first real request, e.g. for a scheduled ``{"warmup": true}`` ping.
+"""
+import json
+import threading
+
+_cache: dict = {}
+_lock = threading.Lock()
+
+
+def _key(kind: str, name: str, kwargs: dict) -> tuple:
+    return (kind, name, json.dumps(kwargs, sort_keys=True, default=str))
+
+
+def _build(kind: str, name: str, kwargs: dict):
+    import boto3
+
+    kwargs = dict(kwargs)
+    if isinstance(kwargs.get("config"), dict):
+        from botocore.config import Config
+        kwargs["config"] = Config(**kwargs["config"])
+    if kind == "client":
+        return boto3.client(name, **kwargs)
+    if kind == "table":
+        return boto3.resource("dynamodb", **kwargs).Table(name)
+    if kind == "resource":
+        return boto3.resource(name, **kwargs)
+    raise ValueError(f"unknown client kind {kind!r}")
+
+
+def get(kind: str, name: str, **kwargs):
+    """The shared client for (kind, name, kwargs), built on first call."""
+    key = _key(kind, name, kwargs)
+    client = _cache.get(key)
+    if client is None:
+        with _lock:
+            client = _cache.get(key)
+            if client is None:
+                client = _cache[key] = _build(kind, name, kwargs)
+    return client
+
+
+class LazyClient:
+    """
+    Stands in for a client until it is first used; ``factory()`` builds it.
+    Also usable for non-AWS clients (Semantic Scholar, arXiv).
+    """
+
+    def __init__(self, factory, label: str):
+        self._factory = factory
+        self._label = label
+        self._client = None
+
+    def _resolve(self):
+        if self._client is None:
+            self._client = self._factory()
+        return self._client
+
+    def __getattr__(self, attr):
+        return getattr(self._resolve(), attr)
+
+    @property
+    def built(self) -> bool:
+        return self._client is not None
+
+    def available(self) -> bool:
+        """Builds the client if needed; False when that fails (no boto3, bad region)."""
+        try:
+            self._resolve()
+        except Exception as e:
+            print(f"Failed to build {self._label} client: {e}")
+            return False
+        return True
+
+    def __repr__(self) -> str:
+        state = "built" if self._client is not None else "not built"
+        return f"<LazyClient {self._label} ({state})>"
+
+
+def lazy(service: str, **kwargs) -> LazyClient:
+    """
+    A boto3 client for ``service`` built on first use. ``config`` may be a
+    dict of botocore Config options, so callers need not import botocore.
+    """
+    return LazyClient(lambda: get("client", service, **kwargs), service)
+
+
+def lazy_table(table_name: str, **kwargs) -> LazyClient:
+    """A DynamoDB Table resource built on first use."""
+    return LazyClient(lambda: get("table", table_name, **kwargs), f"dynamodb:{table_name}")
+
+
+def lazy_resource(service: str, **kwargs) -> LazyClient:
+    """A boto3 service resource (e.g. DynamoDB, for ``batch_get_item``) built on first use."""
+    return LazyClient(lambda: get("resource", service, **kwargs), f"resource:{service}")
+
+
+def available(client) -> bool:
+    """
+    Whether ``client`` can be used: False for None or a lazy client that
+    fails to build. (A proxy is always truthy, so ``if not client`` cannot
+    tell.)
+    """
+    if isinstance(client, LazyClient):
+        return client.available()
+    return client is not None
+
+
+def warm_up(*proxies) -> None:
+    """Build the given lazy clients now (skips None and non-lazy objects)."""
+    for proxy in proxies:
+        if isinstance(proxy, LazyClient):
+            proxy._resolve()
+
+
+def is_warmup(event) -> bool:
+    """True for the scheduled keep-warm ping ``{"warmup": true}``."""
+    return isinstance(event, dict) and bool(event.get("warmup"))
@@ -0,0 +1,46 @@
+"""
+Titan embedding call shared by ChunkAndEmbedLambda and the backfill tool.
+
+Indexing and re-indexing must use the same model and dimensions, so both
+read BEDROCK_MODEL_ID / EMBED_DIMS and call through here.
+"""
+import json
+import os
+
+DEFAULT_MODEL_ID = os.environ.get("BEDROCK_MODEL_ID", "amazon.titan-embed-text-v2:0")
+DEFAULT_DIMS = int(os.environ.get("EMBED_DIMS", "256"))
+
+
+def embed_text(bedrock, text: str, model_id: str = DEFAULT_MODEL_ID, dims: int = DEFAULT_DIMS) -> list[float]:
+    """
+    Call Amazon Titan Text Embeddings (v2) on a single text and return the vector.
+    """
+    body = {
+        "inputText": text,
+        "dimensions": dims,
+        "normalize": True,
+    }
+
+    response = bedrock.invoke_model(
+        modelId=model_id,
+        contentType="application/json",
+        accept="application/json",
+        body=json.dumps(body),
+    )
+
+    payload = json.loads(response["body"].read())
+    embedding = (
+        payload.get("embedding")
+        or payload.get("embeddings")
+        or payload.get("vector")
+    )
+
+    if embedding is None:
+        raise RuntimeError(f"Unexpected embedding response format: {payload}")
+
+    return embedding
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough Titan token count (~4 characters per token) for rate budgeting."""
+    return max(1, len(text) // 4)
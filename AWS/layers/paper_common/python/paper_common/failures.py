@@ -0,0 +1,94 @@
+"""
+Dead-letter handling for the indexing Lambdas.
+
+When a stage raises, ``handle_stage_failure`` decides what happens to the
+event instead of letting it vanish with a fire-and-forget invoke:
+
+* transient errors (throttling, timeouts) are re-queued by invoking the
+  same Lambda asynchronously with ``attempt + 1`` - ChunkAndEmbedLambda
+  also passes a ``resume_from`` checkpoint so finished chunks are kept;
+* permanent errors, and transient ones that used up ``max_attempts``, are
+  *parked*: the item is marked ``failed`` and a ``failure`` map with the
+  diagnostics and the original event is stored on it, so
+  ``AWS/utils/replay_failed.py`` can re-drive it later.
+
+Handlers return the outcome instead of raising, so Lambda's own async
+retries do not duplicate the work. Synchronous callers must therefore
+check the result: ``"status": "failed"`` is a parked failure, and a 202
+(``requeued``) means the work is still in flight, not done.
+"""
+import json
+import traceback
+
+from . import jobs
+from .retry import TRANSIENT, classify_error
+
+DEFAULT_MAX_ATTEMPTS = 4
+
+
+def describe_failure(exc: BaseException, stage: str, event: dict, attempts: int,
+                     function_name: str | None = None) -> dict:
+    return {
+        "stage": stage,
+        "classification": classify_error(exc),
+        "error_type": type(exc).__name__,
+        "message": str(exc)[:1000],
+        "traceback": "".join(traceback.format_exception(exc))[-4000:],
+        "attempts": attempts,
+        "function": function_name,
+        "event": json.dumps(event, default=str),
+        "failed_at": jobs.utc_now(),
+    }
+
+
+def park_failure(recorder: jobs.StatusRecorder, exc: BaseException, stage: str, event: dict,
+                 attempts: int, function_name: str | None = None) -> dict:
+    """Mark the document failed and keep everything needed to replay it."""
+    failure = describe_failure(exc, stage, event, attempts, function_name)
+    # Also log it: items the API never registered have nowhere else to go.
+    print(f"[DeadLetter] {json.dumps({'document_id': recorder.document_id, **failure})}")
+    recorder.set_status(
+        jobs.FAILED,
+        failed_stage=stage,
+        error=f"{failure['error_type']}: {failure['message']}",
+        failure=failure,
+    )
+    return failure
+
+
+def handle_stage_failure(exc: BaseException, *, recorder: jobs.StatusRecorder, event: dict,
+                         lambda_client, function_name: str | None,
+                         max_attempts: int = DEFAULT_MAX_ATTEMPTS, requeue_event: dict | None = None) -> dict:
+    """
+    Re-queue or park a failed event. Returns a small result dict for the
+    handler to return. ``requeue_event`` overrides the payload used for a
+    retry or stored for replay (e.g. with a resume checkpoint added).
+    """
+    stage = getattr(exc, "pipeline_stage", None) or "unknown"
+    attempt = int(event.get("attempt", 0)) + 1
+    classification = classify_error(exc)
+
+    if classification == TRANSIENT and attempt < max_attempts and function_name:
+        payload = {**(requeue_event or event), "attempt": attempt, "wait": False}
+        try:
+            lambda_client.invoke(
+                FunctionName=function_name,
+                InvocationType="Event",
+                Payload=json.dumps(payload),
+            )
+        except Exception as invoke_error:
+            print(f"[DeadLetter] Re-queue failed ({invoke_error}); parking instead")
+        else:
+            print(f"[DeadLetter] Re-queued {recorder.document_id} at stage={stage}, attempt={attempt}: {exc}")
+            recorder.set_status(stage, retry_attempt=attempt, last_error=f"{type(exc).__name__}: {exc}"[:1000])
+            return {"statusCode": 202, "status": "requeued", "stage": stage, "attempt": attempt}
+
+    failure = park_failure(recorder, exc, stage, requeue_event or event, attempt, function_name)
+    return {
+        "statusCode": 500,
+        "status": jobs.FAILED,
+        "stage": stage,
+        "classification": failure["classification"],
+        "error": failure["message"],
+    }
+
@@ -0,0 +1,253 @@
+"""
+Versioned vector index generations (blue/green re-indexing).
+
+Instead of one VECTOR_INDEX shared by writers and readers, a small JSON
+manifest in S3 names the generations:
+
+    {
+      "version": 12,
+      "active": "paper-chunks-g3",          # what QueryRagLambda reads
+      "staging": "paper-chunks-g4",         # being (re)built, not yet read
+      "history": ["paper-chunks-g2"],       # previous actives, newest first
+      "generations": {
+        "paper-chunks-g3": {"state": "active", "model_id": "...", "dims": 256, ...},
+        ...
+      }
+    }
+
+Readers resolve ``active`` through a TTL cache, so a cutover reaches every
+warm Lambda within VECTOR_MANIFEST_TTL seconds. Live writers
+(ChunkAndEmbedLambda) write to every *write target* - active, staging and
+the most recent previous generation - so a backfill never misses new
+uploads and a rollback never loses them. Each generation carries its own
+model and dimensions, so writers embed once per distinct model.
+
+Every change is a compare-and-swap on the object's ETag (S3 conditional
+writes), which makes cutover and rollback atomic: concurrent operators
+retry against the new version instead of overwriting each other.
+"""
+import json
+import time
+
+from . import jobs
+from .embeddings import DEFAULT_DIMS, DEFAULT_MODEL_ID
+
+DEFAULT_MANIFEST_KEY = "manifests/vector-index.json"
+
+ACTIVE = "active"
+STAGING = "staging"
+RETIRED = "retired"
+ROLLED_BACK = "rolled_back"
+DELETED = "deleted"
+
+
+class ManifestConflict(Exception):
+    """The manifest changed underneath a compare-and-swap too many times."""
+
+
+class GenerationError(Exception):
+    """An operation is not valid for the manifest's current state."""
+
+
+def empty_manifest(active: str | None = None, model_id: str = DEFAULT_MODEL_ID, dims: int = DEFAULT_DIMS) -> dict:
+    manifest = {"version": 0, "active": active, "staging": None, "history": [], "generations": {}}
+    if active:
+        manifest["generations"][active] = {
+            "state": ACTIVE, "model_id": model_id, "dims": dims, "created_at": jobs.utc_now(),
+        }
+    return manifest
+
+
+def undeleted(manifest: dict) -> list[str]:
+    """Every generation whose index still exists (and may hold vectors)."""
+    return [name for name, info in manifest["generations"].items() if info.get("state") != DELETED]
+
+
+def generation_info(manifest: dict, name: str) -> dict:
+    info = manifest["generations"].get(name, {})
+    return {
+        "index": name,
+        "model_id": info.get("model_id", DEFAULT_MODEL_ID),
+        "dims": int(info.get("dims", DEFAULT_DIMS)),
+    }
+
+
+def write_targets(manifest: dict) -> list[dict]:
+    """Indexes live writers must write to, with the model/dims each expects."""
+    names = [manifest.get("active"), manifest.get("staging")]
+    if manifest.get("history"):
+        names.append(manifest["history"][0])
+    seen = []
+    for name in names:
+        if name and name not in seen and manifest["generations"].get(name, {}).get("state") != DELETED:
+            seen.append(name)
+    return [generation_info(manifest, name) for name in seen]
+
+
+# ---- pure state transitions (mutate the manifest dict in place) ----
+
+def create_staging(manifest: dict, name: str, model_id: str, dims: int) -> None:
+    if manifest.get("staging") and manifest["staging"] != name:
+        raise GenerationError(f"staging generation {manifest['staging']} already exists")
+    if name == manifest.get("active"):
+        raise GenerationError(f"{name} is the active generation")
+    manifest["staging"] = name
+    manifest["generations"][name] = {
+        "state": STAGING, "model_id": model_id, "dims": dims, "created_at": jobs.utc_now(),
+    }
+
+
+def cutover(manifest: dict) -> None:
+    """Promote staging to active; the old active becomes the rollback target."""
+    staging = manifest.get("staging")
+    if not staging:
+        raise GenerationError("no staging generation to cut over to")
+    old = manifest.get("active")
+    if old:
+        manifest["generations"][old]["state"] = RETIRED
+        manifest["generations"][old]["retired_at"] = jobs.utc_now()
+        manifest["history"] = [old] + [h for h in manifest["history"] if h != old]
+    manifest["active"] = staging
+    manifest["staging"] = None
+    manifest["generations"][staging]["state"] = ACTIVE
+    manifest["generations"][staging]["activated_at"] = jobs.utc_now()
+
+
+def rollback(manifest: dict) -> None:
+    """Re-activate the most recent previous generation."""
+    if not manifest.get("history"):
+        raise GenerationError("no previous generation to roll back to")
+    previous = manifest["history"].pop(0)
+    current = manifest.get("active")
+    if current:
+        manifest["generations"][current]["state"] = ROLLED_BACK
+        manifest["generations"][current]["retired_at"] = jobs.utc_now()
+        # Newest first, so a second rollback rolls forward again.
+        manifest["history"].insert(0, current)
+    manifest["active"] = previous
+    manifest["generations"][previous]["state"] = ACTIVE
+    manifest["generations"][previous]["activated_at"] = jobs.utc_now()
+
+
+def collectable(manifest: dict, keep: int = 1) -> list[str]:
+    """Generations that can be deleted: everything past the newest ``keep`` previous ones."""
+    in_use = {manifest.get("active"), manifest.get("staging")} | set(manifest["history"][:keep])
+    return [
+        name for name, info in manifest["generations"].items()
+        if name not in in_use and info.get("state") != DELETED
+    ]
+
+
+def mark_deleted(manifest: dict, names: list[str]) -> None:
+    for name in names:
+        manifest["generations"][name]["state"] = DELETED
+        manifest["generations"][name]["deleted_at"] = jobs.utc_now()
+    manifest["history"] = [h for h in manifest["history"] if h not in names]
+
+
+class StaticGenerations:
+    """A single fixed index; used when no manifest is configured."""
+
+    def __init__(self, index: str, model_id: str = DEFAULT_MODEL_ID, dims: int = DEFAULT_DIMS):
+        self.info = {"index": index, "model_id": model_id, "dims": dims}
+
+    def active(self) -> dict:
+        return dict(self.info)
+
+    def write_targets(self) -> list[dict]:
+        return [dict(self.info)]
+
+
+def from_env(s3, env: dict, model_id: str = DEFAULT_MODEL_ID, dims: int = DEFAULT_DIMS):
+    """
+    ManifestStore when VECTOR_MANIFEST_BUCKET is set, else the plain
+    VECTOR_INDEX (with the given model/dims) as the only generation.
+    """
+    index = env.get("VECTOR_INDEX")
+    bucket = env.get("VECTOR_MANIFEST_BUCKET")
+    if not bucket:
+        return StaticGenerations(index, model_id, dims) if index else None
+    return ManifestStore(
+        s3,
+        bucket,
+        env.get("VECTOR_MANIFEST_KEY", DEFAULT_MANIFEST_KEY),
+        ttl_seconds=float(env.get("VECTOR_MANIFEST_TTL", "30")),
+        fallback_index=index,
+    )
+
+
+class ManifestStore:
+    """
+    Loads and updates the manifest object, with a TTL cache for readers.
+
+    ``fallback_index`` (normally the VECTOR_INDEX env var) is used as the
+    single active generation when the manifest does not exist yet, so the
+    Lambdas keep working before anyone has run a cutover.
+    """
+
+    def __init__(self, s3, bucket: str, key: str = DEFAULT_MANIFEST_KEY, ttl_seconds: float = 30.0,
+                 fallback_index: str | None = None):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.ttl_seconds = ttl_seconds
+        self.fallback_index = fallback_index
+        self._cached: dict | None = None
+        self._cached_at = 0.0
+
+    def load(self) -> tuple[dict, str | None]:
+        """Return (manifest, etag); etag is None when the object does not exist."""
+        try:
+            obj = self.s3.get_object(Bucket=self.bucket, Key=self.key)
+        except self.s3.exceptions.NoSuchKey:
+            return self.empty(), None
+        return json.loads(obj["Body"].read()), obj["ETag"]
+
+    def empty(self) -> dict:
+        """What ``load`` returns while the object does not exist."""
+        return empty_manifest(self.fallback_index)
+
+    def get(self) -> dict:
+        """The manifest, served from cache for up to ``ttl_seconds``."""
+        now = time.monotonic()
+        if self._cached is None or now - self._cached_at > self.ttl_seconds:
+            self._cached, _ = self.load()
+            self._cached_at = now
+        return self._cached
+
+    def active(self) -> dict:
+        manifest = self.get()
+        if not manifest.get("active"):
+            raise GenerationError("manifest has no active generation")
+        return generation_info(manifest, manifest["active"])
+
+    def write_targets(self) -> list[dict]:
+        return write_targets(self.get())
+
+    def update(self, mutate, attempts: int = 5) -> dict:
+        """
+        Apply ``mutate(manifest)`` as a compare-and-swap. Retries from a fresh
+        read when another writer got there first.
+        """
+        for _ in range(attempts):
+            manifest, etag = self.load()
+            mutate(manifest)
+            manifest["version"] = int(manifest.get("version", 0)) + 1
+            manifest["updated_at"] = jobs.utc_now()
+            condition = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+            try:
+                self.s3.put_object(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    Body=json.dumps(manifest, indent=2).encode("utf-8"),
+                    ContentType="application/json",
+                    **condition,
+                )
+            except Exception as e:
+                code = getattr(e, "response", {}).get("Error", {}).get("Code")
+                if code in ("PreconditionFailed", "ConditionalRequestConflict"):
+                    continue
+                raise
+            self._cached, self._cached_at = manifest, time.monotonic()
+            return manifest
+        raise ManifestConflict(f"s3://{self.bucket}/{self.key} kept changing; gave up after {attempts} attempts")
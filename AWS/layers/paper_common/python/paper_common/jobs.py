@@ -0,0 +1,108 @@
+"""
+Job states for the upload -> index -> embed pipeline.
+
+Every paper's item in the metadata table (keyed by ``document_id``) carries
+its current ``status`` plus a ``stage_timings`` map:
+
+    uploaded -> extracting -> chunking -> embedding -> indexed
+                    |             |            |
+                    +-------------+------------+--> failed
+
+The API writes ``uploaded``; IndexPdfLambda owns ``extracting`` and
+ChunkAndEmbedLambda owns ``chunking``/``embedding``/``indexed``.
+"""
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+UPLOADED = "uploaded"
+EXTRACTING = "extracting"
+CHUNKING = "chunking"
+EMBEDDING = "embedding"
+INDEXED = "indexed"
+FAILED = "failed"
+
+STATES = (UPLOADED, EXTRACTING, CHUNKING, EMBEDDING, INDEXED, FAILED)
+TERMINAL_STATES = (INDEXED, FAILED)
+
+
+def utc_now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def is_terminal(status: str | None) -> bool:
+    return status in TERMINAL_STATES
+
+
+class StatusRecorder:
+    """
+    Records status transitions and per-stage timings for one document.
+
+    ``table`` is a boto3 DynamoDB ``Table`` resource; pass ``None`` to make
+    every call a no-op (e.g. when METADATA_TABLE is not configured).
+    Updates are conditional on the item already existing, so S3 events for
+    keys the API never registered do not create half-empty items.
+    """
+
+    def __init__(self, table, document_id: str):
+        self.table = table
+        self.document_id = document_id
+
+    def _update(self, update_expression: str, names: dict, values: dict) -> None:
+        if self.table is None:
+            return
+        try:
+            self.table.update_item(
+                Key={"document_id": self.document_id},
+                UpdateExpression=update_expression,
+                ConditionExpression="attribute_exists(document_id)",
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+            )
+        except Exception as e:
+            # Status tracking must never break the pipeline itself.
+            code = getattr(e, "response", {}).get("Error", {}).get("Code")
+            if code != "ConditionalCheckFailedException":
+                print(f"[StatusRecorder] Failed to update {self.document_id}: {e}")
+
+    def set_status(self, status: str, **attributes) -> None:
+        """Set ``status`` (and any extra top-level attributes) on the item."""
+        names = {"#status": "status"}
+        values = {":status": status, ":now": utc_now(), ":empty": {}}
+        sets = [
+            "#status = :status",
+            "status_updated_at = :now",
+            "stage_timings = if_not_exists(stage_timings, :empty)",
+        ]
+        for i, (name, value) in enumerate(attributes.items()):
+            names[f"#a{i}"] = name
+            values[f":a{i}"] = value
+            sets.append(f"#a{i} = :a{i}")
+        self._update("SET " + ", ".join(sets), names, values)
+
+    def record_timing(self, stage: str, started_at: str, duration_ms: int) -> None:
+        self._update(
+            "SET stage_timings.#stage = :timing",
+            {"#stage": stage},
+            {":timing": {"started_at": started_at, "duration_ms": duration_ms}},
+        )
+
+    @contextmanager
+    def stage(self, status: str):
+        """
+        Mark the document as being in ``status`` for the duration of the block
+        and record how long the stage took. Exceptions propagate tagged with
+        ``pipeline_stage`` so the caller can retry or park them
+        (see ``paper_common.failures``).
+        """
+        started_at = utc_now()
+        start = time.perf_counter()
+        self.set_status(status)
+        try:
+            yield
+        except Exception as e:
+            if not hasattr(e, "pipeline_stage"):
+                e.pipeline_stage = status
+            raise
+        finally:
+            self.record_timing(status, started_at, int((time.perf_counter() - start) * 1000))
@@ -0,0 +1,37 @@
+"""
+Deterministic object and vector keys.
+
+Keys only depend on (user_id, paper_id, chunk_index), so a retried or
+replayed stage overwrites its own earlier output instead of duplicating it,
+and every artifact of a paper can be addressed without listing.
+"""
+
+
+def pdf_key(user_id: str, paper_id: str) -> str:
+    return f"user/{user_id}/papers/{paper_id}.pdf"
+
+
+def text_key(user_id: str, paper_id: str) -> str:
+    return f"user/{user_id}/papers/{paper_id}.txt"
+
+
+def artifact_key(user_id: str, paper_id: str) -> str:
+    """Compressed, chunk-addressable text (paper_common.artifacts)."""
+    return f"user/{user_id}/papers/{paper_id}.pta"
+
+
+def ids_from_pdf_key(pdf_s3_key: str) -> tuple[str, str]:
+    """
+    (user_id, paper_id) IndexPdfLambda files a PDF's text and vectors under:
+    ``user/<user_id>/papers/<paper_id>.pdf`` as is; any other key (e.g. the
+    older ``uploads/<document_id>-<filename>``) as user ``dev-user`` and the
+    file name without its extension.
+    """
+    parts = pdf_s3_key.split("/")
+    if len(parts) >= 4 and parts[0] == "user" and parts[2] == "papers":
+        return parts[1], parts[3].rsplit(".", 1)[0]
+    return "dev-user", parts[-1].rsplit(".", 1)[0]
+
+
+def vector_key(user_id: str, paper_id: str, chunk_index: int) -> str:
+    return f"{user_id}:{paper_id}:{chunk_index}"
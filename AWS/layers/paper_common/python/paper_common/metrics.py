@@ -0,0 +1,89 @@
+"""
+CloudWatch Embedded Metric Format (EMF) for the Lambdas.
+
+Metrics are buffered per invocation and written as one JSON log line on
+``flush()``; CloudWatch turns the line into metrics without any API calls
+on the hot path. Every metric is published under the ``ResearchPapers``
+namespace with a ``FunctionName`` dimension, and repeated observations are
+sent as value arrays so CloudWatch can compute p50/p99 per operation.
+
+    METRICS = metrics.MetricsLogger("ChunkAndEmbedLambda")
+
+    @METRICS.flush_after
+    def lambda_handler(event, context):
+        with METRICS.timed("embed"):
+            ...
+        METRICS.put("payload_bytes", len(body), metrics.BYTES)
+"""
+import functools
+import json
+import time
+from contextlib import contextmanager
+
+NAMESPACE = "ResearchPapers"
+MILLISECONDS = "Milliseconds"
+BYTES = "Bytes"
+COUNT = "Count"
+
+# CloudWatch accepts at most 100 values per metric in one EMF record.
+MAX_VALUES_PER_METRIC = 100
+
+
+class MetricsLogger:
+    def __init__(self, function_name: str, namespace: str = NAMESPACE):
+        self.function_name = function_name
+        self.namespace = namespace
+        self._values: dict[str, list[float]] = {}
+        self._units: dict[str, str] = {}
+
+    def put(self, name: str, value: float, unit: str = COUNT) -> None:
+        self._values.setdefault(name, []).append(value)
+        self._units[name] = unit
+
+    @contextmanager
+    def timed(self, operation: str):
+        """Record ``<operation>_ms``; failures also count ``<operation>_errors``."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.put(f"{operation}_errors", 1, COUNT)
+            raise
+        finally:
+            self.put(f"{operation}_ms", (time.perf_counter() - start) * 1000.0, MILLISECONDS)
+
+    def flush(self) -> None:
+        """Print buffered metrics as EMF records and reset the buffer."""
+        values, self._values = self._values, {}
+        while values:
+            record = {}
+            for name in list(values):
+                record[name] = values[name][:MAX_VALUES_PER_METRIC]
+                values[name] = values[name][MAX_VALUES_PER_METRIC:]
+                if not values[name]:
+                    del values[name]
+            print(json.dumps(self._record(record)))
+
+    def _record(self, batch: dict) -> dict:
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": [["FunctionName"]],
+                    "Metrics": [{"Name": name, "Unit": self._units[name]} for name in batch],
+                }],
+            },
+            "FunctionName": self.function_name,
+            **{name: vals[0] if len(vals) == 1 else vals for name, vals in batch.items()},
+        }
+
+    def flush_after(self, handler):
+        """Decorator: flush after every invocation, including failed ones."""
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            try:
+                return handler(event, context)
+            finally:
+                self.flush()
+        return wrapper
@@ -0,0 +1,202 @@
+"""
+Per-tenant vector index partitions.
+
+With one index per generation, every query scans (and filters) the whole
+platform's vectors. A routing table in S3 splits each generation into
+partitions, each its own S3 Vectors index:
+
+    {
+      "version": 7,
+      "current": {"shards": 2, "dedicated": {"alice": "u-5d41402abc"}},
+      "next": null,                         # layout being migrated to
+      "previous": null,                     # layout migrated from (being drained)
+      "thresholds": {"user_vectors": 20000, "shard_vectors": 200000}
+    }
+
+A *layout* routes a user to their dedicated partition when they have one,
+else to shard ``s<hash(user) % shards>``. Partition ``s0`` is the
+generation's own index, so a fresh routing table (one shard, nobody
+dedicated) is exactly the unpartitioned setup; other partitions are
+``<generation index>-<partition>``.
+
+* Queries for a user read that user's partition in ``current`` (a
+  dedicated partition needs no user filter); queries without a user fan
+  out over every partition and merge the top-k.
+* Writers write to the user's partition in ``current`` and ``next``, so
+  nothing is missed while vectors are copied over.
+* ``AWS/utils/vector_partitions.py rebalance`` (meant to run on a schedule)
+  plans a new layout when a user or a shard grows past the thresholds
+  (``plan``), publishes it as ``next``, copies the affected users' vectors,
+  makes it ``current`` (``commit``), and deletes what was left behind in
+  ``previous`` partitions (``finish_drain``). Shards only ever double, so
+  half of a shard's users stay where they are.
+
+The table is read through the same TTL cache and compare-and-swap updates
+as the generations manifest (``RoutingStore`` is a ``ManifestStore``).
+"""
+import hashlib
+
+from .generations import ManifestStore
+
+DEFAULT_ROUTING_KEY = "manifests/vector-partitions.json"
+DEFAULT_THRESHOLDS = {"user_vectors": 20000, "shard_vectors": 200000}
+MAX_SHARDS = 64
+
+
+class PartitionError(Exception):
+    """An operation is not valid for the routing table's current state."""
+
+
+def empty_routing() -> dict:
+    return {
+        "version": 0,
+        "current": {"shards": 1, "dedicated": {}},
+        "next": None,
+        "previous": None,
+        "thresholds": dict(DEFAULT_THRESHOLDS),
+    }
+
+
+def _digest(user_id: str) -> str:
+    return hashlib.sha1(user_id.encode("utf-8")).hexdigest()
+
+
+def shard_of(user_id: str, shards: int) -> int:
+    return int(_digest(user_id)[:8], 16) % shards
+
+
+def layout_partition(layout: dict, user_id: str) -> str:
+    dedicated = layout.get("dedicated", {}).get(user_id)
+    return dedicated or f"s{shard_of(user_id, int(layout['shards']))}"
+
+
+def layout_partitions(layout: dict) -> list[str]:
+    """Every partition of a layout."""
+    shards = [f"s{k}" for k in range(int(layout["shards"]))]
+    return shards + sorted(set(layout.get("dedicated", {}).values()))
+
+
+def is_dedicated(partition: str) -> bool:
+    return not partition.startswith("s")
+
+
+def index_name(generation_index: str, partition: str) -> str:
+    """The S3 Vectors index holding ``partition`` of a generation."""
+    return generation_index if partition == "s0" else f"{generation_index}-{partition}"
+
+
+def _layouts(routing: dict, *names: str) -> list[dict]:
+    return [routing[name] for name in names if routing.get(name)]
+
+
+def read_partition(routing: dict, user_id: str) -> str:
+    return layout_partition(routing["current"], user_id)
+
+
+def write_partitions(routing: dict, user_id: str) -> list[str]:
+    """Partitions a new vector of ``user_id`` must be written to."""
+    return list(dict.fromkeys(layout_partition(layout, user_id) for layout in _layouts(routing, "current", "next")))
+
+
+def stored_partitions(routing: dict, user_id: str) -> list[str]:
+    """Partitions that may hold vectors of ``user_id`` (for deletes)."""
+    layouts = _layouts(routing, "current", "next", "previous")
+    return list(dict.fromkeys(layout_partition(layout, user_id) for layout in layouts))
+
+
+def all_partitions(routing: dict) -> list[str]:
+    """Every partition any writer or reader may use (for creating / deleting indexes)."""
+    layouts = _layouts(routing, "current", "next", "previous")
+    return list(dict.fromkeys(p for layout in layouts for p in layout_partitions(layout)))
+
+
+def moved_users(old: dict, new: dict, users) -> list[tuple[str, str, str]]:
+    """(user, from partition, to partition) for each of ``users`` the new layout moves."""
+    moves = []
+    for user_id in users:
+        src, dst = layout_partition(old, user_id), layout_partition(new, user_id)
+        if src != dst:
+            moves.append((user_id, src, dst))
+    return moves
+
+
+def plan(routing: dict, user_vectors: dict[str, int], thresholds: dict | None = None) -> dict | None:
+    """
+    The layout ``current`` should move to, or None when it is balanced:
+    users past ``user_vectors`` get a dedicated partition, then shards
+    double until none holds more than ``shard_vectors``.
+    """
+    thresholds = {**DEFAULT_THRESHOLDS, **routing.get("thresholds", {}), **(thresholds or {})}
+    current = routing["current"]
+    layout = {"shards": int(current["shards"]), "dedicated": dict(current.get("dedicated", {}))}
+    for user_id, count in user_vectors.items():
+        if count > thresholds["user_vectors"] and user_id not in layout["dedicated"]:
+            layout["dedicated"][user_id] = f"u-{_digest(user_id)[:10]}"
+
+    def largest_shard(shards: int) -> int:
+        sizes: dict[int, int] = {}
+        for user_id, count in user_vectors.items():
+            if user_id not in layout["dedicated"]:
+                shard = shard_of(user_id, shards)
+                sizes[shard] = sizes.get(shard, 0) + count
+        return max(sizes.values(), default=0)
+
+    while largest_shard(layout["shards"]) > thresholds["shard_vectors"] and layout["shards"] < MAX_SHARDS:
+        layout["shards"] *= 2
+    if layout == {"shards": int(current["shards"]), "dedicated": current.get("dedicated", {})}:
+        return None
+    return layout
+
+
+# ---- pure state transitions (mutate the routing table in place) ----
+
+def begin(routing: dict, layout: dict) -> None:
+    """Publish ``layout`` as ``next``: writers start writing to it too."""
+    if routing.get("next") and routing["next"] != layout:
+        raise PartitionError("another layout is already being migrated to")
+    if routing.get("previous"):
+        raise PartitionError("the previous layout has not been drained yet")
+    routing["next"] = layout
+
+
+def commit(routing: dict) -> None:
+    """Readers switch to ``next``; the old layout is kept until drained."""
+    if not routing.get("next"):
+        raise PartitionError("no layout to commit")
+    routing["previous"] = routing["current"]
+    routing["current"] = routing["next"]
+    routing["next"] = None
+
+
+def finish_drain(routing: dict) -> None:
+    routing["previous"] = None
+
+
+class StaticRouting:
+    """One shard, nobody dedicated: every user in the generation's own index."""
+
+    def get(self) -> dict:
+        return empty_routing()
+
+
+class RoutingStore(ManifestStore):
+    """The routing table object in S3, with a TTL cache for readers."""
+
+    def __init__(self, s3, bucket: str, key: str = DEFAULT_ROUTING_KEY, ttl_seconds: float = 30.0):
+        super().__init__(s3, bucket, key, ttl_seconds=ttl_seconds)
+
+    def empty(self) -> dict:
+        return empty_routing()
+
+
+def from_env(s3, env: dict):
+    """RoutingStore when VECTOR_PARTITIONS_BUCKET is set, else StaticRouting."""
+    bucket = env.get("VECTOR_PARTITIONS_BUCKET")
+    if not bucket:
+        return StaticRouting()
+    return RoutingStore(
+        s3,
+        bucket,
+        env.get("VECTOR_PARTITIONS_KEY", DEFAULT_ROUTING_KEY),
+        ttl_seconds=float(env.get("VECTOR_PARTITIONS_TTL", "30")),
+    )
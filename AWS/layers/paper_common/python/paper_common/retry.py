@@ -0,0 +1,161 @@
+"""
+Error classification and retry helpers for the indexing stages.
+
+Errors are either *transient* (throttling, timeouts, 5xx - worth retrying)
+or *permanent* (corrupt PDF, bad event, missing object - retrying cannot
+help). Transient errors are retried with exponential backoff and full
+jitter; ``AdaptivePacer`` additionally slows a whole loop down while
+Bedrock is throttling, so a storm degrades throughput instead of burning
+through every attempt at once.
+"""
+import random
+import socket
+import time
+import urllib.error
+
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+
+# botocore ClientError codes that mean "try again later"
+TRANSIENT_ERROR_CODES = {
+    "ThrottlingException",
+    "Throttling",
+    "TooManyRequestsException",
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+    "SlowDown",
+    "ServiceUnavailable",
+    "ServiceUnavailableException",
+    "InternalServerError",
+    "InternalServerException",
+    "InternalFailure",
+    "ModelNotReadyException",
+    "ModelTimeoutException",
+    "RequestTimeout",
+    "RequestTimeoutException",
+    "EC2ThrottledException",
+    "TransactionInProgressException",
+}
+
+THROTTLING_ERROR_CODES = {
+    "ThrottlingException",
+    "Throttling",
+    "TooManyRequestsException",
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+    "SlowDown",
+}
+
+
+def error_code(exc: BaseException) -> str | None:
+    """The AWS error code of a botocore ClientError, else None."""
+    response = getattr(exc, "response", None)
+    if isinstance(response, dict):
+        return response.get("Error", {}).get("Code")
+    return None
+
+
+def is_throttle(exc: BaseException) -> bool:
+    if error_code(exc) in THROTTLING_ERROR_CODES:
+        return True
+    return isinstance(exc, urllib.error.HTTPError) and exc.code == 429
+
+
+def classify_error(exc: BaseException) -> str:
+    """Return TRANSIENT or PERMANENT for an exception raised by a stage."""
+    code = error_code(exc)
+    if code is not None:
+        if code in TRANSIENT_ERROR_CODES:
+            return TRANSIENT
+        status = getattr(exc, "response", {}).get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+        return TRANSIENT if status == 429 or status >= 500 else PERMANENT
+
+    if isinstance(exc, urllib.error.HTTPError):
+        return TRANSIENT if exc.code == 429 or exc.code >= 500 else PERMANENT
+
+    # botocore connection/read timeouts, sockets, urllib network errors
+    name = type(exc).__name__
+    if isinstance(exc, (TimeoutError, ConnectionError, socket.timeout, urllib.error.URLError)):
+        return TRANSIENT
+    if name in {
+        "EndpointConnectionError",
+        "ConnectTimeoutError",
+        "ReadTimeoutError",
+        "ConnectionClosedError",
+        "IncompleteReadError",
+        "ResponseStreamingError",
+    }:
+        return TRANSIENT
+
+    return PERMANENT
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 20.0) -> float:
+    """Full-jitter exponential backoff for the given (0-based) retry attempt."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def call_with_retry(
+    fn,
+    *args,
+    attempts: int = 5,
+    base_delay: float = 0.5,
+    max_delay: float = 20.0,
+    deadline: float | None = None,
+    pacer: "AdaptivePacer | None" = None,
+    sleep=time.sleep,
+    **kwargs,
+):
+    """
+    Call ``fn(*args, **kwargs)``, retrying transient errors.
+
+    ``deadline`` is a ``time.monotonic()`` value after which no further
+    retry is started (e.g. derived from the Lambda's remaining time). The
+    last error is re-raised once attempts or time run out; permanent
+    errors are re-raised immediately.
+    """
+    for attempt in range(attempts):
+        if pacer is not None:
+            pacer.wait()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if pacer is not None and is_throttle(e):
+                pacer.on_throttle()
+            if classify_error(e) == PERMANENT or attempt == attempts - 1:
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                raise
+            sleep(delay)
+        else:
+            if pacer is not None:
+                pacer.on_success()
+            return result
+
+
+class AdaptivePacer:
+    """
+    AIMD pacing between calls: each throttle doubles the gap between calls
+    (up to ``max_interval``), each success shrinks it a little. When nothing
+    is throttling the interval decays to zero and calls run back to back.
+    """
+
+    def __init__(self, max_interval: float = 5.0, increase: float = 2.0, decrease: float = 0.05,
+                 initial_step: float = 0.1, sleep=time.sleep):
+        self.max_interval = max_interval
+        self.increase = increase
+        self.decrease = decrease
+        self.initial_step = initial_step
+        self.interval = 0.0
+        self._sleep = sleep
+
+    def wait(self) -> None:
+        if self.interval > 0:
+            self._sleep(self.interval)
+
+    def on_throttle(self) -> None:
+        self.interval = min(self.max_interval, max(self.initial_step, self.interval * self.increase))
+
+    def on_success(self) -> None:
+        self.interval = max(0.0, self.interval - self.decrease)
@@ -0,0 +1,137 @@
+"""
+Conversation working sets for follow-up questions.
+
+A chat about a paper asks many questions about the same few chunks.
+QueryRagLambda keeps, per ``conversation_id``, the chunks it has retrieved
+so far together with their embeddings (``WorkingSet``), and scores the next
+question against them first. When the working set answers it well enough
+(every returned chunk at or above ``min_similarity``), no vector query is
+made. Otherwise the vector store is queried, and the hits plus their
+neighbours (``chunk_index`` +/- n in the same paper) are fetched with their
+embeddings and added, so the follow-ups that move through the paper stay
+local.
+
+Working sets live in an in-process LRU (warm containers) and, when a
+SESSION_TABLE is configured, in DynamoDB - one item per conversation,
+expiring through a TTL attribute - so any container can continue a
+conversation. A working set belongs to one user and one index generation;
+a mismatch (or a cutover) starts a fresh one.
+"""
+import base64
+import json
+import math
+import threading
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+
+DEFAULT_MAX_CHUNKS = 64
+DEFAULT_TTL_SECONDS = 1800
+
+
+def _cosine(a: list[float], b: list[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class WorkingSet:
+    """Chunks retrieved in one conversation (vector key -> chunk + embedding), least recently used first."""
+
+    def __init__(self, user_id: str, generation: str, max_chunks: int = DEFAULT_MAX_CHUNKS):
+        self.user_id = user_id
+        self.generation = generation
+        self.max_chunks = max_chunks
+        self.chunks: "OrderedDict[str, dict]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def add(self, chunk: dict) -> None:
+        """``chunk``: key, embedding, text, paper_id, chunk_index."""
+        self.chunks[chunk["key"]] = chunk
+        self.chunks.move_to_end(chunk["key"])
+        while len(self.chunks) > self.max_chunks:
+            self.chunks.popitem(last=False)
+
+    def search(self, embedding: list[float], top_k: int, paper_ids: list[str] | None = None) -> list[tuple[float, dict]]:
+        """The ``top_k`` most similar chunks as (similarity, chunk); they count as recently used."""
+        scored = sorted(
+            ((_cosine(embedding, c["embedding"]), c) for c in self.chunks.values()
+             if not paper_ids or c["paper_id"] in paper_ids),
+            key=lambda s: s[0], reverse=True,
+        )[:top_k]
+        for _, chunk in scored:
+            self.chunks.move_to_end(chunk["key"])
+        return scored
+
+    # ---- serialization (DynamoDB binary attribute) ----
+
+    def dumps(self) -> bytes:
+        chunks = [
+            {**c, "embedding": base64.b64encode(array("f", c["embedding"]).tobytes()).decode("ascii")}
+            for c in self.chunks.values()
+        ]
+        return zlib.compress(json.dumps({
+            "user_id": self.user_id, "generation": self.generation, "chunks": chunks,
+        }, separators=(",", ":")).encode("utf-8"))
+
+    @classmethod
+    def loads(cls, data: bytes, max_chunks: int = DEFAULT_MAX_CHUNKS) -> "WorkingSet":
+        state = json.loads(zlib.decompress(data))
+        working_set = cls(state["user_id"], state["generation"], max_chunks)
+        for chunk in state["chunks"]:
+            embedding = array("f")
+            embedding.frombytes(base64.b64decode(chunk["embedding"]))
+            working_set.add({**chunk, "embedding": embedding.tolist()})
+        return working_set
+
+
+class SessionStore:
+    """
+    Working sets by conversation id: an in-process LRU in front of an
+    optional DynamoDB table (``table`` keyed on ``conversation_id``, with
+    TTL enabled on ``expires_at``).
+    """
+
+    def __init__(self, table=None, ttl_seconds: float = DEFAULT_TTL_SECONDS, max_chunks: int = DEFAULT_MAX_CHUNKS,
+                 max_sessions: int = 256):
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self.max_chunks = max_chunks
+        self.max_sessions = max_sessions
+        self._local: "OrderedDict[str, tuple[float, WorkingSet]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, conversation_id: str, user_id: str, generation: str) -> WorkingSet:
+        """The conversation's working set, or an empty one for this user and generation."""
+        working_set = None
+        with self._lock:
+            entry = self._local.get(conversation_id)
+            if entry is not None and time.time() - entry[0] <= self.ttl_seconds:
+                working_set = entry[1]
+                self._local.move_to_end(conversation_id)
+        if working_set is None and self.table is not None:
+            item = self.table.get_item(Key={"conversation_id": conversation_id}).get("Item")
+            if item and int(item.get("expires_at", 0)) > time.time():
+                data = item["state"]
+                working_set = WorkingSet.loads(bytes(getattr(data, "value", data)), self.max_chunks)
+        if working_set is None or working_set.user_id != user_id or working_set.generation != generation:
+            working_set = WorkingSet(user_id, generation, self.max_chunks)
+        return working_set
+
+    def put(self, conversation_id: str, working_set: WorkingSet) -> None:
+        now = time.time()
+        with self._lock:
+            self._local[conversation_id] = (now, working_set)
+            self._local.move_to_end(conversation_id)
+            while len(self._local) > self.max_sessions:
+                self._local.popitem(last=False)
+        if self.table is not None:
+            self.table.put_item(Item={
+                "conversation_id": conversation_id,
+                "user_id": working_set.user_id,
+                "state": working_set.dumps(),
+                "expires_at": int(now + self.ttl_seconds),
+            })
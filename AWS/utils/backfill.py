@@ -0,0 +1,415 @@
+"""
+Re-embed the whole corpus into a new vector index generation.
+
+Enumerates every extracted text in TEXT_BUCKET (``user/<uid>/papers/*.pta``
+artifacts, or ``*.txt`` for papers indexed before them), re-chunks and re-embeds it with the current chunker / BEDROCK_MODEL_ID /
+EMBED_DIMS, and writes the vectors into ``--generation`` - registered as
+the *staging* generation in the index manifest (see
+paper_common.generations), so live uploads are written to it too while the
+backfill runs and queries keep reading the active one. Work is spread
+over ``--processes`` worker processes (each with ``--threads`` concurrent
+Titan calls) that share one global tokens-per-second budget, so the run
+uses all of the Bedrock quota it is given and no more. Progress, throughput
+and ETA are printed while it runs. With a partition routing table
+(``--partitions-bucket``, see paper_common.partitions) each user's vectors
+go to their partition of the new generation, and ``--create-index``
+creates every partition's index.
+
+With ``--switch``, once the run is clean, a catch-up pass re-embeds texts
+written by invocations that started before the staging generation was
+registered, and the manifest is cut over atomically: every QueryRagLambda
+reads the new generation within VECTOR_MANIFEST_TTL seconds.
+
+Usage:
+
+    python AWS/utils/backfill.py \\
+        --text-bucket paper-texts --vector-bucket paper-vectors-rohan-dev \\
+        --manifest-bucket paper-texts \\
+        --generation paper-chunks-g4 --create-index --dims 256 \\
+        --processes 8 --threads 8 --tokens-per-second 20000 \\
+        [--done-file backfill.done] [--switch]
+
+``--done-file`` records finished keys, so an interrupted run can be resumed
+by re-running the same command.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import queue
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import boto3
+from botocore.config import Config
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "layers", "paper_common", "python"))
+
+from paper_common import artifacts, embeddings, generations, keys, partitions  # noqa: E402
+from paper_common.chunking import DEFAULT_MAX_CHARS  # noqa: E402
+from paper_common.retry import AdaptivePacer, call_with_retry  # noqa: E402
+
+TEXT_KEY_RE = re.compile(r"^user/([^/]+)/papers/([^/]+)\.(pta|txt)$")
+PUT_BATCH_SIZE = 100
+# Longest a ChunkAndEmbedLambda invocation can run on a manifest it loaded
+# before the staging generation existed (Lambda timeout + manifest TTL).
+CATCH_UP_WINDOW = timedelta(minutes=16)
+
+
+class SharedTokenBucket:
+    """
+    Token bucket shared by every worker process.
+
+    ``rate`` tokens are added per second up to ``capacity``. Throttling
+    responses lower the effective rate (down to ``min_fraction`` of the
+    budget) and successes let it recover, so a throttled account converges
+    on what Bedrock actually accepts instead of hammering it.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None, min_fraction: float = 0.1):
+        self.target_rate = rate
+        self.capacity = capacity or rate
+        self.min_rate = rate * min_fraction
+        self._rate = mp.RawValue("d", rate)
+        self._tokens = mp.RawValue("d", self.capacity)
+        self._updated = mp.RawValue("d", time.monotonic())
+        self._lock = mp.Lock()
+
+    def acquire(self, n: float) -> None:
+        n = min(n, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                rate = self._rate.value
+                self._tokens.value = min(self.capacity, self._tokens.value + (now - self._updated.value) * rate)
+                self._updated.value = now
+                if self._tokens.value >= n:
+                    self._tokens.value -= n
+                    return
+                wait = (n - self._tokens.value) / rate
+            time.sleep(wait)
+
+    def on_throttle(self) -> None:
+        with self._lock:
+            self._rate.value = max(self.min_rate, self._rate.value * 0.7)
+
+    def on_success(self) -> None:
+        if self._rate.value < self.target_rate:
+            with self._lock:
+                self._rate.value = min(self.target_rate, self._rate.value + self.target_rate * 0.01)
+
+    @property
+    def rate(self) -> float:
+        return self._rate.value
+
+
+class BucketPacer:
+    """
+    The pacer ``call_with_retry`` sees for one embedding call: every attempt
+    takes ``tokens`` from the shared bucket and every throttle reaches it
+    (as well as this process's ``AdaptivePacer``). Only a call that
+    succeeded on its first attempt counts as a success for the bucket.
+    """
+
+    def __init__(self, bucket: SharedTokenBucket, pacer: AdaptivePacer, tokens: float):
+        self.bucket = bucket
+        self.pacer = pacer
+        self.tokens = tokens
+        self.throttled = False
+
+    def wait(self) -> None:
+        self.pacer.wait()
+        self.bucket.acquire(self.tokens)
+
+    def on_throttle(self) -> None:
+        self.throttled = True
+        self.pacer.on_throttle()
+        self.bucket.on_throttle()
+
+    def on_success(self) -> None:
+        self.pacer.on_success()
+        if not self.throttled:
+            self.bucket.on_success()
+
+
+def list_text_objects(s3, bucket: str, modified_after: datetime | None = None):
+    """
+    Yield (key, size) for every paper's text: user/<uid>/papers/<pid>.pta,
+    or <pid>.txt when the paper has no artifact.
+    """
+    paginator = s3.get_paginator("list_objects_v2")
+    # Listings are sorted by key, so a paper's .pta comes right before its .txt.
+    last_artifact = None
+    for page in paginator.paginate(Bucket=bucket, Prefix="user/"):
+        for obj in page.get("Contents", []):
+            match = TEXT_KEY_RE.match(obj["Key"])
+            if not match:
+                continue
+            if match.group(3) == "pta":
+                last_artifact = match.group(1, 2)
+            elif match.group(1, 2) == last_artifact:
+                continue
+            if modified_after and obj["LastModified"] < modified_after:
+                continue
+            yield obj["Key"], obj["Size"]
+
+
+def _worker(opts: dict, work_q, progress_q, bucket: SharedTokenBucket) -> None:
+    cfg = Config(
+        retries={"mode": "standard", "max_attempts": 2},
+        max_pool_connections=opts["threads"] + 2,
+    )
+    s3 = boto3.client("s3", region_name=opts["region"], config=cfg)
+    s3v = boto3.client("s3vectors", region_name=opts["region"], config=cfg)
+    bedrock = boto3.client("bedrock-runtime", region_name=opts["region"], config=cfg)
+    pacer = AdaptivePacer()
+
+    def embed(chunk: str) -> list[float]:
+        return call_with_retry(
+            embeddings.embed_text, bedrock, chunk,
+            model_id=opts["model_id"], dims=opts["dims"],
+            pacer=BucketPacer(bucket, pacer, embeddings.estimate_tokens(chunk)),
+        )
+
+    with ThreadPoolExecutor(max_workers=opts["threads"]) as pool:
+        while True:
+            item = work_q.get()
+            if item is None:
+                return
+            key, size = item
+            try:
+                user_id, paper_id, _ = TEXT_KEY_RE.match(key).groups()
+                indexes = [
+                    partitions.index_name(opts["target_index"], partition)
+                    for partition in partitions.write_partitions(opts["routing"], user_id)
+                ]
+                obj = call_with_retry(s3.get_object, Bucket=opts["text_bucket"], Key=key)
+                chunks, _ = artifacts.load_chunks(obj["Body"].read(), max_chars=opts["chunk_chars"])
+                vectors = list(pool.map(embed, chunks))
+
+                for start in range(0, len(chunks), PUT_BATCH_SIZE):
+                    batch = [
+                        {
+                            "key": keys.vector_key(user_id, paper_id, idx),
+                            "data": {"float32": vectors[idx]},
+                            "metadata": {
+                                "source_text": chunks[idx],
+                                "user_id": user_id,
+                                "paper_id": paper_id,
+                                "chunk_index": idx,
+                            },
+                        }
+                        for idx in range(start, min(start + PUT_BATCH_SIZE, len(chunks)))
+                    ]
+                    for index in indexes:
+                        call_with_retry(
+                            s3v.put_vectors,
+                            vectorBucketName=opts["vector_bucket"],
+                            indexName=index,
+                            vectors=batch,
+                        )
+
+                tokens = sum(embeddings.estimate_tokens(c) for c in chunks)
+                progress_q.put(("ok", key, size, len(chunks), tokens, None))
+            except Exception as e:
+                progress_q.put(("error", key, size, 0, 0, f"{type(e).__name__}: {e}"))
+
+
+def _fmt_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def run_backfill(opts: dict, work: list[tuple[str, int]], done_file: str | None,
+                 failures_file: str | None, progress_interval: float) -> dict:
+    """Embed every (key, size) in ``work``; returns summary counters."""
+    total_docs = len(work)
+    total_bytes = sum(size for _, size in work) or 1
+    stats = {"docs": 0, "chunks": 0, "tokens": 0, "bytes": 0, "errors": 0}
+    if not work:
+        return stats
+
+    bucket = SharedTokenBucket(opts["tokens_per_second"])
+    work_q = mp.Queue()
+    progress_q = mp.Queue()
+    for item in work:
+        work_q.put(item)
+    for _ in range(opts["processes"]):
+        work_q.put(None)
+
+    procs = [
+        mp.Process(target=_worker, args=(opts, work_q, progress_q, bucket), daemon=True)
+        for _ in range(opts["processes"])
+    ]
+    for p in procs:
+        p.start()
+
+    done_fh = open(done_file, "a") if done_file else None
+    fail_fh = open(failures_file, "a") if failures_file else None
+    started = time.monotonic()
+    last_report = 0.0
+    finished = 0
+
+    try:
+        while finished < total_docs:
+            try:
+                status, key, size, n_chunks, tokens, error = progress_q.get(timeout=1.0)
+            except queue.Empty:
+                if not any(p.is_alive() for p in procs):
+                    print("[backfill] ERROR: all workers exited early")
+                    break
+            else:
+                finished += 1
+                stats["bytes"] += size
+                if status == "ok":
+                    stats["docs"] += 1
+                    stats["chunks"] += n_chunks
+                    stats["tokens"] += tokens
+                    if done_fh:
+                        done_fh.write(key + "\n")
+                        done_fh.flush()
+                else:
+                    stats["errors"] += 1
+                    print(f"[backfill] FAILED {key}: {error}")
+                    if fail_fh:
+                        fail_fh.write(json.dumps({"key": key, "error": error}) + "\n")
+                        fail_fh.flush()
+
+            now = time.monotonic()
+            if now - last_report >= progress_interval or finished == total_docs:
+                last_report = now
+                elapsed = max(now - started, 1e-6)
+                byte_rate = stats["bytes"] / elapsed
+                eta = (total_bytes - stats["bytes"]) / byte_rate if byte_rate else float("inf")
+                print(
+                    f"[backfill] {finished}/{total_docs} docs ({100 * stats['bytes'] / total_bytes:.1f}%), "
+                    f"{stats['chunks']:,} chunks, {stats['chunks'] / elapsed:,.0f} chunks/s, "
+                    f"{stats['tokens'] / elapsed:,.0f} tok/s (budget {bucket.rate:,.0f}), "
+                    f"errors={stats['errors']}, elapsed {_fmt_duration(elapsed)}, "
+                    f"ETA {_fmt_duration(eta) if eta != float('inf') else '?'}"
+                )
+    finally:
+        for p in procs:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+        if done_fh:
+            done_fh.close()
+        if fail_fh:
+            fail_fh.close()
+
+    return stats
+
+
+def ensure_index(s3v, vector_bucket: str, index: str, dims: int) -> None:
+    try:
+        s3v.create_index(
+            vectorBucketName=vector_bucket,
+            indexName=index,
+            dataType="float32",
+            dimension=dims,
+            distanceMetric="cosine",
+            metadataConfiguration={"nonFilterableMetadataKeys": ["source_text"]},
+        )
+        print(f"[backfill] Created index {index} (dims={dims})")
+    except s3v.exceptions.ConflictException:
+        print(f"[backfill] Index {index} already exists")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-embed TEXT_BUCKET into a new vector index generation.")
+    parser.add_argument("--text-bucket", default=os.environ.get("TEXT_BUCKET", "paper-texts"))
+    parser.add_argument("--vector-bucket", default=os.environ.get("VECTOR_BUCKET"), required=not os.environ.get("VECTOR_BUCKET"))
+    parser.add_argument("--manifest-bucket", default=os.environ.get("VECTOR_MANIFEST_BUCKET"))
+    parser.add_argument("--manifest-key", default=os.environ.get("VECTOR_MANIFEST_KEY", generations.DEFAULT_MANIFEST_KEY))
+    parser.add_argument("--partitions-bucket", default=os.environ.get("VECTOR_PARTITIONS_BUCKET"))
+    parser.add_argument("--partitions-key", default=os.environ.get("VECTOR_PARTITIONS_KEY", partitions.DEFAULT_ROUTING_KEY))
+    parser.add_argument("--generation", required=True, help="Name of the new generation (= vector index name)")
+    parser.add_argument("--create-index", action="store_true")
+    parser.add_argument("--region", default=os.environ.get("AWS_REGION", "us-east-1"))
+    parser.add_argument("--model-id", default=embeddings.DEFAULT_MODEL_ID)
+    parser.add_argument("--dims", type=int, default=embeddings.DEFAULT_DIMS)
+    parser.add_argument("--chunk-chars", type=int, default=DEFAULT_MAX_CHARS)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--threads", type=int, default=8, help="Concurrent Titan calls per process")
+    parser.add_argument("--tokens-per-second", type=float, default=10000, help="Global Bedrock token budget")
+    parser.add_argument("--limit", type=int, default=0, help="Only process the first N texts (0 = all)")
+    parser.add_argument("--done-file", help="Append finished keys here and skip keys already in it")
+    parser.add_argument("--failures-file", help="Append failed keys + errors here (JSON lines)")
+    parser.add_argument("--progress-interval", type=float, default=10.0)
+    parser.add_argument("--switch", action="store_true", help="Cut the manifest over to the generation when done")
+    parser.add_argument("--allow-errors", action="store_true", help="Switch even if some papers failed")
+    args = parser.parse_args(argv)
+
+    if args.switch and not args.manifest_bucket:
+        parser.error("--switch needs --manifest-bucket (or VECTOR_MANIFEST_BUCKET)")
+
+    opts = {
+        "region": args.region,
+        "text_bucket": args.text_bucket,
+        "vector_bucket": args.vector_bucket,
+        "target_index": args.generation,
+        "model_id": args.model_id,
+        "dims": args.dims,
+        "chunk_chars": args.chunk_chars,
+        "threads": args.threads,
+        "processes": args.processes,
+        "tokens_per_second": args.tokens_per_second,
+    }
+
+    s3 = boto3.client("s3", region_name=args.region)
+    s3v = boto3.client("s3vectors", region_name=args.region)
+    # Vectors go to each user's partition(s) of the new generation, as the
+    # Lambdas write them; don't rebalance partitions while a backfill runs.
+    opts["routing"] = (
+        partitions.RoutingStore(s3, args.partitions_bucket, args.partitions_key).get()
+        if args.partitions_bucket else partitions.empty_routing()
+    )
+    if args.create_index:
+        for partition in partitions.all_partitions(opts["routing"]):
+            ensure_index(s3v, args.vector_bucket, partitions.index_name(args.generation, partition), args.dims)
+
+    store = None
+    if args.manifest_bucket:
+        store = generations.ManifestStore(s3, args.manifest_bucket, args.manifest_key)
+        manifest = store.update(
+            lambda m: generations.create_staging(m, args.generation, args.model_id, args.dims)
+        )
+        print(f"[backfill] Registered {args.generation} as staging (manifest v{manifest['version']}); "
+              f"live uploads now dual-write to it")
+
+    done = set()
+    if args.done_file and os.path.exists(args.done_file):
+        with open(args.done_file) as fh:
+            done = {line.strip() for line in fh if line.strip()}
+
+    backfill_started = datetime.now(timezone.utc)
+    work = [(k, size) for k, size in list_text_objects(s3, args.text_bucket) if k not in done]
+    if args.limit:
+        work = work[: args.limit]
+    print(f"[backfill] {len(work)} texts to embed into {args.generation} "
+          f"({len(done)} already done, {sum(s for _, s in work) / 1e6:.1f} MB)")
+
+    stats = run_backfill(opts, work, args.done_file, args.failures_file, args.progress_interval)
+    print(f"[backfill] Done: {json.dumps(stats)}")
+
+    if not args.switch:
+        return
+    if stats["errors"] and not args.allow_errors:
+        print("[backfill] Not switching: some papers failed (see --failures-file, or pass --allow-errors)")
+        sys.exit(1)
+
+    catch_up = list(list_text_objects(s3, args.text_bucket, modified_after=backfill_started - CATCH_UP_WINDOW))
+    print(f"[backfill] Catch-up pass: {len(catch_up)} texts written around the start of the backfill")
+    run_backfill(opts, catch_up, None, args.failures_file, args.progress_interval)
+
+    manifest = store.update(generations.cutover)
+    print(f"[backfill] Cut over: active={manifest['active']}, previous={manifest['history'][:1]} "
+          f"(manifest v{manifest['version']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Manage vector index generations (see paper_common.generations).
+
+    python AWS/utils/index_generations.py show
+    python AWS/utils/index_generations.py init --active paper-chunks
+    python AWS/utils/index_generations.py create-staging paper-chunks-g4 --dims 256 --create-index
+    python AWS/utils/index_generations.py cutover
+    python AWS/utils/index_generations.py rollback
+    python AWS/utils/index_generations.py gc --keep 1 [--dry-run]
+
+The manifest location comes from --manifest-bucket/--manifest-key or the
+VECTOR_MANIFEST_BUCKET/VECTOR_MANIFEST_KEY env vars the Lambdas use. With
+per-user partitions (VECTOR_PARTITIONS_BUCKET, see AWS/utils/vector_partitions.py)
+a generation is one index per partition; create-staging and gc handle all
+of them.
+Normally ``AWS/utils/backfill.py`` does create-staging + cutover for you;
+this is for inspecting, rolling back and garbage-collecting.
+"""
+import argparse
+import json
+import os
+import sys
+
+import boto3
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "layers", "paper_common", "python"))
+
+from paper_common import embeddings, generations, partitions  # noqa: E402
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage vector index generations.")
+    parser.add_argument("--manifest-bucket", default=os.environ.get("VECTOR_MANIFEST_BUCKET"))
+    parser.add_argument("--manifest-key", default=os.environ.get("VECTOR_MANIFEST_KEY", generations.DEFAULT_MANIFEST_KEY))
+    parser.add_argument("--vector-bucket", default=os.environ.get("VECTOR_BUCKET"))
+    parser.add_argument("--partitions-bucket", default=os.environ.get("VECTOR_PARTITIONS_BUCKET"))
+    parser.add_argument("--partitions-key", default=os.environ.get("VECTOR_PARTITIONS_KEY", partitions.DEFAULT_ROUTING_KEY))
+    parser.add_argument("--region", default=os.environ.get("AWS_REGION", "us-east-1"))
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("show", help="Print the manifest")
+
+    p_init = sub.add_parser("init", help="Create the manifest around an existing index")
+    p_init.add_argument("--active", required=True)
+    p_init.add_argument("--model-id", default=embeddings.DEFAULT_MODEL_ID)
+    p_init.add_argument("--dims", type=int, default=embeddings.DEFAULT_DIMS)
+
+    p_stage = sub.add_parser("create-staging", help="Register a new staging generation")
+    p_stage.add_argument("name")
+    p_stage.add_argument("--model-id", default=embeddings.DEFAULT_MODEL_ID)
+    p_stage.add_argument("--dims", type=int, default=embeddings.DEFAULT_DIMS)
+    p_stage.add_argument("--create-index", action="store_true")
+
+    sub.add_parser("cutover", help="Promote staging to active")
+    sub.add_parser("rollback", help="Re-activate the previous generation")
+
+    p_gc = sub.add_parser("gc", help="Delete indexes of old generations")
+    p_gc.add_argument("--keep", type=int, default=1, help="Previous generations to keep for rollback")
+    p_gc.add_argument("--dry-run", action="store_true")
+
+    args = parser.parse_args(argv)
+    if not args.manifest_bucket:
+        parser.error("--manifest-bucket (or VECTOR_MANIFEST_BUCKET) is required")
+
+    s3 = boto3.client("s3", region_name=args.region)
+    store = generations.ManifestStore(s3, args.manifest_bucket, args.manifest_key)
+    routing = (
+        partitions.RoutingStore(s3, args.partitions_bucket, args.partitions_key).get()
+        if args.partitions_bucket else partitions.empty_routing()
+    )
+
+    if args.command == "show":
+        manifest, _ = store.load()
+        print(json.dumps(manifest, indent=2))
+        return
+
+    if args.command == "init":
+        def init(manifest):
+            if manifest.get("active"):
+                raise generations.GenerationError(f"manifest already exists (active={manifest['active']})")
+            manifest.update(generations.empty_manifest(args.active, args.model_id, args.dims))
+        manifest = store.update(init)
+
+    elif args.command == "create-staging":
+        if args.create_index:
+            if not args.vector_bucket:
+                parser.error("--create-index needs --vector-bucket (or VECTOR_BUCKET)")
+            from backfill import ensure_index
+            s3v = boto3.client("s3vectors", region_name=args.region)
+            for partition in partitions.all_partitions(routing):
+                ensure_index(s3v, args.vector_bucket, partitions.index_name(args.name, partition), args.dims)
+        manifest = store.update(lambda m: generations.create_staging(m, args.name, args.model_id, args.dims))
+
+    elif args.command == "cutover":
+        manifest = store.update(generations.cutover)
+
+    elif args.command == "rollback":
+        manifest = store.update(generations.rollback)
+
+    elif args.command == "gc":
+        if not args.vector_bucket:
+            parser.error("gc needs --vector-bucket (or VECTOR_BUCKET)")
+        manifest, _ = store.load()
+        doomed = generations.collectable(manifest, keep=args.keep)
+        if not doomed or args.dry_run:
+            print(f"{'Would delete' if args.dry_run else 'Nothing to delete'}: {doomed}")
+            return
+        s3v = boto3.client("s3vectors", region_name=args.region)
+        # Unpublish first so no writer targets an index that is going away.
+        manifest = store.update(lambda m: generations.mark_deleted(m, doomed))
+        for name in doomed:
+            for index in (partitions.index_name(name, p) for p in partitions.all_partitions(routing)):
+                try:
+                    s3v.delete_index(vectorBucketName=args.vector_bucket, indexName=index)
+                    print(f"Deleted index {index}")
+                except s3v.exceptions.NotFoundException:
+                    print(f"Index {index} already gone")
+
+    print(f"active={manifest['active']} staging={manifest['staging']} "
+          f"history={manifest['history']} (manifest v{manifest['version']})")
+
+
+if __name__ == "__main__":
+    main()
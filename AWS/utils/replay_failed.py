@@ -0,0 +1,117 @@
+"""
+Replay parked (failed) indexing events.
+
+Failed papers keep the event that failed in their ``failure`` map on the
+metadata item (see paper_common.failures). This re-drives them: the item is
+reset to ``uploaded`` and the stored event is sent again, asynchronously, to
+the Lambda that owns the failed stage.
+
+Usage:
+
+    python AWS/utils/replay_failed.py \\
+        --table research-papers-metadata \\
+        --index-pdf-arn  arn:aws:lambda:...:function:IndexPdfLambda \\
+        --chunk-embed-arn arn:aws:lambda:...:function:ChunkAndEmbedLambda \\
+        [--user dev-user] [--stage embedding] [--include-permanent] \\
+        [--rate 5] [--limit 100] [--dry-run]
+
+By default only transient failures (throttling, timeouts) are replayed;
+``--include-permanent`` also retries ones classified as permanent, e.g.
+after fixing a bug. ``--rate`` caps invocations per second so a large
+replay does not start its own throttling storm.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "layers", "paper_common", "python"))
+
+from paper_common import jobs  # noqa: E402
+from paper_common.retry import PERMANENT  # noqa: E402
+
+INDEX_STAGES = {jobs.UPLOADED, jobs.EXTRACTING, "unknown"}
+
+
+def iter_failed(table, user_id=None):
+    condition = Attr("status").eq(jobs.FAILED)
+    if user_id:
+        condition = condition & Attr("user_id").eq(user_id)
+    kwargs = {"FilterExpression": condition}
+    while True:
+        resp = table.scan(**kwargs)
+        yield from resp.get("Items", [])
+        if "LastEvaluatedKey" not in resp:
+            return
+        kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay failed indexing events.")
+    parser.add_argument("--table", default=os.environ.get("METADATA_TABLE", "research-papers-metadata"))
+    parser.add_argument("--index-pdf-arn", default=os.environ.get("INDEX_PDF_LAMBDA_ARN"))
+    parser.add_argument("--chunk-embed-arn", default=os.environ.get("CHUNK_EMBED_LAMBDA_ARN"))
+    parser.add_argument("--region", default=os.environ.get("AWS_REGION", "us-east-1"))
+    parser.add_argument("--user", help="Only replay this user's papers")
+    parser.add_argument("--stage", help="Only replay failures of this stage")
+    parser.add_argument("--include-permanent", action="store_true")
+    parser.add_argument("--rate", type=float, default=5.0, help="Max invocations per second")
+    parser.add_argument("--limit", type=int, default=0, help="Stop after this many replays (0 = no limit)")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    table = boto3.resource("dynamodb", region_name=args.region).Table(args.table)
+    lambda_client = boto3.client("lambda", region_name=args.region)
+
+    replayed = skipped = 0
+    interval = 1.0 / args.rate if args.rate > 0 else 0.0
+
+    for item in iter_failed(table, args.user):
+        document_id = item["document_id"]
+        failure = item.get("failure") or {}
+        stage = failure.get("stage") or item.get("failed_stage") or "unknown"
+
+        if args.stage and stage != args.stage:
+            continue
+        if failure.get("classification") == PERMANENT and not args.include_permanent:
+            skipped += 1
+            continue
+        if not failure.get("event"):
+            print(f"SKIP {document_id}: no stored event (failed before dead-letter handling)")
+            skipped += 1
+            continue
+
+        function_name = args.index_pdf_arn if stage in INDEX_STAGES else args.chunk_embed_arn
+        if not function_name:
+            print(f"SKIP {document_id}: no Lambda ARN configured for stage={stage}")
+            skipped += 1
+            continue
+
+        event = {**json.loads(failure["event"]), "attempt": 0, "wait": False}
+        print(f"{'DRY-RUN ' if args.dry_run else ''}REPLAY {document_id} stage={stage} "
+              f"({failure.get('classification')}: {failure.get('message', '')[:80]})")
+
+        if not args.dry_run:
+            jobs.StatusRecorder(table, document_id).set_status(
+                jobs.UPLOADED, replayed_at=jobs.utc_now(), replay_count=int(item.get("replay_count", 0)) + 1
+            )
+            lambda_client.invoke(
+                FunctionName=function_name,
+                InvocationType="Event",
+                Payload=json.dumps(event),
+            )
+            time.sleep(interval)
+
+        replayed += 1
+        if args.limit and replayed >= args.limit:
+            break
+
+    print(f"Replayed {replayed}, skipped {skipped}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""
+Manage per-user vector index partitions (see paper_common.partitions).
+
+    python AWS/utils/vector_partitions.py show
+    python AWS/utils/vector_partitions.py set-thresholds --user-vectors 20000 --shard-vectors 200000
+    python AWS/utils/vector_partitions.py rebalance [--dry-run]
+
+``rebalance`` sums each user's vectors from the metadata table
+(``num_chunks``) and, when a user or a shard is past the thresholds,
+migrates to the planned layout:
+
+1. creates the new partitions' indexes in every generation;
+2. publishes the layout as ``next`` and waits one routing TTL, so every
+   ChunkAndEmbedLambda writes moved users' vectors to both partitions;
+3. copies the moved users' existing vectors (GetVectors -> PutVectors);
+4. commits the layout and waits one TTL, so every QueryRagLambda reads the
+   new partitions;
+5. deletes the moved vectors from their old partitions.
+
+Run it on a schedule (cron, EventBridge + a container task): it does
+nothing while partitions are within the thresholds, and an interrupted run
+resumes from the routing table's state. Don't run it during a backfill.
+
+The routing table location comes from --partitions-bucket/--partitions-key
+or the VECTOR_PARTITIONS_BUCKET/VECTOR_PARTITIONS_KEY env vars the Lambdas
+and the backend use; generations from --manifest-bucket (or --vector-index
+without a manifest).
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "layers", "paper_common", "python"))
+
+from paper_common import embeddings, generations, keys, partitions  # noqa: E402
+from paper_common.retry import call_with_retry  # noqa: E402
+
+VECTOR_BATCH = 100              # keys per GetVectors / PutVectors call
+DELETE_BATCH = 500              # keys per DeleteVectors call
+
+
+def scan_papers(table) -> dict[str, list[dict]]:
+    """user_id -> [{"document_id", "num_chunks"}] for every paper in the metadata table."""
+    papers: dict[str, list[dict]] = {}
+    kwargs = {"ProjectionExpression": "document_id, user_id, num_chunks"}
+    while True:
+        resp = table.scan(**kwargs)
+        for item in resp.get("Items", []):
+            if item.get("user_id"):
+                papers.setdefault(item["user_id"], []).append(item)
+        if "LastEvaluatedKey" not in resp:
+            return papers
+        kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
+class Mover:
+    """Copies / deletes one user's vectors between two indexes, paper by paper."""
+
+    def __init__(self, s3v, vector_bucket: str, table):
+        self.s3v = s3v
+        self.vector_bucket = vector_bucket
+        self.table = table
+
+    def _get(self, index: str, vector_keys: list[str]) -> list[dict]:
+        return call_with_retry(
+            self.s3v.get_vectors, vectorBucketName=self.vector_bucket, indexName=index, keys=vector_keys,
+            returnData=True, returnMetadata=True,
+        ).get("vectors", [])
+
+    def _paper_batches(self, index: str, user_id: str, paper: dict):
+        """Yields the paper's vectors in ``index``, VECTOR_BATCH at a time."""
+        num_chunks = paper.get("num_chunks")
+        start = 0
+        while num_chunks is None or start < int(num_chunks):
+            end = start + VECTOR_BATCH if num_chunks is None else min(start + VECTOR_BATCH, int(num_chunks))
+            found = self._get(index, [keys.vector_key(user_id, paper["document_id"], i) for i in range(start, end)])
+            if num_chunks is None and not found:
+                return                                  # probed past the last chunk
+            yield found
+            start = end
+
+    def copy(self, src: str, dst: str, user_id: str, papers: list[dict]) -> int:
+        copied = 0
+        for paper in papers:
+            paper_keys = []
+            for batch in self._paper_batches(src, user_id, paper):
+                if batch:
+                    call_with_retry(self.s3v.put_vectors, vectorBucketName=self.vector_bucket, indexName=dst,
+                                    vectors=[{"key": v["key"], "data": v["data"], "metadata": v["metadata"]}
+                                             for v in batch])
+                    paper_keys.extend(v["key"] for v in batch)
+            # A paper deleted while it was being copied must not come back in dst.
+            if paper_keys and "Item" not in self.table.get_item(Key={"document_id": paper["document_id"]}):
+                self._delete(dst, paper_keys)
+                continue
+            copied += len(paper_keys)
+        return copied
+
+    def _delete(self, index: str, vector_keys: list[str]) -> None:
+        for i in range(0, len(vector_keys), DELETE_BATCH):
+            call_with_retry(self.s3v.delete_vectors, vectorBucketName=self.vector_bucket, indexName=index,
+                            keys=vector_keys[i:i + DELETE_BATCH])
+
+    def drain(self, index: str, user_id: str, papers: list[dict]) -> int:
+        deleted = 0
+        for paper in papers:
+            for batch in self._paper_batches(index, user_id, paper):
+                self._delete(index, [v["key"] for v in batch])
+                deleted += len(batch)
+        return deleted
+
+
+def _run(pool: ThreadPoolExecutor, fn, moves, generation_names, papers) -> int:
+    futures = [
+        pool.submit(fn, user_id, name, src, dst, papers.get(user_id, []))
+        for user_id, src, dst in moves for name in generation_names
+    ]
+    return sum(f.result() for f in futures)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage per-user vector index partitions.")
+    parser.add_argument("--partitions-bucket", default=os.environ.get("VECTOR_PARTITIONS_BUCKET"))
+    parser.add_argument("--partitions-key", default=os.environ.get("VECTOR_PARTITIONS_KEY", partitions.DEFAULT_ROUTING_KEY))
+    parser.add_argument("--manifest-bucket", default=os.environ.get("VECTOR_MANIFEST_BUCKET"))
+    parser.add_argument("--manifest-key", default=os.environ.get("VECTOR_MANIFEST_KEY", generations.DEFAULT_MANIFEST_KEY))
+    parser.add_argument("--vector-index", default=os.environ.get("VECTOR_INDEX"), help="The index, without a manifest")
+    parser.add_argument("--dims", type=int, default=embeddings.DEFAULT_DIMS, help="Its dimensions, without a manifest")
+    parser.add_argument("--vector-bucket", default=os.environ.get("VECTOR_BUCKET"))
+    parser.add_argument("--table", default=os.environ.get("METADATA_TABLE", "research-papers-metadata"))
+    parser.add_argument("--region", default=os.environ.get("AWS_REGION", "us-east-1"))
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("show", help="Print the routing table")
+
+    p_thresholds = sub.add_parser("set-thresholds", help="Change when rebalance splits partitions")
+    p_thresholds.add_argument("--user-vectors", type=int, help="Give a user their own partition past this")
+    p_thresholds.add_argument("--shard-vectors", type=int, help="Double the shards when one holds more than this")
+
+    p_rebalance = sub.add_parser("rebalance", help="Split partitions that grew past the thresholds")
+    p_rebalance.add_argument("--dry-run", action="store_true")
+    p_rebalance.add_argument("--threads", type=int, default=8, help="Users copied / drained in parallel")
+    p_rebalance.add_argument("--wait", type=float, default=float(os.environ.get("VECTOR_PARTITIONS_TTL", "30")) + 5,
+                             help="Seconds for a routing change to reach every Lambda (routing TTL + margin)")
+
+    args = parser.parse_args(argv)
+    if not args.partitions_bucket:
+        parser.error("--partitions-bucket (or VECTOR_PARTITIONS_BUCKET) is required")
+
+    s3 = boto3.client("s3", region_name=args.region)
+    store = partitions.RoutingStore(s3, args.partitions_bucket, args.partitions_key)
+
+    if args.command == "show":
+        routing, _ = store.load()
+        print(json.dumps(routing, indent=2))
+        return
+
+    if args.command == "set-thresholds":
+        def set_thresholds(routing):
+            for name, value in (("user_vectors", args.user_vectors), ("shard_vectors", args.shard_vectors)):
+                if value is not None:
+                    routing.setdefault("thresholds", {})[name] = value
+        routing = store.update(set_thresholds)
+        print(f"thresholds={routing['thresholds']} (routing v{routing['version']})")
+        return
+
+    # ---- rebalance ----
+    if not args.vector_bucket:
+        parser.error("rebalance needs --vector-bucket (or VECTOR_BUCKET)")
+    if args.manifest_bucket:
+        manifest, _ = generations.ManifestStore(s3, args.manifest_bucket, args.manifest_key).load()
+        if manifest.get("staging"):
+            sys.exit(f"Not rebalancing: generation {manifest['staging']} is being backfilled")
+        gens = [generations.generation_info(manifest, name) for name in generations.undeleted(manifest)]
+    elif args.vector_index:
+        gens = [{"index": args.vector_index, "dims": args.dims}]
+    else:
+        parser.error("rebalance needs --manifest-bucket or --vector-index")
+    generation_names = [g["index"] for g in gens]
+
+    table = boto3.resource("dynamodb", region_name=args.region).Table(args.table)
+    s3v = boto3.client("s3vectors", region_name=args.region)
+    mover = Mover(s3v, args.vector_bucket, table)
+    papers = scan_papers(table)
+    routing, _ = store.load()
+
+    def copy(user_id, name, src, dst, user_papers):
+        return mover.copy(partitions.index_name(name, src), partitions.index_name(name, dst), user_id, user_papers)
+
+    def drain(user_id, name, src, dst, user_papers):
+        return mover.drain(partitions.index_name(name, src), user_id, user_papers)
+
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        if not routing.get("next") and not routing.get("previous"):
+            counts = {
+                user_id: sum(int(p.get("num_chunks") or 0) for p in user_papers)
+                for user_id, user_papers in papers.items()
+            }
+            layout = partitions.plan(routing, counts)
+            if layout is None:
+                print(f"Balanced: {len(partitions.layout_partitions(routing['current']))} partitions, "
+                      f"largest user {max(counts.values(), default=0)} vectors")
+                return
+            moves = partitions.moved_users(routing["current"], layout, papers)
+            print(f"New layout: {layout['shards']} shards, {len(layout['dedicated'])} dedicated; "
+                  f"moving {len(moves)} users ({sum(counts[u] for u, _, _ in moves)} vectors)")
+            if args.dry_run:
+                for user_id, src, dst in moves:
+                    print(f"  {user_id}: {src} -> {dst} ({counts[user_id]} vectors)")
+                return
+
+            from backfill import ensure_index
+            existing = set(partitions.all_partitions(routing))
+            for partition in partitions.layout_partitions(layout):
+                if partition not in existing:
+                    for g in gens:
+                        ensure_index(s3v, args.vector_bucket, partitions.index_name(g["index"], partition), g["dims"])
+            routing = store.update(lambda r: partitions.begin(r, layout))
+            print(f"Published the new layout (routing v{routing['version']}); waiting {args.wait:.0f}s for writers")
+            time.sleep(args.wait)
+
+        elif args.dry_run:
+            print("A migration is in progress; run without --dry-run to finish it")
+            return
+
+        if routing.get("next"):
+            moves = partitions.moved_users(routing["current"], routing["next"], papers)
+            copied = _run(pool, copy, moves, generation_names, papers)
+            print(f"Copied {copied} vectors of {len(moves)} users")
+            routing = store.update(partitions.commit)
+            print(f"Committed (routing v{routing['version']}); waiting {args.wait:.0f}s for readers")
+            time.sleep(args.wait)
+
+        moves = partitions.moved_users(routing["previous"], routing["current"], papers)
+        deleted = _run(pool, drain, moves, generation_names, papers)
+        routing = store.update(partitions.finish_drain)
+        print(f"Deleted {deleted} vectors from old partitions; {routing['current']['shards']} shards, "
+              f"{len(routing['current']['dedicated'])} dedicated (routing v{routing['version']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+Deleting papers together with everything derived from them.
+
+A paper leaves four things behind: the PDF (``s3_bucket``/``s3_key``), the
+extracted text in TEXT_BUCKET (``.txt`` and/or ``.pta`` artifact), one vector per chunk in every index
+generation, and its metadata row. ``PaperDeleter.delete`` removes all of
+them for many papers at once:
+
+* PDFs and texts with S3 ``delete_objects`` (up to 1000 keys per call);
+* vectors with ``delete_vectors`` (up to 500 keys per call) in every
+  generation of the index manifest - retired ones included, since a
+  rollback could make them live again - and in every partition of it the
+  owner's vectors may be in (paper_common.partitions). Vector keys are deterministic
+  (paper_common.keys), so the ``num_chunks`` recorded at indexing time is
+  enough to address them without listing; papers without one (not indexed
+  yet, or older rows) are probed with ``get_vectors`` batch by batch.
+
+Text and vectors are filed under the (user, paper) ids IndexPdfLambda
+derived: the item's ``user_id``/``document_id`` for jobs the API queued,
+and ids taken from the PDF key for S3-triggered indexing - for PDFs stored
+under ``uploads/`` before the ``user/<uid>/papers/`` layout, user
+``dev-user`` and ``<document_id>-<stem>`` (``keys.ids_from_pdf_key``). Both
+are deleted. A paper without an ``s3_key`` is reported ``partial``: its
+row is deleted, but artifacts filed under other ids may remain.
+
+These calls run in parallel. A paper's metadata row is deleted last, and
+only once all its artifacts are gone, so a partly failed delete can simply
+be retried. A paper still being indexed may get vectors written after its
+delete; deleting it again once it has settled removes them.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from paper_common import generations, keys, partitions
+
+import metrics
+
+S3_DELETE_BATCH = 1000          # keys per DeleteObjects call
+VECTOR_DELETE_BATCH = 500       # keys per DeleteVectors call
+VECTOR_GET_BATCH = 100          # keys per GetVectors call
+PROJECTION = "document_id, user_id, s3_bucket, s3_key, num_chunks"
+
+
+def _batches(items: List, size: int) -> Iterable[List]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class PaperDeleter:
+    def __init__(self, s3, table, text_bucket: Optional[str] = None, s3v=None, vector_bucket: Optional[str] = None,
+                 generation_source=None, routing_source=None, concurrency: int = 8):
+        self.s3 = s3
+        self.table = table
+        self.text_bucket = text_bucket
+        self.s3v = s3v
+        self.vector_bucket = vector_bucket
+        self.generation_source = generation_source
+        self.routing_source = routing_source or partitions.StaticRouting()
+        self.concurrency = concurrency
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix="delete")
+            return self._executor
+
+    def indexes(self, user_id: str) -> List[str]:
+        """Every vector index (generation x partition) that may hold the user's vectors."""
+        if self.s3v is None or not self.vector_bucket or self.generation_source is None:
+            return []
+        if isinstance(self.generation_source, generations.StaticGenerations):
+            names = [self.generation_source.active()["index"]]
+        else:
+            names = generations.undeleted(self.generation_source.get())
+        stored = partitions.stored_partitions(self.routing_source.get(), user_id)
+        return [partitions.index_name(name, partition) for name in names for partition in stored]
+
+    # ---- resolving papers ----
+
+    def _get(self, document_id: str) -> Optional[Dict]:
+        with metrics.timed("dynamodb_get_item", source="delete"):
+            return self.table.get_item(
+                Key={"document_id": document_id},
+                ProjectionExpression=PROJECTION,
+            ).get("Item")
+
+    def user_papers(self, user_id: str) -> List[Dict]:
+        items, kwargs = [], {}
+        while True:
+            with metrics.timed("dynamodb_scan", source="delete"):
+                response = self.table.scan(
+                    FilterExpression="user_id = :uid",
+                    ProjectionExpression=PROJECTION,
+                    ExpressionAttributeValues={":uid": user_id},
+                    **kwargs,
+                )
+            items.extend(response.get("Items", []))
+            if "LastEvaluatedKey" not in response:
+                return items
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    # ---- artifacts ----
+
+    def _delete_objects(self, bucket: str, object_keys: List[str]) -> Dict[str, str]:
+        """Deletes one batch; returns key -> error for the keys S3 could not delete."""
+        with metrics.timed("s3_delete_objects", source="delete"):
+            response = self.s3.delete_objects(
+                Bucket=bucket,
+                Delete={"Objects": [{"Key": k} for k in object_keys], "Quiet": True},
+            )
+        return {e["Key"]: f"{e.get('Code')}: {e.get('Message', '')}" for e in response.get("Errors", [])}
+
+    def _delete_vectors(self, index: str, vector_keys: List[str]) -> None:
+        with metrics.timed("s3vectors_delete_vectors", source="delete"):
+            self.s3v.delete_vectors(vectorBucketName=self.vector_bucket, indexName=index, keys=vector_keys)
+
+    def _probe_vectors(self, index: str, user_id: str, document_id: str) -> int:
+        """Deletes a paper's vectors without knowing its chunk count; returns how many were found."""
+        start, found = 0, 0
+        while True:
+            batch = [keys.vector_key(user_id, document_id, i) for i in range(start, start + VECTOR_GET_BATCH)]
+            with metrics.timed("s3vectors_get_vectors", source="delete"):
+                existing = self.s3v.get_vectors(
+                    vectorBucketName=self.vector_bucket, indexName=index, keys=batch,
+                ).get("vectors", [])
+            if not existing:
+                return found
+            self._delete_vectors(index, [v["key"] for v in existing])
+            found += len(existing)
+            start += VECTOR_GET_BATCH
+
+    @staticmethod
+    def pipeline_ids(paper: Dict) -> List[Tuple[str, str]]:
+        """(user_id, paper_id) pairs the paper's text and vectors may be stored under."""
+        ids = [(paper["user_id"], paper["document_id"])]
+        if paper.get("s3_key"):
+            ids.append(keys.ids_from_pdf_key(paper["s3_key"]))
+        return list(dict.fromkeys(ids))
+
+    def _artifact_tasks(self, papers: List[Dict]) -> List[tuple]:
+        """(callable, args, document_ids it covers) for every batched delete."""
+        tasks = []
+        by_bucket: Dict[str, List[tuple]] = {}          # bucket -> [(key, document_id)]
+        for paper in papers:
+            if paper.get("s3_bucket") and paper.get("s3_key"):
+                by_bucket.setdefault(paper["s3_bucket"], []).append((paper["s3_key"], paper["document_id"]))
+            if self.text_bucket:
+                # Either format may exist (TEXT_FORMAT changed, or a backfill); deleting a missing key is a no-op.
+                for user_id, paper_id in self.pipeline_ids(paper):
+                    for text_key in (keys.text_key, keys.artifact_key):
+                        by_bucket.setdefault(self.text_bucket, []).append(
+                            (text_key(user_id, paper_id), paper["document_id"]),
+                        )
+        for bucket, entries in by_bucket.items():
+            for batch in _batches(entries, S3_DELETE_BATCH):
+                owners = dict(batch)
+                tasks.append((self._delete_objects, (bucket, list(owners)), owners))
+
+        known: Dict[str, List[tuple]] = {}             # index -> [(vector key, document_id)]
+        for paper in papers:
+            for user_id, paper_id in self.pipeline_ids(paper):
+                # num_chunks is recorded on the item only by jobs filed under its own ids.
+                num_chunks = paper.get("num_chunks") if paper_id == paper["document_id"] else None
+                for index in self.indexes(user_id):
+                    if num_chunks is None:
+                        tasks.append((
+                            self._probe_vectors, (index, user_id, paper_id),
+                            {None: paper["document_id"]},
+                        ))
+                        continue
+                    known.setdefault(index, []).extend(
+                        (keys.vector_key(user_id, paper_id, i), paper["document_id"])
+                        for i in range(int(num_chunks))
+                    )
+        for index, entries in known.items():
+            for batch in _batches(entries, VECTOR_DELETE_BATCH):
+                owners = dict(batch)
+                tasks.append((self._delete_vectors, (index, list(owners)), owners))
+        return tasks
+
+    def _run_artifacts(self, papers: List[Dict]) -> Dict[str, List[str]]:
+        """Deletes every artifact of ``papers`` in parallel; returns document_id -> errors."""
+        tasks = self._artifact_tasks(papers)
+        futures = [(self._pool().submit(fn, *args), owners) for fn, args, owners in tasks]
+        errors: Dict[str, List[str]] = {}
+        for future, owners in futures:
+            try:
+                failed_keys = future.result()
+            except Exception as e:
+                print(f"Artifact delete failed: {e}")
+                for document_id in set(owners.values()):
+                    errors.setdefault(document_id, []).append(f"{type(e).__name__}: {e}")
+                continue
+            if isinstance(failed_keys, dict):           # per-key errors of delete_objects
+                for key, error in failed_keys.items():
+                    errors.setdefault(owners[key], []).append(f"{key}: {error}")
+        return errors
+
+    def _delete_rows(self, document_ids: List[str]) -> None:
+        with metrics.timed("dynamodb_batch_write_item", source="delete"):
+            with self.table.batch_writer() as batch:
+                for document_id in document_ids:
+                    batch.delete_item(Key={"document_id": document_id})
+
+    # ---- entry points ----
+
+    def _delete(self, user_id: str, document_ids: Optional[List[str]]) -> List[Dict]:
+        if document_ids is None:
+            papers = self.user_papers(user_id)
+            report = {p["document_id"]: None for p in papers}
+        else:
+            document_ids = list(dict.fromkeys(document_ids))
+            found = list(self._pool().map(self._get, document_ids))
+            report, papers = {}, []
+            for document_id, paper in zip(document_ids, found):
+                if paper is None:
+                    report[document_id] = {"status": "not_found"}
+                elif paper.get("user_id") != user_id:
+                    report[document_id] = {"status": "forbidden"}
+                else:
+                    report[document_id] = None
+                    papers.append(paper)
+
+        errors = self._run_artifacts(papers) if papers else {}
+        done = [p["document_id"] for p in papers if p["document_id"] not in errors]
+        try:
+            if done:
+                self._delete_rows(done)
+        except Exception as e:
+            print(f"Metadata delete failed: {e}")
+            for document_id in done:
+                errors[document_id] = [f"{type(e).__name__}: {e}"]
+        for paper in papers:
+            document_id = paper["document_id"]
+            if document_id in errors:
+                report[document_id] = {"status": "failed", "errors": errors[document_id]}
+            elif not paper.get("s3_key"):
+                report[document_id] = {
+                    "status": "partial",
+                    "errors": ["no s3_key: text and vectors filed under other ids may remain"],
+                }
+            else:
+                report[document_id] = {"status": "deleted"}
+        return [{"document_id": document_id, **outcome} for document_id, outcome in report.items()]
+
+    async def delete(self, user_id: str, document_ids: Optional[List[str]] = None) -> List[Dict]:
+        """
+        Deletes ``document_ids`` (or every paper of ``user_id`` when None).
+        One report entry per id: deleted, partial (deleted, but some
+        artifacts could not be addressed; see ``errors``), not_found,
+        forbidden (another user's paper) or failed (with ``errors``; the
+        paper is kept).
+        """
+        return await asyncio.to_thread(self._delete, user_id, document_ids)
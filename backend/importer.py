@@ -0,0 +1,296 @@
+"""
+Server-side import of search hits (arXiv / Semantic Scholar) into a library.
+
+``Importer.run`` takes resolved ``Candidate``s, reports the ones already in
+the user's library (same arXiv id, DOI or title, matched with
+merge.Merger) or repeated in the request as duplicates, and downloads the
+rest concurrently: at most ``concurrency`` downloads in flight, and at most
+``per_host`` against one host. Each PDF is streamed from upstream straight
+into S3 - one PutObject when it fits in a single part, a multipart upload
+otherwise - so a download holds at most one part in memory whatever its
+size. Then the metadata row is written and the caller queues indexing.
+
+Downloads go through a fetcher with an ``open(url)`` context manager that
+yields byte chunks. ``HttpPdfFetcher`` (httpx) is the real one; tests and
+benchmarks can pass their own, or point the PDF URL templates at a local
+file server.
+"""
+import asyncio
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional
+from urllib.parse import urlsplit
+from uuid import uuid4
+
+from paper_common import jobs as job_states
+
+import merge
+import metrics
+import uploads
+
+PART_SIZE = 8 * 1024 * 1024             # S3 multipart part size (min 5 MiB)
+PDF_MAGIC = b"%PDF-"
+
+
+class FetchError(Exception):
+    """The download failed or did not return a PDF."""
+
+
+@dataclass
+class Candidate:
+    """A search hit to import, with everything needed to store it."""
+    source: str                             # "arxiv" | "semantic_scholar"
+    id: str
+    title: str = ""
+    authors: List[str] = field(default_factory=list)
+    pdf_url: Optional[str] = None
+    abstract_snippet: str = ""
+    published: str = ""
+    arxiv_id: Optional[str] = None
+    doi: Optional[str] = None
+    error: Optional[str] = None             # why it cannot be imported (not found, no open-access PDF)
+
+    def as_result(self) -> Dict:
+        """Search-result shape, as merge.Merger expects."""
+        result = {"id": self.id, "title": self.title, "abstract_snippet": self.abstract_snippet}
+        if self.arxiv_id:
+            result["arxiv_id"] = self.arxiv_id
+        if self.doi:
+            result["doi"] = self.doi
+        return result
+
+
+class HttpPdfFetcher:
+    def __init__(self, timeout: float = 60.0, chunk_size: int = 1024 * 1024, user_agent: str = "paper-api-import/1.0"):
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.user_agent = user_agent
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _http(self):
+        with self._lock:
+            if self._client is None:
+                import httpx
+                self._client = httpx.Client(
+                    timeout=self.timeout, follow_redirects=True, headers={"User-Agent": self.user_agent},
+                )
+            return self._client
+
+    @contextmanager
+    def open(self, url: str) -> Iterator[Iterator[bytes]]:
+        with self._http().stream("GET", url) as response:
+            if response.status_code != 200:
+                raise FetchError(f"GET {url} returned HTTP {response.status_code}")
+            yield response.iter_bytes(self.chunk_size)
+
+
+class Importer:
+    def __init__(self, s3, table, bucket: str, fetcher, concurrency: int = 4, per_host: int = 2,
+                 max_bytes: int = 100 * 1024 * 1024):
+        self.s3 = s3
+        self.table = table
+        self.bucket = bucket
+        self.fetcher = fetcher
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.max_bytes = max_bytes
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._hosts: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+        self._in_flight = set()                     # (user_id, *identity) being imported
+
+    # ---- dedup ----
+
+    @staticmethod
+    def _identity(candidate: Candidate) -> tuple:
+        if candidate.arxiv_id:
+            return ("arxiv", candidate.arxiv_id)
+        if candidate.doi:
+            return ("doi", candidate.doi.lower())
+        return (candidate.source, candidate.id)
+
+    def _plan(self, candidates: List[Candidate], library: List[Dict]) -> Dict[int, Dict]:
+        """Report entries for candidates that must not be downloaded (keyed by position)."""
+        merger = merge.Merger("")
+        owners: Dict[int, Dict] = {}
+        for rank, item in enumerate(library):
+            result = {
+                "id": item["document_id"], "title": item.get("title"),
+                "abstract_snippet": item.get("abstract_snippet"),
+                "arxiv_id": item.get("arxiv_id"), "doi": item.get("doi"),
+            }
+            owners[merger.add(result, "library", rank)] = item
+
+        skipped: Dict[int, Dict] = {}
+        entries: Dict[int, int] = {}                # position -> merger entry
+        for position, candidate in enumerate(candidates):
+            if candidate.error:
+                skipped[position] = {"status": "failed", "error": candidate.error}
+            else:
+                entries[position] = merger.add(candidate.as_result(), candidate.source, position)
+
+        library_of = {}
+        for entry, item in owners.items():
+            library_of.setdefault(merger.find(entry), item)
+        first_of: Dict[int, Candidate] = {}         # root -> first candidate of that paper
+        for position, entry in entries.items():
+            candidate = candidates[position]
+            # Identifiers found in the URL / text are stored with the paper.
+            candidate.arxiv_id = candidate.arxiv_id or merger.entries[entry].arxiv_id
+            candidate.doi = candidate.doi or merger.entries[entry].doi
+            root = merger.find(entry)
+            if root in library_of:
+                skipped[position] = {"status": "duplicate", "document_id": library_of[root]["document_id"]}
+            elif root in first_of:
+                first = first_of[root]
+                skipped[position] = {"status": "duplicate", "duplicate_of": f"{first.source}:{first.id}"}
+            else:
+                first_of[root] = candidate
+        return skipped
+
+    # ---- download + store ----
+
+    def _host_slot(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return self._hosts[host]
+
+    def _stream_to_s3(self, chunks: Iterator[bytes], key: str, spool) -> int:
+        buffer = bytearray()
+        upload_id, parts, size, checked = None, [], 0, False
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise FetchError(f"PDF is larger than {self.max_bytes} bytes")
+                buffer += chunk
+                spool.write(chunk)
+                if not checked and len(buffer) >= len(PDF_MAGIC):
+                    if not buffer.startswith(PDF_MAGIC):
+                        raise FetchError("response is not a PDF")
+                    checked = True
+                if len(buffer) >= PART_SIZE:
+                    if upload_id is None:
+                        upload_id = self.s3.create_multipart_upload(
+                            Bucket=self.bucket, Key=key, ContentType="application/pdf",
+                        )["UploadId"]
+                    parts.append(self._upload_part(key, upload_id, len(parts) + 1, bytes(buffer)))
+                    buffer.clear()
+            if not checked:
+                raise FetchError("response is not a PDF")
+            if upload_id is None:
+                self.s3.put_object(Bucket=self.bucket, Key=key, Body=bytes(buffer), ContentType="application/pdf")
+                return size
+            if buffer:
+                parts.append(self._upload_part(key, upload_id, len(parts) + 1, bytes(buffer)))
+            self.s3.complete_multipart_upload(
+                Bucket=self.bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts},
+            )
+            return size
+        except BaseException:
+            if upload_id is not None:
+                try:
+                    self.s3.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+                except Exception as e:
+                    print(f"Aborting multipart upload of {key} failed: {e}")
+            raise
+
+    def _upload_part(self, key: str, upload_id: str, number: int, body: bytes) -> Dict:
+        response = self.s3.upload_part(Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=body)
+        return {"ETag": response["ETag"], "PartNumber": number}
+
+    @staticmethod
+    def _page_count(spool) -> int:
+        try:
+            from PyPDF2 import PdfReader
+            spool.seek(0)
+            return uploads.page_count(PdfReader(spool))
+        except Exception as e:
+            print(f"Could not count pages of imported PDF: {e}")
+            return 0
+
+    def _import_one(self, user_id: str, candidate: Candidate, on_imported) -> Dict:
+        document_id = str(uuid4())
+        # Same key layout as /upload, so IndexPdfLambda derives user_id/paper_id from it.
+        key = f"user/{user_id}/papers/{document_id}.pdf"
+        with tempfile.SpooledTemporaryFile(max_size=PART_SIZE) as spool:
+            with self._host_slot(candidate.pdf_url), metrics.timed("import_pdf", source=candidate.source):
+                with self.fetcher.open(candidate.pdf_url) as chunks:
+                    size = self._stream_to_s3(chunks, key, spool)
+            metrics.observe_payload("import_pdf", size)
+            page_count = self._page_count(spool)
+
+        item = {
+            "document_id": document_id,
+            "user_id": user_id,
+            "title": candidate.title or candidate.id,
+            "author": ", ".join(candidate.authors) or "Unknown",
+            "filename": f"{candidate.id.replace('/', '_')}.pdf",
+            "s3_key": key,
+            "s3_bucket": self.bucket,
+            "source": candidate.source,
+            "source_id": candidate.id,
+            "source_url": candidate.pdf_url,
+            "page_count": page_count,
+            "abstract_snippet": candidate.abstract_snippet,
+            "published": candidate.published,
+            "uploaded_at": datetime.utcnow().isoformat(),
+            "status": job_states.UPLOADED,
+            "status_updated_at": job_states.utc_now(),
+            "stage_timings": {},
+        }
+        if candidate.arxiv_id:
+            item["arxiv_id"] = candidate.arxiv_id
+        if candidate.doi:
+            item["doi"] = candidate.doi
+        with metrics.timed("dynamodb_put_item"):
+            self.table.put_item(Item=item)
+        if on_imported is not None:
+            on_imported(document_id, user_id, key)
+        return {"status": "imported", "document_id": document_id, "title": item["title"], "bytes": size,
+                "page_count": page_count}
+
+    def _guarded(self, user_id: str, candidate: Candidate, on_imported) -> Dict:
+        identity = (user_id,) + self._identity(candidate)
+        with self._lock:
+            if identity in self._in_flight:
+                return {"status": "duplicate", "in_progress": True}
+            self._in_flight.add(identity)
+        try:
+            return self._import_one(user_id, candidate, on_imported)
+        except Exception as e:
+            print(f"Import of {candidate.source}:{candidate.id} failed: {e}")
+            return {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+        finally:
+            with self._lock:
+                self._in_flight.discard(identity)
+
+    async def run(self, user_id: str, candidates: List[Candidate], library: List[Dict],
+                  on_imported: Optional[Callable[[str, str, str], None]] = None) -> List[Dict]:
+        """
+        One report entry per candidate, in order: imported, duplicate or
+        failed. ``library`` is the user's metadata rows;
+        ``on_imported(document_id, user_id, s3_key)`` runs after each import,
+        on the import worker thread.
+        """
+        skipped = self._plan(candidates, library)
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix="import")
+        loop = asyncio.get_running_loop()
+        todo = [i for i in range(len(candidates)) if i not in skipped]
+        done = await asyncio.gather(*(
+            loop.run_in_executor(self._executor, self._guarded, user_id, candidates[i], on_imported) for i in todo
+        ))
+        outcomes = {**skipped, **dict(zip(todo, done))}
+        return [
+            {"source": c.source, "id": c.id, **outcomes[i]}
+            for i, c in enumerate(candidates)
+        ]
@@ -0,0 +1,344 @@
+"""
+Indexing job queue for the upload -> index -> embed pipeline.
+
+Uploads are registered with status ``uploaded`` and submitted here. A fixed
+pool of workers drains a priority queue (interactive uploads before bulk
+imports) and hands each job to a runner:
+
+* ``LambdaPipelineRunner`` invokes IndexPdfLambda synchronously, which in
+  turn waits on ChunkAndEmbedLambda, so a worker slot is held for the whole
+  pipeline and ``JOB_CONCURRENCY`` really bounds the work in flight. The
+  Lambdas record each stage in the metadata table themselves. When a stage
+  is re-queued (or continued) asynchronously, the runner keeps the slot and
+  polls the table until the paper is indexed or failed.
+* ``LocalPipelineRunner`` runs the same stages in-process (PDF text
+  extraction, chunking, embedding) with injectable hooks; used for tests
+  and local development without Lambdas. ``VectorStore`` provides the
+  real hooks: Titan embeddings written to S3 Vectors like
+  ChunkAndEmbedLambda writes them.
+
+The queue lives in memory, so a restart or deploy drops the jobs waiting in
+it. ``claim_stale_jobs`` finds papers that have sat in a non-terminal state
+for longer than a lease and claims them, so the API re-submits them at
+startup (``JOB_LEASE_SECONDS``).
+"""
+import asyncio
+import itertools
+import json
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from enum import IntEnum
+from io import BytesIO
+from typing import Callable, Dict, List, Optional
+
+from paper_common import embeddings, keys, partitions
+from paper_common import jobs as job_states
+from paper_common.chunking import chunk_text
+from paper_common.failures import park_failure
+from paper_common.jobs import StatusRecorder
+from paper_common.retry import AdaptivePacer, call_with_retry, error_code
+
+PUT_BATCH_SIZE = 100            # vectors per put_vectors call
+
+
+class Priority(IntEnum):
+    """Lower value runs first."""
+    INTERACTIVE = 0
+    BULK = 10
+
+
+@dataclass(order=True)
+class Job:
+    priority: int
+    seq: int
+    document_id: str = field(compare=False)
+    user_id: str = field(compare=False)
+    bucket: str = field(compare=False)
+    key: str = field(compare=False)
+    enqueued_at: float = field(default_factory=time.monotonic, compare=False)
+
+
+class LambdaPipelineRunner:
+    """Runs a job by invoking IndexPdfLambda and waiting for the full pipeline."""
+
+    def __init__(self, lambda_client, function_arn: str, table, poll_interval: float = 5.0,
+                 max_wait: float = 3600.0):
+        self.lambda_client = lambda_client
+        self.function_arn = function_arn
+        self.table = table
+        self.poll_interval = poll_interval
+        self.max_wait = max_wait    # for re-queued jobs to reach indexed / failed
+
+    def _status(self, document_id: str) -> Optional[str]:
+        return self.table.get_item(
+            Key={"document_id": document_id},
+            ProjectionExpression="#s",
+            ExpressionAttributeNames={"#s": "status"},
+        ).get("Item", {}).get("status")
+
+    def _wait_until_terminal(self, job: Job) -> None:
+        deadline = time.monotonic() + self.max_wait
+        status = self._status(job.document_id)
+        while not job_states.is_terminal(status):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{job.document_id} still {status} after {self.max_wait:.0f}s")
+            time.sleep(self.poll_interval)
+            status = self._status(job.document_id)
+        if status == job_states.FAILED:
+            raise RuntimeError(f"Indexing failed for {job.document_id}")
+
+    def run(self, job: Job) -> None:
+        payload = {
+            "document_id": job.document_id,
+            "user_id": job.user_id,
+            "pdf_s3_bucket": job.bucket,
+            "pdf_s3_key": job.key,
+            "wait": True,
+        }
+        resp = self.lambda_client.invoke(
+            FunctionName=self.function_arn,
+            InvocationType="RequestResponse",
+            Payload=json.dumps(payload),
+        )
+        if resp.get("FunctionError"):
+            body = resp["Payload"].read().decode("utf-8", errors="replace")
+            # The Lambdas normally mark the failure themselves; this covers
+            # crashes before their first status write (timeouts, bad layer).
+            status = self._status(job.document_id)
+            error = RuntimeError(f"IndexPdfLambda failed for {job.document_id}: {body[:1000]}")
+            if not job_states.is_terminal(status):
+                payload.pop("wait")
+                park_failure(
+                    StatusRecorder(self.table, job.document_id), error,
+                    status or job_states.EXTRACTING, payload,
+                    attempts=1, function_name=self.function_arn,
+                )
+            raise error
+
+        result = json.loads(resp["Payload"].read().decode("utf-8") or "{}")
+        if result.get("status") == job_states.FAILED:
+            # Parked by the Lambda (it already marked the item failed).
+            raise RuntimeError(f"IndexPdfLambda failed for {job.document_id}: {result.get('error')}")
+        if result.get("statusCode") == 202:
+            self._wait_until_terminal(job)
+
+
+def extract_pdf_text(pdf_bytes: bytes) -> str:
+    import PyPDF2  # deferred: only the local runner needs it
+
+    reader = PyPDF2.PdfReader(BytesIO(pdf_bytes))
+    return "\n".join((page.extract_text() or "") for page in reader.pages)
+
+
+class VectorStore:
+    """
+    ``embed`` / ``store`` hooks for ``LocalPipelineRunner``: chunks are
+    embedded with the active generation's model and written, under the
+    same keys and metadata as ChunkAndEmbedLambda, to the job owner's
+    partition(s) of every generation being written (re-embedded for a
+    generation with another model or dimensions).
+    """
+
+    def __init__(self, bedrock, s3v, vector_bucket: str, generation_source, routing_source=None):
+        self.bedrock = bedrock
+        self.s3v = s3v
+        self.vector_bucket = vector_bucket
+        self.generation_source = generation_source
+        self.routing_source = routing_source or partitions.StaticRouting()
+        self.pacer = AdaptivePacer()
+
+    def _embed(self, chunks: List[str], model_id: str, dims: int) -> List[List[float]]:
+        return [
+            call_with_retry(embeddings.embed_text, self.bedrock, chunk, model_id=model_id, dims=dims, pacer=self.pacer)
+            for chunk in chunks
+        ]
+
+    def embed(self, chunks: List[str]) -> List[List[float]]:
+        active = self.generation_source.active()
+        return self._embed(chunks, active["model_id"], active["dims"])
+
+    def store(self, job: Job, chunks: List[str], vectors: List[List[float]]) -> None:
+        active = self.generation_source.active()
+        by_model = {(active["model_id"], active["dims"]): vectors}
+        routing = self.routing_source.get()
+        for target in self.generation_source.write_targets():
+            model = (target["model_id"], target["dims"])
+            if model not in by_model:
+                by_model[model] = self._embed(chunks, *model)
+            items = [
+                {
+                    "key": keys.vector_key(job.user_id, job.document_id, idx),
+                    "data": {"float32": by_model[model][idx]},
+                    "metadata": {
+                        "source_text": chunk,
+                        "user_id": job.user_id,
+                        "paper_id": job.document_id,
+                        "chunk_index": idx,
+                    },
+                }
+                for idx, chunk in enumerate(chunks)
+            ]
+            for partition in partitions.write_partitions(routing, job.user_id):
+                index = partitions.index_name(target["index"], partition)
+                for start in range(0, len(items), PUT_BATCH_SIZE):
+                    call_with_retry(
+                        self.s3v.put_vectors, vectorBucketName=self.vector_bucket, indexName=index,
+                        vectors=items[start:start + PUT_BATCH_SIZE],
+                    )
+
+
+class LocalPipelineRunner:
+    """
+    Runs the extract -> chunk -> embed stages in-process.
+
+    ``embed`` maps a list of chunk texts to vectors and ``store`` receives
+    ``(job, chunks, vectors)`` (see ``VectorStore``). A paper is only
+    marked indexed once ``store`` has returned.
+    """
+
+    def __init__(
+        self,
+        s3_client,
+        table,
+        embed: Callable[[List[str]], List[List[float]]],
+        store: Callable[[Job, List[str], List[List[float]]], None],
+        extract: Callable[[bytes], str] = extract_pdf_text,
+    ):
+        self.s3_client = s3_client
+        self.table = table
+        self.embed = embed
+        self.store = store
+        self.extract = extract
+
+    def run(self, job: Job) -> None:
+        status = StatusRecorder(self.table, job.document_id)
+
+        try:
+            with status.stage(job_states.EXTRACTING):
+                obj = self.s3_client.get_object(Bucket=job.bucket, Key=job.key)
+                text = self.extract(obj["Body"].read())
+
+            with status.stage(job_states.CHUNKING):
+                chunks = chunk_text(text)
+
+            with status.stage(job_states.EMBEDDING):
+                vectors = self.embed(chunks) if chunks else []
+                self.store(job, chunks, vectors)
+        except Exception as e:
+            event = {
+                "document_id": job.document_id,
+                "user_id": job.user_id,
+                "pdf_s3_bucket": job.bucket,
+                "pdf_s3_key": job.key,
+            }
+            park_failure(status, e, getattr(e, "pipeline_stage", "unknown"), event, attempts=1)
+            raise
+
+        status.set_status(job_states.INDEXED, num_chunks=len(chunks))
+
+
+class JobQueue:
+    """Bounded-concurrency priority queue of indexing jobs."""
+
+    def __init__(self, runner, concurrency: int = 4, on_done: Optional[Callable[[Job], None]] = None):
+        self.runner = runner
+        self.concurrency = concurrency
+        self.on_done = on_done          # called after every job, finished or failed
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._workers: List[asyncio.Task] = []
+        self.in_flight = 0
+
+    def submit(
+        self,
+        document_id: str,
+        user_id: str,
+        bucket: str,
+        key: str,
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> Job:
+        job = Job(int(priority), next(self._seq), document_id, user_id, bucket, key)
+        self._queue.put_nowait(job)
+        return job
+
+    def start(self) -> None:
+        if not self._workers:
+            self._workers = [
+                asyncio.create_task(self._worker(i)) for i in range(self.concurrency)
+            ]
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def join(self) -> None:
+        """Wait until every submitted job has finished (useful in tests)."""
+        await self._queue.join()
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "in_flight": self.in_flight,
+            "concurrency": self.concurrency,
+        }
+
+    async def _worker(self, worker_id: int) -> None:
+        while True:
+            job = await self._queue.get()
+            self.in_flight += 1
+            waited = time.monotonic() - job.enqueued_at
+            try:
+                await asyncio.to_thread(self.runner.run, job)
+                print(f"[JobQueue] worker={worker_id} finished {job.document_id} (queued {waited:.1f}s)")
+            except Exception as e:
+                print(f"[JobQueue] worker={worker_id} job {job.document_id} failed: {e}")
+            finally:
+                self.in_flight -= 1
+                self._queue.task_done()
+                if self.on_done is not None:
+                    self.on_done(job)
+
+
+def _claim(table, item: Dict) -> bool:
+    """Refresh the item's lease unless someone else (a pipeline stage, another worker) touched it first."""
+    try:
+        table.update_item(
+            Key={"document_id": item["document_id"]},
+            UpdateExpression="SET status_updated_at = :now",
+            ConditionExpression="status_updated_at = :seen",
+            ExpressionAttributeValues={":now": job_states.utc_now(), ":seen": item["status_updated_at"]},
+        )
+    except Exception as e:
+        if error_code(e) == "ConditionalCheckFailedException":
+            return False
+        raise
+    return True
+
+
+def claim_stale_jobs(table, lease_seconds: float) -> List[Dict]:
+    """
+    Papers still ``uploaded`` / ``extracting`` / ``chunking`` / ``embedding``
+    whose status has not changed for ``lease_seconds`` (their job was lost),
+    each claimed with a conditional write so only one API worker re-submits it.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=lease_seconds)).isoformat()
+    values = {f":s{i}": state for i, state in enumerate(job_states.STATES) if not job_states.is_terminal(state)}
+    kwargs = {
+        "FilterExpression": f"#s IN ({', '.join(values)}) AND status_updated_at < :cutoff",
+        "ProjectionExpression": "document_id, user_id, s3_bucket, s3_key, #s, status_updated_at",
+        "ExpressionAttributeNames": {"#s": "status"},
+        "ExpressionAttributeValues": {**values, ":cutoff": cutoff},
+    }
+    stale = []
+    while True:
+        resp = table.scan(**kwargs)
+        stale.extend(
+            item for item in resp.get("Items", [])
+            if item.get("s3_bucket") and item.get("s3_key") and _claim(table, item)
+        )
+        if "LastEvaluatedKey" not in resp:
+            return stale
+        kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
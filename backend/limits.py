@@ -0,0 +1,280 @@
+"""
+Per-user rate limiting and adaptive concurrency limits for upstream calls.
+
+Two independent guards keep one heavy client from degrading everyone:
+
+* ``RateLimiter`` - a token bucket per (rule, user): ``rate`` tokens per
+  second refill a bucket of ``burst``; each request takes one, and a request
+  finding the bucket empty is rejected with 429 and ``Retry-After``. Bucket
+  state lives in a store: ``MemoryBucketStore`` (per worker, the default) or
+  ``DynamoBucketStore`` (one DynamoDB item per bucket, shared by every
+  worker).
+* ``AdaptiveLimit`` - an AIMD concurrency limit per upstream (Semantic
+  Scholar, arXiv, S3, DynamoDB). Every call holds a slot; a call slower than
+  ``target_latency`` or failing with a transient error (throttling, 5xx,
+  timeout) cuts the limit by ``backoff``, at most once per
+  ``target_latency``, and calls within the target raise it by about one
+  slot per limit's worth of calls. When the upstream degrades, excess calls
+  wait up to ``queue_timeout`` for a slot and are then shed with
+  ``Overloaded`` (503) instead of piling up and dragging every request's
+  latency along.
+
+Calls made directly on the event loop thread never wait for a slot (that
+would stall every other request on the worker); they are shed at once, so
+``async`` handlers run their upstream calls with ``asyncio.to_thread``.
+"""
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from decimal import Decimal
+from typing import Callable, Dict, Optional, Tuple
+
+from botocore.exceptions import ClientError
+from paper_common import retry
+
+import metrics
+
+# upstream -> AdaptiveLimit settings. Targets sit well above the normal
+# latency of each upstream, so only real degradation shrinks a limit.
+DEFAULT_UPSTREAMS = {
+    "semantic_scholar": {"initial": 4, "max_limit": 16, "target_latency": 3.0},
+    "arxiv": {"initial": 2, "max_limit": 8, "target_latency": 5.0},
+    "s3": {"initial": 32, "max_limit": 128, "target_latency": 1.0},
+    "dynamodb": {"initial": 32, "max_limit": 128, "target_latency": 0.5},
+}
+
+
+class Overloaded(Exception):
+    """An upstream's concurrency limit is reached; retry after ``retry_after`` seconds."""
+
+    def __init__(self, upstream: str, retry_after: float = 1.0):
+        super().__init__(f"{upstream} is overloaded, retry later")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+def parse_rule(value: str) -> Optional[Tuple[float, float]]:
+    """``"rate,burst"`` (tokens per second, bucket size) -> (rate, burst); ``"0"`` or "" disables the rule."""
+    parts = [p.strip() for p in (value or "").split(",") if p.strip()]
+    if not parts or float(parts[0]) <= 0:
+        return None
+    rate = float(parts[0])
+    burst = float(parts[1]) if len(parts) > 1 else max(1.0, rate)
+    return rate, burst
+
+
+# ---- token buckets ----
+
+class MemoryBucketStore:
+    """Token buckets in this process (least recently used buckets are dropped past ``max_keys``)."""
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()   # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> Tuple[bool, float]:
+        """(allowed, tokens left)."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, tokens
+
+
+class DynamoBucketStore:
+    """
+    Token buckets shared by all workers, one item per bucket in ``table``
+    (partition key ``bucket_key``; enable TTL on ``expires_at`` so idle
+    buckets expire). Updates are optimistic: the write is conditional on
+    the ``updated_at`` that was read, and retried on a concurrent update.
+    """
+
+    def __init__(self, table, attempts: int = 3):
+        self.table = table
+        self.attempts = attempts
+
+    def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> Tuple[bool, float]:
+        for _ in range(self.attempts):
+            with metrics.timed("dynamodb_get_item", source="rate_limit"):
+                item = self.table.get_item(Key={"bucket_key": key}, ConsistentRead=True).get("Item")
+            now = time.time()
+            if item is None:
+                tokens, updated = burst, now
+            else:
+                tokens, updated = float(item["tokens"]), float(item["updated_at"])
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+            if tokens < cost:
+                return False, tokens        # nothing to write: the refill is recomputed from updated_at
+            tokens -= cost
+            try:
+                with metrics.timed("dynamodb_put_item", source="rate_limit"):
+                    self.table.put_item(
+                        Item={
+                            "bucket_key": key,
+                            "tokens": Decimal(str(round(tokens, 6))),
+                            "updated_at": Decimal(str(round(now, 6))),
+                            "expires_at": int(now + burst / rate) + 60,
+                        },
+                        **(
+                            {"ConditionExpression": "attribute_not_exists(bucket_key)"} if item is None else {
+                                "ConditionExpression": "updated_at = :prev",
+                                "ExpressionAttributeValues": {":prev": item["updated_at"]},
+                            }
+                        ),
+                    )
+            except ClientError as e:
+                if retry.error_code(e) != "ConditionalCheckFailedException":
+                    raise
+                continue
+            return True, tokens
+        # Still contended after every attempt: this bucket is being hammered.
+        return False, 0.0
+
+
+class RateLimiter:
+    def __init__(self, store, rules: Dict[str, Tuple[float, float]]):
+        self.store = store
+        self.rules = rules                  # rule name -> (rate, burst)
+
+    def check(self, rule: str, client_key: str, cost: float = 1.0) -> Tuple[bool, Dict[str, str]]:
+        """
+        (allowed, response headers) for one request of ``client_key`` under
+        ``rule``. If the store fails the request is allowed: an outage of
+        the limiter must not take the API down with it.
+        """
+        rate, burst = self.rules[rule]
+        try:
+            allowed, tokens = self.store.take(f"{rule}:{client_key}", rate, burst, cost)
+        except Exception as e:
+            print(f"Rate limiter store failed, allowing request: {e}")
+            return True, {}
+        headers = {"X-RateLimit-Limit": str(int(burst)), "X-RateLimit-Remaining": str(max(0, int(tokens)))}
+        if not allowed:
+            metrics.RATE_LIMITED.inc(rule=rule)
+            headers["Retry-After"] = str(max(1, math.ceil((cost - tokens) / rate)))
+        return allowed, headers
+
+
+# ---- adaptive concurrency ----
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def is_congestion(exc: BaseException) -> bool:
+    """Errors that say the upstream is struggling (as opposed to a bad request)."""
+    if isinstance(exc, Overloaded):
+        return False
+    if retry.classify_error(exc) == retry.TRANSIENT:
+        return True
+    status = getattr(exc, "status", None) or getattr(exc, "status_code", None)
+    if isinstance(status, int) and (status == 429 or status >= 500):
+        return True
+    name = type(exc).__name__
+    return "Timeout" in name or name in {"ServerErrorException", "ConnectError", "RemoteProtocolError"}
+
+
+class AdaptiveLimit:
+    def __init__(self, name: str, initial: int = 8, min_limit: int = 1, max_limit: int = 64,
+                 target_latency: float = 1.0, backoff: float = 0.75, queue_timeout: float = 2.0):
+        self.name = name
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        metrics.UPSTREAM_LIMIT.set(self.limit, upstream=name)
+
+    def acquire(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self.in_flight += 1
+            return True
+
+    def release(self, latency: float, failed: bool) -> None:
+        with self._cond:
+            busy = self.in_flight >= self.limit / 2
+            self.in_flight -= 1
+            now = time.monotonic()
+            if failed or latency > self.target_latency:
+                # Calls in flight together all see the same slowdown; one cut per
+                # target_latency keeps them from collapsing the limit at once.
+                if now - self._last_decrease >= self.target_latency:
+                    self.limit = max(float(self.min_limit), self.limit * self.backoff)
+                    self._last_decrease = now
+            elif busy:
+                # Grow only while the limit is actually in use.
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+            metrics.UPSTREAM_LIMIT.set(round(self.limit, 2), upstream=self.name)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """Hold one slot for a call; raises ``Overloaded`` if none frees up in time."""
+        if not self.acquire(0.0 if _on_event_loop() else self.queue_timeout):
+            metrics.UPSTREAM_REJECTED.inc(upstream=self.name)
+            raise Overloaded(self.name, retry_after=max(1.0, self.target_latency))
+        start = time.monotonic()
+        failed = False
+        try:
+            yield
+        except Exception as e:
+            failed = is_congestion(e)
+            raise
+        finally:
+            self.release(time.monotonic() - start, failed)
+
+    def wrap(self, fn: Callable) -> Callable:
+        def limited(*args, **kwargs):
+            with self.slot():
+                return fn(*args, **kwargs)
+        limited.__name__ = getattr(fn, "__name__", "limited")
+        return limited
+
+    def stats(self) -> Dict:
+        return {"limit": round(self.limit, 2), "in_flight": self.in_flight}
+
+
+class LimitedClient:
+    """
+    Proxy running every method call of ``client`` (a boto3 client or Table)
+    inside ``limit.slot()``. Other attributes (``exceptions``, ``meta``)
+    pass through.
+    """
+
+    def __init__(self, client, limit: AdaptiveLimit):
+        self.client = client
+        self._limit = limit
+
+    def __getattr__(self, attr):
+        value = getattr(self.client, attr)
+        if attr.startswith("_") or attr in ("exceptions", "meta") or not callable(value):
+            return value
+        return self._limit.wrap(value)
+
+    def __repr__(self) -> str:
+        return f"<LimitedClient {self._limit.name} {self.client!r}>"
@@ -1,49 +1,222 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Query
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-import boto3
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+import asyncio
+import dataclasses
+import json
+import math
 import os
-import arxiv 
-from semanticscholar import SemanticScholar
-import PyPDF2
+import time
 from io import BytesIO
 from datetime import datetime
 from decimal import Decimal
 
-# Try to import ApiError
-try:
-    from semanticscholar.rest import ApiError
-except ImportError:
-    try:
-        from semanticscholar import ApiError
-    except ImportError:
-        ApiError = Exception
-
 from uuid import uuid4
 from botocore.exceptions import BotoCoreError, ClientError
 from typing import List, Dict, Optional
 from dotenv import load_dotenv
 
+from paper_common import clients, generations, partitions
+from paper_common import jobs as job_states
+from jobs import JobQueue, LambdaPipelineRunner, LocalPipelineRunner, Priority, VectorStore, claim_stale_jobs
+import deletion
+import importer
+import limits
+import merge
+import metrics
+import mirror
+import paper_cache
+import rerank
+import search
+import uploads
+
 # --- CONFIG ---
-load_dotenv() 
+# Explicit path: skips find_dotenv()'s directory walk on every worker boot.
+load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
 
 AWS_REGION = "us-east-1"  
 S3_BUCKET_NAME = "research-papers-cc"
 DYNAMODB_TABLE = "research-papers-metadata"
 SS_API_KEY = os.environ.get("SEMANTIC_SCHOLAR_API_KEY")
+# Where the pipeline keeps each paper's text and vectors, so deletes can
+# remove them too. VECTOR_INDEX / VECTOR_MANIFEST_BUCKET and
+# VECTOR_PARTITIONS_BUCKET (read below, as in the Lambdas) name the index
+# generations and their per-user partitions.
+TEXT_BUCKET = os.environ.get("TEXT_BUCKET", "paper-texts")
+VECTOR_BUCKET = os.environ.get("VECTOR_BUCKET")
+DELETE_CONCURRENCY = int(os.environ.get("DELETE_CONCURRENCY", "8"))
+DELETE_MAX_PAPERS = 1000
+
+# Indexing pipeline: with INDEX_PDF_LAMBDA_ARN set, uploads are queued and
+# dispatched to IndexPdfLambda; JOB_RUNNER=local runs the stages in-process.
+# With neither set, indexing is left to the S3 ObjectCreated trigger.
+INDEX_PDF_LAMBDA_ARN = os.environ.get("INDEX_PDF_LAMBDA_ARN")
+JOB_RUNNER = os.environ.get("JOB_RUNNER", "lambda" if INDEX_PDF_LAMBDA_ARN else "none")
+JOB_CONCURRENCY = int(os.environ.get("JOB_CONCURRENCY", "4"))
+# Papers stuck before indexed/failed for longer than this are re-queued at
+# startup (their job was lost with a restarted worker); "0" disables.
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "900"))
+STATUS_POLL_INTERVAL = float(os.environ.get("STATUS_POLL_INTERVAL", "1.0"))
+STATUS_STREAM_MAX_SECONDS = 900
+SEARCH_BUFFER_TTL = float(os.environ.get("SEARCH_BUFFER_TTL", "300"))
+SEARCH_BUFFER_MAX_SESSIONS = int(os.environ.get("SEARCH_BUFFER_MAX_SESSIONS", "512"))
+# Local SQLite mirror of arXiv / Semantic Scholar results ("" disables it).
+METADATA_MIRROR_PATH = os.environ.get("METADATA_MIRROR_PATH", mirror.DEFAULT_PATH)
+METADATA_MIRROR_TTL = float(os.environ.get("METADATA_MIRROR_TTL", "86400"))
+METADATA_MIRROR_OFFLINE = os.environ.get("METADATA_MIRROR_OFFLINE", "0") == "1"
+# Re-rank search pages by Titan embedding similarity to the query (default
+# for ?rerank=; the model and dimensions are BEDROCK_MODEL_ID / EMBED_DIMS).
+SEARCH_RERANK = os.environ.get("SEARCH_RERANK", "0") == "1"
+BEDROCK_REGION = os.environ.get("BEDROCK_REGION", AWS_REGION)
+RERANK_CACHE_SIZE = int(os.environ.get("RERANK_CACHE_SIZE", "20000"))
+RERANK_CONCURRENCY = int(os.environ.get("RERANK_CONCURRENCY", "8"))
+# /import: downloads in flight (overall and per upstream host), PDF size cap,
+# and where arXiv PDFs are fetched from (point it at a local file server to test).
+IMPORT_CONCURRENCY = int(os.environ.get("IMPORT_CONCURRENCY", "4"))
+IMPORT_PER_HOST = int(os.environ.get("IMPORT_PER_HOST", "2"))
+IMPORT_MAX_BYTES = int(os.environ.get("IMPORT_MAX_BYTES", str(100 * 1024 * 1024)))
+IMPORT_MAX_PAPERS = 50
+ARXIV_PDF_URL = os.environ.get("ARXIV_PDF_URL", "https://arxiv.org/pdf/{id}")
+# Direct-to-S3 uploads (/upload/presign + /upload/complete): size cap, URL
+# lifetime (seconds) and background metadata extractions in flight.
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", str(100 * 1024 * 1024)))
+UPLOAD_URL_EXPIRES = int(os.environ.get("UPLOAD_URL_EXPIRES", "900"))
+UPLOAD_METADATA_CONCURRENCY = int(os.environ.get("UPLOAD_METADATA_CONCURRENCY", "4"))
+# Paper metadata / library cache (seconds; 0 disables). Entries are also
+# dropped on upload, import, delete and observed status changes.
+PAPER_CACHE_TTL = float(os.environ.get("PAPER_CACHE_TTL", "30"))
+PAPERS_MAX_IDS = 100
+# Per-user token buckets for the expensive routes: "rate,burst" (tokens per
+# second, bucket size), "0" disables a rule. Buckets are per worker unless
+# RATE_LIMIT_TABLE names a DynamoDB table to share them across workers.
+RATE_LIMIT_SEARCH = limits.parse_rule(os.environ.get("RATE_LIMIT_SEARCH", "2,30"))
+RATE_LIMIT_UPLOAD = limits.parse_rule(os.environ.get("RATE_LIMIT_UPLOAD", "0.5,20"))
+RATE_LIMIT_IMPORT = limits.parse_rule(os.environ.get("RATE_LIMIT_IMPORT", "0.1,5"))
+RATE_LIMIT_TABLE = os.environ.get("RATE_LIMIT_TABLE", "")
+# AIMD concurrency limits per upstream (see limits.DEFAULT_UPSTREAMS); calls
+# wait at most UPSTREAM_QUEUE_TIMEOUT seconds for a slot before being shed.
+ADAPTIVE_CONCURRENCY = os.environ.get("ADAPTIVE_CONCURRENCY", "1") != "0"
+UPSTREAM_QUEUE_TIMEOUT = float(os.environ.get("UPSTREAM_QUEUE_TIMEOUT", "2.0"))
+# Build clients and import the PDF/search libraries in the background right
+# after startup, so the first requests do not pay for it.
+WARM_UP_CLIENTS = os.environ.get("WARM_UP_CLIENTS", "1") != "0"
 
 # --- CLIENT INITIALIZATION ---
-try:
-    s3_client = boto3.client("s3", region_name=AWS_REGION)
-    dynamodb = boto3.resource('dynamodb', region_name=AWS_REGION)
-    table = dynamodb.Table(DYNAMODB_TABLE)
-    print(f"Successfully connected to DynamoDB table: {DYNAMODB_TABLE}")
-except Exception as e:
-    print(f"Failed to initialize AWS clients: {e}")
-    s3_client = None
-    table = None
-
-ss_client = SemanticScholar(api_key=SS_API_KEY)
-arxiv_client = arxiv.Client()
+# boto3, arxiv and semanticscholar are imported and their clients built on
+# first use (or by the startup warm-up), not while the worker boots.
+upstream_limits: Dict[str, limits.AdaptiveLimit] = {
+    name: limits.AdaptiveLimit(name, queue_timeout=UPSTREAM_QUEUE_TIMEOUT, **settings)
+    for name, settings in limits.DEFAULT_UPSTREAMS.items()
+} if ADAPTIVE_CONCURRENCY else {}
+
+
+def _limited_client(upstream: str, client):
+    limit = upstream_limits.get(upstream)
+    return limits.LimitedClient(client, limit) if limit is not None and client is not None else client
+
+
+def _available(client) -> bool:
+    """False when the client is missing or cannot be built (see clients.available)."""
+    return clients.available(client.client if isinstance(client, limits.LimitedClient) else client)
+
+
+def _limited_call(upstream: str, fn):
+    limit = upstream_limits.get(upstream)
+    return limit.wrap(fn) if limit is not None else fn
+
+
+s3_client = _limited_client("s3", clients.lazy("s3", region_name=AWS_REGION))
+table = _limited_client("dynamodb", clients.lazy_table(DYNAMODB_TABLE, region_name=AWS_REGION))
+# Service resource, for batch_get_item.
+dynamodb = _limited_client("dynamodb", clients.lazy_resource("dynamodb", region_name=AWS_REGION))
+
+
+def _semantic_scholar_client():
+    from semanticscholar import SemanticScholar
+    return SemanticScholar(api_key=SS_API_KEY)
+
+
+def _arxiv_client():
+    import arxiv
+    return arxiv.Client()
+
+
+ss_client = clients.LazyClient(_semantic_scholar_client, "semanticscholar")
+arxiv_client = clients.LazyClient(_arxiv_client, "arxiv")
+# Retries are handled by the reranker (call_with_retry + AdaptivePacer).
+bedrock = clients.lazy(
+    "bedrock-runtime", region_name=BEDROCK_REGION, config={"retries": {"mode": "standard", "max_attempts": 2}},
+)
+reranker = rerank.Reranker(
+    bedrock, cache=rerank.EmbeddingCache(RERANK_CACHE_SIZE), concurrency=RERANK_CONCURRENCY,
+)
+
+rate_limiter = limits.RateLimiter(
+    limits.DynamoBucketStore(clients.lazy_table(RATE_LIMIT_TABLE, region_name=AWS_REGION))
+    if RATE_LIMIT_TABLE else limits.MemoryBucketStore(),
+    {
+        rule: setting
+        for rule, setting in (("search", RATE_LIMIT_SEARCH), ("upload", RATE_LIMIT_UPLOAD), ("import", RATE_LIMIT_IMPORT))
+        if setting is not None
+    },
+)
+
+s3v = clients.lazy("s3vectors", region_name=AWS_REGION) if VECTOR_BUCKET else None
+generation_source = generations.from_env(s3_client, os.environ)
+routing_source = partitions.from_env(s3_client, os.environ)
+
+paper_deleter = deletion.PaperDeleter(
+    s3_client, table,
+    text_bucket=TEXT_BUCKET,
+    s3v=s3v,
+    vector_bucket=VECTOR_BUCKET,
+    generation_source=generation_source,
+    routing_source=routing_source,
+    concurrency=DELETE_CONCURRENCY,
+)
+
+paper_importer = importer.Importer(
+    s3_client, table, S3_BUCKET_NAME, importer.HttpPdfFetcher(),
+    concurrency=IMPORT_CONCURRENCY, per_host=IMPORT_PER_HOST, max_bytes=IMPORT_MAX_BYTES,
+)
+
+direct_uploads = uploads.DirectUploads(
+    s3_client, table, S3_BUCKET_NAME,
+    extract=lambda pdf: extract_pdf_metadata(pdf),   # defined below
+    max_bytes=UPLOAD_MAX_BYTES, expires_in=UPLOAD_URL_EXPIRES, concurrency=UPLOAD_METADATA_CONCURRENCY,
+)
+
+metadata_cache = paper_cache.PaperCache(ttl_seconds=PAPER_CACHE_TTL)
+
+
+def _job_done(job) -> None:
+    # Indexing changed the paper's status (and num_chunks).
+    metadata_cache.invalidate(job.document_id, job.user_id)
+
+
+# Built at startup: checking that the table can be built imports boto3.
+job_queue: Optional[JobQueue] = None
+
+
+def _build_job_queue() -> Optional[JobQueue]:
+    if JOB_RUNNER == "lambda" and INDEX_PDF_LAMBDA_ARN:
+        runner = LambdaPipelineRunner(clients.lazy("lambda", region_name=AWS_REGION), INDEX_PDF_LAMBDA_ARN, table)
+    elif JOB_RUNNER == "local":
+        if s3v is None or generation_source is None:
+            # Marking papers indexed without writing vectors would hide them from search.
+            print("Indexing jobs disabled: JOB_RUNNER=local needs VECTOR_BUCKET and VECTOR_INDEX "
+                  "(or VECTOR_MANIFEST_BUCKET)")
+            return None
+        vectors = VectorStore(bedrock, s3v, VECTOR_BUCKET, generation_source, routing_source)
+        runner = LocalPipelineRunner(s3_client, table, embed=vectors.embed, store=vectors.store)
+    else:
+        return None
+    if not _available(table):
+        print("Indexing jobs disabled: DynamoDB is not available")
+        return None
+    return JobQueue(runner, concurrency=JOB_CONCURRENCY, on_done=_job_done)
 
 # --- FASTAPI APP ---
 app = FastAPI(title="Research Paper Uploader and Search API")
@@ -56,28 +229,117 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+# Path prefix -> rate limit rule (None: not limited). A direct upload is
+# charged once, when it is presigned.
+RATE_LIMITED_ROUTES = (
+    ("/search", "search"), ("/upload/complete", None), ("/upload/abort", None), ("/upload", "upload"),
+    ("/import", "import"),
+)
+
+
+@app.middleware("http")
+async def enforce_rate_limit(request: Request, call_next):
+    rule = next((r for prefix, r in RATE_LIMITED_ROUTES if request.url.path.startswith(prefix)), None)
+    if rule is None or rule not in rate_limiter.rules or request.method == "OPTIONS":
+        return await call_next(request)
+    user_id = request.query_params.get("user_id")
+    client_key = f"user:{user_id}" if user_id else f"ip:{request.client.host if request.client else 'unknown'}"
+    if isinstance(rate_limiter.store, limits.MemoryBucketStore):
+        allowed, headers = rate_limiter.check(rule, client_key)
+    else:
+        allowed, headers = await asyncio.to_thread(rate_limiter.check, rule, client_key)
+    if not allowed:
+        return JSONResponse(
+            status_code=429,
+            content={"detail": f"Rate limit exceeded for {rule}; retry in {headers['Retry-After']} s."},
+            headers=headers,
+        )
+    response = await call_next(request)
+    response.headers.update(headers)
+    return response
+
+
+@app.exception_handler(limits.Overloaded)
+async def upstream_overloaded(request: Request, exc: limits.Overloaded):
+    return JSONResponse(
+        status_code=503, content={"detail": str(exc)}, headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
+
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        metrics.HTTP_SECONDS.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=status,
+        )
+
 # ----------------------------------------------------
 # HELPER: Extract PDF Metadata
 # ----------------------------------------------------
 
-def extract_pdf_metadata(file_bytes: bytes) -> Dict:
-    """Extract title, author, and first page text from PDF."""
+# pdf_reader.pages loads the dictionary of every page, which in a ranged
+# read touches most of the file; the page tree's /Count (uploads.page_count)
+# and its first leaf are all the metadata needs.
+
+def _first_page(pdf_reader):
+    from PyPDF2 import PageObject
+
+    node = pdf_reader.trailer["/Root"]["/Pages"].get_object()
+    reference, inherited = None, {}
+    while node.get("/Type") == "/Pages":
+        for attr in ("/Resources", "/MediaBox", "/CropBox", "/Rotate"):
+            if attr in node:
+                inherited[attr] = node[attr]
+        kids = node.get("/Kids") or []
+        if not kids:
+            return None
+        reference = kids[0]
+        node = reference.get_object()
+    page = PageObject(pdf_reader, getattr(reference, "indirect_reference", reference))
+    page.update(inherited)
+    page.update(node)
+    return page
+
+
+def extract_pdf_metadata(pdf) -> Dict:
+    """
+    Extract title, author, and first page text from PDF: its bytes, or a
+    seekable file object (an uploads.RangedS3File reads only what PyPDF2 asks for).
+    """
     try:
-        pdf_reader = PyPDF2.PdfReader(BytesIO(file_bytes))
-        
-        metadata = pdf_reader.metadata or {}
-        title = metadata.get('/Title', '')
-        author = metadata.get('/Author', '')
-        
-        # Extract first page text for abstract/keywords
-        first_page_text = ""
-        if len(pdf_reader.pages) > 0:
-            first_page_text = pdf_reader.pages[0].extract_text()[:500]
+        import PyPDF2  # first upload pays the import, not every worker boot
+
+        stream = BytesIO(pdf) if isinstance(pdf, (bytes, bytearray)) else pdf
+        size = len(pdf) if isinstance(pdf, (bytes, bytearray)) else getattr(pdf, "size", None)
+        with metrics.timed("pdf_parse", payload_bytes=size):
+            pdf_reader = PyPDF2.PdfReader(stream)
+
+            metadata = pdf_reader.metadata or {}
+            title = metadata.get('/Title', '')
+            author = metadata.get('/Author', '')
+            page_count = uploads.page_count(pdf_reader)
+
+            # Extract first page text for abstract/keywords
+            first_page_text = ""
+            first_page = _first_page(pdf_reader) if page_count > 0 else None
+            if first_page is not None:
+                first_page_text = first_page.extract_text()[:500]
         
         return {
             "title": str(title) if title else "Untitled Document",
             "author": str(author) if author else "Unknown",
-            "page_count": len(pdf_reader.pages),
+            "page_count": page_count,
             "abstract_snippet": first_page_text
         }
     except Exception as e:
@@ -96,11 +358,13 @@ def extract_pdf_metadata(file_bytes: bytes) -> Dict:
 @app.post("/upload")
 async def upload_pdf(
     file: UploadFile = File(...),
-    user_id: Optional[str] = "default_user"  # TODO: Get from Cognito JWT later
+    user_id: Optional[str] = "default_user",  # TODO: Get from Cognito JWT later
+    priority: str = Query("interactive", pattern="^(interactive|bulk)$",
+                          description="Queue priority; bulk imports yield to interactive uploads")
 ):
-    """Handles PDF upload, extracts metadata, stores in S3 + DynamoDB."""
+    """Handles PDF upload, extracts metadata, stores in S3 + DynamoDB, queues indexing."""
     
-    if not s3_client or not table:
+    if not _available(s3_client) or not _available(table):
         raise HTTPException(status_code=500, detail="AWS services not initialized.")
         
     # 1. Validation
@@ -114,18 +378,21 @@ async def upload_pdf(
     pdf_metadata = extract_pdf_metadata(file_bytes)
     
     # 4. Create unique IDs
+    # Key layout matches what IndexPdfLambda derives user_id/paper_id from,
+    # so paper_id == document_id throughout the pipeline.
     document_id = str(uuid4())
-    object_key = f"uploads/{document_id}-{file.filename}"
+    object_key = f"user/{user_id}/papers/{document_id}.pdf"
 
     # 5. Upload to S3
     try:
-        s3_client.put_object(
-            Bucket=S3_BUCKET_NAME,
-            Key=object_key,
-            Body=file_bytes,
-            ContentType="application/pdf",
-        )
-        print(f"Uploaded to S3: {object_key}")
+        with metrics.timed("s3_put_object", payload_bytes=len(file_bytes)):
+            await asyncio.to_thread(
+                s3_client.put_object,
+                Bucket=S3_BUCKET_NAME,
+                Key=object_key,
+                Body=file_bytes,
+                ContentType="application/pdf",
+            )
     except (BotoCoreError, ClientError) as e:
         print(f"S3 upload failed: {e}")
         raise HTTPException(status_code=500, detail=f"S3 upload failed: {e}")
@@ -133,27 +400,38 @@ async def upload_pdf(
     # 6. Store metadata in DynamoDB
     try:
         # DynamoDB doesn't support float, so convert page_count to Decimal if needed
-        table.put_item(
-            Item={
-                'document_id': document_id,
-                'user_id': user_id,
-                'title': pdf_metadata['title'],
-                'author': pdf_metadata['author'],
-                'filename': file.filename,
-                's3_key': object_key,
-                's3_bucket': S3_BUCKET_NAME,
-                'source': 'user_upload',
-                'page_count': pdf_metadata['page_count'],
-                'abstract_snippet': pdf_metadata['abstract_snippet'],
-                'uploaded_at': datetime.utcnow().isoformat(),
-                'status': 'ready'
-            }
-        )
-        print(f"Stored metadata in DynamoDB: {document_id}")
+        with metrics.timed("dynamodb_put_item"):
+            await asyncio.to_thread(
+                table.put_item,
+                Item={
+                    'document_id': document_id,
+                    'user_id': user_id,
+                    'title': pdf_metadata['title'],
+                    'author': pdf_metadata['author'],
+                    'filename': file.filename,
+                    's3_key': object_key,
+                    's3_bucket': S3_BUCKET_NAME,
+                    'source': 'user_upload',
+                    'page_count': pdf_metadata['page_count'],
+                    'abstract_snippet': pdf_metadata['abstract_snippet'],
+                    'uploaded_at': datetime.utcnow().isoformat(),
+                    'status': job_states.UPLOADED,
+                    'status_updated_at': job_states.utc_now(),
+                    'stage_timings': {}
+                }
+            )
     except Exception as e:
         print(f"DynamoDB error: {e}")
         # File is already in S3, so we don't fail completely
         raise HTTPException(status_code=500, detail=f"Failed to store metadata: {e}")
+    metadata_cache.invalidate(user_id=user_id)
+
+    # 7. Queue indexing
+    if job_queue is not None:
+        job_queue.submit(
+            document_id, user_id, S3_BUCKET_NAME, object_key,
+            priority=Priority.BULK if priority == "bulk" else Priority.INTERACTIVE,
+        )
 
     return {
         "success": True,
@@ -163,9 +441,296 @@ async def upload_pdf(
         "title": pdf_metadata['title'],
         "author": pdf_metadata['author'],
         "page_count": pdf_metadata['page_count'],
-        "message": "File uploaded and indexed successfully"
+        "status": job_states.UPLOADED,
+        "message": "File uploaded; indexing in progress"
     }
 
+# ----------------------------------------------------
+# 1a. DIRECT-TO-S3 UPLOADS (PRESIGNED)
+# ----------------------------------------------------
+
+class PresignRequest(BaseModel):
+    filename: str = Field(..., description="Name of the PDF, e.g. paper.pdf")
+    size: int = Field(..., gt=0, description="Exact size of the PDF in bytes")
+    content_type: str = Field(uploads.CONTENT_TYPE, description="Must be application/pdf")
+
+
+class CompletedPart(BaseModel):
+    part_number: int = Field(..., ge=1, le=uploads.MAX_PARTS)
+    etag: str = Field(..., description="ETag header returned by the part's PUT")
+
+
+class CompleteRequest(BaseModel):
+    document_id: str
+    upload_id: Optional[str] = Field(None, description="For multipart uploads")
+    parts: List[CompletedPart] = Field(default_factory=list, max_length=uploads.MAX_PARTS)
+
+
+class AbortRequest(BaseModel):
+    document_id: str
+    upload_id: str
+
+
+def _upload_error(e: uploads.UploadError) -> HTTPException:
+    return HTTPException(status_code=e.status_code, detail=e.detail)
+
+
+@app.post("/upload/presign")
+async def presign_upload(
+    request: PresignRequest,
+    user_id: Optional[str] = "default_user",  # TODO: Get from Cognito JWT later
+):
+    """
+    Presigned upload of a PDF straight to S3: a POST form (``url`` +
+    ``fields``) for PDFs up to 16 MiB, otherwise one PUT URL per part of a
+    multipart upload. Then call ``/upload/complete``.
+    """
+
+    if not _available(s3_client) or not _available(table):
+        raise HTTPException(status_code=500, detail="AWS services not initialized.")
+
+    try:
+        return await direct_uploads.presign(user_id, request.filename, request.size, request.content_type)
+    except uploads.UploadError as e:
+        raise _upload_error(e)
+    except (BotoCoreError, ClientError) as e:
+        print(f"Presign error: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to presign upload: {e}")
+
+
+@app.post("/upload/complete")
+async def complete_upload(
+    request: CompleteRequest,
+    user_id: Optional[str] = "default_user",  # TODO: Get from Cognito JWT later
+    priority: str = Query("interactive", pattern="^(interactive|bulk)$",
+                          description="Queue priority; bulk imports yield to interactive uploads")
+):
+    """
+    Registers a presigned upload once the PDF is in S3 and queues indexing.
+    Title, author and page count are extracted in the background
+    (``metadata_status`` goes from ``pending`` to ``extracted``).
+    """
+
+    if not _available(s3_client) or not _available(table):
+        raise HTTPException(status_code=500, detail="AWS services not initialized.")
+
+    try:
+        item, created = await direct_uploads.complete(
+            user_id, request.document_id, request.upload_id,
+            [part.model_dump() for part in request.parts],
+            on_extracted=lambda document_id, owner: metadata_cache.invalidate(document_id, owner),
+        )
+    except uploads.UploadError as e:
+        raise _upload_error(e)
+    except (BotoCoreError, ClientError) as e:
+        print(f"Upload completion error: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to complete upload: {e}")
+
+    if created:
+        metadata_cache.invalidate(user_id=user_id)
+        if job_queue is not None:
+            job_queue.submit(
+                item["document_id"], user_id, item["s3_bucket"], item["s3_key"],
+                priority=Priority.BULK if priority == "bulk" else Priority.INTERACTIVE,
+            )
+
+    return {
+        "success": True,
+        "document_id": item["document_id"],
+        "bucket": item["s3_bucket"],
+        "key": item["s3_key"],
+        "filename": item.get("filename"),
+        "status": item.get("status"),
+        "metadata_status": item.get("metadata_status"),
+        "message": "File uploaded; indexing in progress" if created else "Upload already completed"
+    }
+
+
+@app.post("/upload/abort")
+async def abort_upload(request: AbortRequest, user_id: Optional[str] = "default_user"):
+    """Abandon a presigned multipart upload (frees the parts already uploaded)."""
+
+    if not _available(s3_client):
+        raise HTTPException(status_code=500, detail="AWS services not initialized.")
+
+    try:
+        await direct_uploads.abort(user_id, request.document_id, request.upload_id)
+    except uploads.UploadError as e:
+        raise _upload_error(e)
+    except (BotoCoreError, ClientError) as e:
+        print(f"Upload abort error: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to abort upload: {e}")
+    return {"success": True, "document_id": request.document_id}
+
+# ----------------------------------------------------
+# 1b. IMPORT SEARCH RESULTS INTO THE LIBRARY
+# ----------------------------------------------------
+
+class ImportItem(BaseModel):
+    source: str = Field(..., description="Search result source: arXiv or Semantic Scholar")
+    id: str = Field(..., description="Search result id (arXiv id or Semantic Scholar paperId)")
+
+
+class ImportRequest(BaseModel):
+    papers: List[ImportItem] = Field(..., min_length=1, max_length=IMPORT_MAX_PAPERS)
+
+
+# Search results carry display names; the source keys are accepted too.
+IMPORT_SOURCES = {
+    "arxiv": "arxiv",
+    "semantic scholar": "semantic_scholar",
+    "semantic_scholar": "semantic_scholar",
+}
+
+
+@app.post("/import")
+async def import_papers(
+    request: ImportRequest,
+    user_id: Optional[str] = "default_user",  # TODO: Get from Cognito JWT later
+    priority: str = Query("bulk", pattern="^(interactive|bulk)$",
+                          description="Queue priority for indexing the imported papers")
+):
+    """
+    Adds search hits to the library: downloads each PDF server-side (in
+    parallel), stores it in S3 + DynamoDB and queues indexing. Papers already
+    in the library are reported as duplicates instead of imported again.
+    """
+
+    if not _available(s3_client) or not _available(table):
+        raise HTTPException(status_code=500, detail="AWS services not initialized.")
+
+    unknown = sorted({p.source for p in request.papers if p.source.lower() not in IMPORT_SOURCES})
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Cannot import from: {', '.join(unknown)}")
+
+    try:
+        candidates, library = await asyncio.gather(
+            asyncio.to_thread(_resolve_import_candidates, request.papers),
+            asyncio.to_thread(_library_items, user_id),
+        )
+    except Exception as e:
+        print(f"Import lookup error: {e}")
+        raise HTTPException(status_code=502, detail=f"Failed to look up papers: {e}")
+
+    loop = asyncio.get_running_loop()
+    job_priority = Priority.BULK if priority == "bulk" else Priority.INTERACTIVE
+
+    def queue_indexing(document_id: str, owner: str, key: str) -> None:
+        # Called on the importer's worker threads; the job queue belongs to the loop.
+        if job_queue is not None:
+            loop.call_soon_threadsafe(
+                lambda: job_queue.submit(document_id, owner, S3_BUCKET_NAME, key, priority=job_priority)
+            )
+
+    results = await paper_importer.run(user_id, candidates, library, on_imported=queue_indexing)
+    metadata_cache.invalidate(user_id=user_id)
+    counts = {status: sum(r["status"] == status for r in results) for status in ("imported", "duplicate", "failed")}
+    return {
+        "results": results,
+        "imported": counts["imported"],
+        "duplicates": counts["duplicate"],
+        "failed": counts["failed"],
+    }
+
+
+def _resolve_import_candidates(papers: List[ImportItem]) -> List[importer.Candidate]:
+    """Metadata and PDF URL of each requested paper (one upstream call per source)."""
+    keys = [IMPORT_SOURCES[p.source.lower()] for p in papers]
+    # Malformed ids would fail the whole arXiv batch, so they are not sent.
+    arxiv_ids = [p.id for p, key in zip(papers, keys) if key == "arxiv" and merge.normalize_arxiv_id(p.id)]
+    ss_ids = [p.id for p, key in zip(papers, keys) if key == "semantic_scholar"]
+    found = {}
+    if arxiv_ids:
+        found.update({("arxiv", k): c for k, c in _limited_call("arxiv", _arxiv_candidates)(arxiv_ids).items()})
+    if ss_ids:
+        found.update({
+            ("semantic_scholar", k): c
+            for k, c in _limited_call("semantic_scholar", _semantic_scholar_candidates)(ss_ids).items()
+        })
+
+    candidates = []
+    for paper, key in zip(papers, keys):
+        lookup = merge.normalize_arxiv_id(paper.id) if key == "arxiv" else paper.id
+        candidate = found.get((key, lookup)) if lookup else None
+        if candidate is None:
+            candidate = importer.Candidate(key, paper.id, error="paper not found")
+        else:
+            # Reported under the id the client sent.
+            candidate = dataclasses.replace(candidate, id=paper.id)
+        candidates.append(candidate)
+    return candidates
+
+
+def _arxiv_candidates(ids: List[str]) -> Dict[str, importer.Candidate]:
+    import arxiv
+
+    found = {}
+    for r in arxiv_client.results(arxiv.Search(id_list=ids, max_results=len(ids))):
+        entry_id = r.entry_id.split('/')[-1]
+        arxiv_id = merge.normalize_arxiv_id(entry_id)
+        found[arxiv_id] = importer.Candidate(
+            "arxiv", entry_id,
+            title=r.title,
+            authors=[author.name for author in r.authors],
+            pdf_url=ARXIV_PDF_URL.format(id=entry_id),
+            abstract_snippet=r.summary[:200] + "...",
+            published=r.published.strftime("%Y-%m-%d"),
+            arxiv_id=arxiv_id,
+            doi=getattr(r, "doi", None),
+        )
+    return found
+
+
+def _semantic_scholar_candidates(ids: List[str]) -> Dict[str, importer.Candidate]:
+    _ensure_event_loop()
+    papers = ss_client.get_papers(
+        ids, fields=['paperId', 'title', 'authors', 'publicationDate', 'abstract', 'externalIds', 'openAccessPdf'],
+    )
+    found = {}
+    for paper in papers:
+        if paper is None:
+            continue
+        authors_raw = _paper_get(paper, 'authors') or []
+        external_ids = _paper_get(paper, 'externalIds') or {}
+        open_access = _paper_get(paper, 'openAccessPdf') or {}
+        arxiv_id = merge.normalize_arxiv_id(external_ids.get("ArXiv"))
+        # Prefer the open-access copy; papers on arXiv always have one there.
+        pdf_url = open_access.get("url") or (ARXIV_PDF_URL.format(id=arxiv_id) if arxiv_id else None)
+        abstract = _paper_get(paper, 'abstract')
+        found[_paper_get(paper, 'paperId')] = importer.Candidate(
+            "semantic_scholar", _paper_get(paper, 'paperId'),
+            title=_paper_get(paper, 'title') or "",
+            authors=[
+                author.get('name') if isinstance(author, dict) else getattr(author, 'name', 'Unknown')
+                for author in authors_raw
+            ],
+            pdf_url=pdf_url,
+            abstract_snippet=abstract[:200] + "..." if abstract else "No abstract available",
+            published=_paper_get(paper, 'publicationDate') or "",
+            arxiv_id=arxiv_id,
+            doi=external_ids.get("DOI"),
+            error=None if pdf_url else "no open-access PDF",
+        )
+    return found
+
+
+def _library_items(user_id: str) -> List[Dict]:
+    """Every library row of the user (only the fields duplicate detection needs)."""
+    items, kwargs = [], {}
+    while True:
+        with metrics.timed("dynamodb_scan", source="library"):
+            response = table.scan(
+                FilterExpression='user_id = :uid',
+                ProjectionExpression='document_id, #title, abstract_snippet, arxiv_id, doi',
+                ExpressionAttributeNames={'#title': 'title'},  # 'title' is a reserved word
+                ExpressionAttributeValues={':uid': user_id},
+                **kwargs,
+            )
+        items.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return items
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
 # ----------------------------------------------------
 # 2. UNIFIED SEARCH ENDPOINT (3 Sources)
 # ----------------------------------------------------
@@ -175,187 +740,396 @@ async def search_papers(
     query: str = Query(..., description="Search query for papers"),
     limit: int = Query(10, ge=1, le=50),
     user_id: Optional[str] = "default_user",
-    include_library: bool = Query(True, description="Include papers from your S3 library")
+    include_library: bool = Query(True, description="Include papers from your S3 library"),
+    rerank: Optional[bool] = Query(None, description="Order by semantic similarity (default: SEARCH_RERANK)"),
 ):
     """
     Unified search across:
     1. Semantic Scholar
     2. arXiv  
     3. User's S3 library (DynamoDB metadata)
+
+    Returns the first page: up to `limit * 2` papers, each merged across
+    sources (`sources` lists where it was found) and ranked by `score`
+    (or by `similarity` with rerank). Use /search/page or /search/stream
+    for the following pages.
     """
-    
-    all_results = []
-    
-    # 1. Search Semantic Scholar
+    session, offsets = _open_search(query, user_id, include_library, None)
+    page = await paginator.page(session, offsets, limit * 2)
+    return (await _rerank(session.query, page, rerank))["results"]
+
+
+@app.get("/search/page")
+async def search_papers_page(
+    query: Optional[str] = Query(None, description="Search query (optional when `cursor` is given)"),
+    limit: int = Query(10, ge=1, le=50),
+    user_id: Optional[str] = "default_user",
+    include_library: bool = Query(True, description="Include papers from your S3 library"),
+    cursor: Optional[str] = Query(None, description="`next_cursor` from the previous page"),
+    rerank: Optional[bool] = Query(None, description="Order by semantic similarity (default: SEARCH_RERANK)"),
+):
+    """
+    Paginated search. Returns `{results, next_cursor, sources}`; pass
+    `next_cursor` back to get the next page (null when every source is
+    exhausted). Sources are interleaved, the same paper from several
+    sources is merged into one result, and upstream results are buffered
+    server-side for a few minutes, so later pages rarely hit upstream.
+    With `rerank`, each page is ordered by Titan embedding similarity to the
+    query (`similarity` on each result).
+    """
+    session, offsets = _open_search(query, user_id, include_library, cursor)
+    page = await paginator.page(session, offsets, limit)
+    return await _rerank(session.query, page, rerank)
+
+
+@app.get("/search/stream")
+async def search_papers_stream(
+    request: Request,
+    query: Optional[str] = Query(None, description="Search query (optional when `cursor` is given)"),
+    limit: int = Query(10, ge=1, le=50, description="Results per source"),
+    user_id: Optional[str] = "default_user",
+    include_library: bool = Query(True, description="Include papers from your S3 library"),
+    cursor: Optional[str] = Query(None),
+    format: str = Query("ndjson", pattern="^(ndjson|sse)$"),
+):
+    """
+    Streams each source's results as soon as that source answers, one JSON
+    object per line (`{"source", "results", "updated"?}` - `updated` carries
+    already-sent papers that this source also found), then a final
+    `{"done": true, "next_cursor", "sources"}`. With `format=sse` (or an
+    `Accept: text/event-stream` header) the same objects are sent as SSE
+    `results` / `done` events. Continue with /search/page or /search/stream.
+    """
+    session, offsets = _open_search(query, user_id, include_library, cursor)
+    sse = format == "sse" or "text/event-stream" in request.headers.get("accept", "")
+
+    async def body():
+        async for chunk in paginator.stream(session, offsets, limit):
+            data = json.dumps(jsonable_encoder(chunk))
+            if sse:
+                yield f"event: {'done' if chunk.get('done') else 'results'}\ndata: {data}\n\n"
+            else:
+                yield data + "\n"
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+def _search_sources(include_library: bool) -> List[str]:
+    # Library first: round-robin starts with the user's own papers.
+    sources = []
+    if include_library and _available(table):
+        sources.append("library")
+    if SS_API_KEY or (metadata_mirror and metadata_mirror.offline):
+        sources.append("semantic_scholar")
+    sources.append("arxiv")
+    return sources
+
+
+async def _rerank(query: str, page: Dict, enabled: Optional[bool]) -> Dict:
+    if not (SEARCH_RERANK if enabled is None else enabled):
+        return page
     try:
-        if SS_API_KEY:
-            ss_results = search_semantic_scholar_impl(query, limit)
-            all_results.extend(ss_results)
-            print(f"Semantic Scholar: {len(ss_results)} results")
+        page["results"] = await asyncio.to_thread(reranker.rerank, query, page["results"])
     except Exception as e:
-        print(f"Semantic Scholar failed: {e}")
-    
-    # 2. Search arXiv
+        # Optional stage: keep the merged order rather than fail the search.
+        print(f"Re-ranking failed: {e}")
+    return page
+
+
+def _open_search(query, user_id, include_library, cursor):
     try:
-        arxiv_results = search_arxiv_impl(query, limit)
-        all_results.extend(arxiv_results)
-        print(f"arXiv: {len(arxiv_results)} results")
-    except Exception as e:
-        print(f"⚠️  arXiv failed: {e}")
-    
-    # 3. Search User's Library (DynamoDB)
-    if include_library and table:
-        try:
-            library_results = search_user_library(query, user_id, limit)
-            all_results.extend(library_results)
-            print(f"Your Library: {len(library_results)} results")
-        except Exception as e:
-            print(f"⚠️  Library search failed: {e}")
-    
-    return all_results[:limit * 2]
+        return paginator.open(query, user_id, include_library, _search_sources(include_library), cursor)
+    except search.InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {e}")
+
 
 # ----------------------------------------------------
 # 3. GET USER'S LIBRARY (ALL PAPERS)
 # ----------------------------------------------------
 
 @app.get("/library")
-async def get_library(user_id: Optional[str] = "default_user"):
-    """Get all papers uploaded by the user."""
+async def get_library(request: Request, user_id: Optional[str] = "default_user"):
+    """Get all papers uploaded by the user (ETag / Last-Modified; 304 when unchanged)."""
     
-    if not table:
+    if not _available(table):
         raise HTTPException(status_code=500, detail="DynamoDB not initialized.")
     
+    cached = metadata_cache.get_library(user_id)
+    if cached is not None:
+        return paper_cache.respond(request, cached)
+
     try:
+        token = metadata_cache.token()
         # Scan table for all items with matching user_id
         # Note: For production, use a GSI (Global Secondary Index) on user_id
-        response = table.scan(
-            FilterExpression='user_id = :uid',
-            ExpressionAttributeValues={':uid': user_id}
-        )
-        
-        items = response.get('Items', [])
+        items, kwargs = [], {}
+        while True:
+            with metrics.timed("dynamodb_scan", source="library"):
+                response = await asyncio.to_thread(
+                    table.scan,
+                    FilterExpression='user_id = :uid',
+                    ExpressionAttributeValues={':uid': user_id},
+                    **kwargs,
+                )
+            items.extend(response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                break
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        metrics.observe_results("dynamodb_scan", len(items), source="library")
         
         # Sort by upload date (newest first)
         items.sort(key=lambda x: x.get('uploaded_at', ''), reverse=True)
         
-        return {
-            "count": len(items),
-            "papers": items
-        }
-        
     except Exception as e:
         print(f"Library retrieval error: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to retrieve library: {e}")
 
+    return paper_cache.respond(request, metadata_cache.put_library(user_id, items, token))
+
 # ----------------------------------------------------
 # 4. GET SINGLE PAPER DETAILS
 # ----------------------------------------------------
 
 @app.get("/paper/{document_id}")
-async def get_paper(document_id: str):
-    """Get details of a specific paper."""
+async def get_paper(request: Request, document_id: str):
+    """Get details of a specific paper (ETag / Last-Modified; 304 when unchanged)."""
     
-    if not table:
+    if not _available(table):
         raise HTTPException(status_code=500, detail="DynamoDB not initialized.")
     
+    cached = metadata_cache.get(document_id)
+    if cached is not None:
+        return paper_cache.respond(request, cached)
+
     try:
-        response = table.get_item(Key={'document_id': document_id})
-        
-        if 'Item' not in response:
-            raise HTTPException(status_code=404, detail="Paper not found")
-        
-        return response['Item']
-        
-    except HTTPException:
-        raise
+        token = metadata_cache.token()
+        with metrics.timed("dynamodb_get_item", source="paper"):
+            response = await asyncio.to_thread(table.get_item, Key={'document_id': document_id})
     except Exception as e:
         print(f"Error retrieving paper: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to retrieve paper: {e}")
 
+    if 'Item' not in response:
+        raise HTTPException(status_code=404, detail="Paper not found")
+
+    return paper_cache.respond(request, metadata_cache.put(response['Item'], token))
+
+
+@app.get("/papers")
+async def get_papers(
+    request: Request,
+    ids: List[str] = Query(..., description="Document ids: repeat the parameter or separate them with commas"),
+):
+    """Details of several papers in one request (one BatchGetItem for the ones not cached)."""
+
+    if not _available(table):
+        raise HTTPException(status_code=500, detail="DynamoDB not initialized.")
+
+    document_ids = list(dict.fromkeys(i.strip() for value in ids for i in value.split(",") if i.strip()))
+    if len(document_ids) > PAPERS_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {PAPERS_MAX_IDS} ids per request.")
+
+    found = {}
+    for document_id in document_ids:
+        cached = metadata_cache.get(document_id)
+        if cached is not None:
+            found[document_id] = cached
+    missing = [d for d in document_ids if d not in found]
+    if missing:
+        try:
+            token = metadata_cache.token()
+            items = await asyncio.to_thread(paper_cache.batch_get_items, dynamodb, DYNAMODB_TABLE, missing)
+        except Exception as e:
+            print(f"Error retrieving papers: {e}")
+            raise HTTPException(status_code=500, detail=f"Failed to retrieve papers: {e}")
+        for item in items:
+            found[item['document_id']] = metadata_cache.put(item, token)
+
+    papers = [found[d].payload for d in document_ids if d in found]
+    payload = {"papers": papers, "missing": [d for d in document_ids if d not in found]}
+    return paper_cache.respond(request, paper_cache.validators(payload, papers))
+
+# ----------------------------------------------------
+# 4b. PAPER INDEXING STATUS (long-poll / SSE)
+# ----------------------------------------------------
+
+def _read_status(document_id: str) -> Optional[Dict]:
+    with metrics.timed("dynamodb_get_item", source="status"):
+        response = table.get_item(
+            Key={'document_id': document_id},
+            ProjectionExpression='#s, status_updated_at, stage_timings, failed_stage, #e, num_chunks',
+            ExpressionAttributeNames={'#s': 'status', '#e': 'error'},
+        )
+    item = response.get('Item')
+    if item is None:
+        return None
+    state = jsonable_encoder({'document_id': document_id, **item})
+    metadata_cache.observe_status(document_id, state)
+    return state
+
+
+@app.get("/paper/{document_id}/status")
+async def get_paper_status(
+    request: Request,
+    document_id: str,
+    wait: float = Query(0, ge=0, le=60, description="Long-poll: seconds to wait for a change from `since`"),
+    since: Optional[str] = Query(None, description="Last status the client has seen"),
+    stream: bool = Query(False, description="Stream status changes as Server-Sent Events"),
+):
+    """
+    Indexing status of a paper: uploaded, extracting, chunking, embedding,
+    indexed or failed, plus per-stage timings.
+
+    With `wait`, the request is held until the status differs from `since`
+    (or the paper reaches a terminal state). With `stream=true` (or an
+    `Accept: text/event-stream` header) every change is pushed as an SSE
+    `status` event until the paper is indexed or failed.
+    """
+    if not _available(table):
+        raise HTTPException(status_code=500, detail="DynamoDB not initialized.")
+
+    state = await asyncio.to_thread(_read_status, document_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Paper not found")
+
+    if stream or "text/event-stream" in request.headers.get("accept", ""):
+        async def events():
+            current = state
+            last_sent = None
+            deadline = time.monotonic() + STATUS_STREAM_MAX_SECONDS
+            while True:
+                if current != last_sent:
+                    yield f"event: status\ndata: {json.dumps(current)}\n\n"
+                    last_sent = current
+                if job_states.is_terminal(current.get('status')) or time.monotonic() > deadline:
+                    return
+                if await request.is_disconnected():
+                    return
+                await asyncio.sleep(STATUS_POLL_INTERVAL)
+                current = await asyncio.to_thread(_read_status, document_id) or current
+
+        return StreamingResponse(
+            events(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache"},
+        )
+
+    deadline = time.monotonic() + wait
+    while (
+        state.get('status') == since
+        and not job_states.is_terminal(state.get('status'))
+        and time.monotonic() < deadline
+    ):
+        await asyncio.sleep(min(STATUS_POLL_INTERVAL, max(deadline - time.monotonic(), 0)))
+        state = await asyncio.to_thread(_read_status, document_id) or state
+
+    return state
+
 # ----------------------------------------------------
 # 5. DELETE PAPER
 # ----------------------------------------------------
 
 @app.delete("/paper/{document_id}")
 async def delete_paper(document_id: str, user_id: Optional[str] = "default_user"):
-    """Delete a paper from S3 and DynamoDB."""
+    """Delete a paper with its PDF, extracted text and vectors."""
     
-    if not s3_client or not table:
+    if not _available(s3_client) or not _available(table):
         raise HTTPException(status_code=500, detail="AWS services not initialized.")
     
     try:
-        # 1. Get paper details
-        response = table.get_item(Key={'document_id': document_id})
-        
-        if 'Item' not in response:
-            raise HTTPException(status_code=404, detail="Paper not found")
-        
-        paper = response['Item']
-        
-        # 2. Verify ownership
-        if paper.get('user_id') != user_id:
-            raise HTTPException(status_code=403, detail="Not authorized to delete this paper")
-        
-        # 3. Delete from S3
-        s3_client.delete_object(
-            Bucket=paper['s3_bucket'],
-            Key=paper['s3_key']
-        )
-        print(f"Deleted from S3: {paper['s3_key']}")
-        
-        # 4. Delete from DynamoDB
-        table.delete_item(Key={'document_id': document_id})
-        print(f"Deleted from DynamoDB: {document_id}")
-        
+        [result] = await paper_deleter.delete(user_id, [document_id])
+        metadata_cache.invalidate(document_id, user_id)
+    except Exception as e:
+        print(f"Delete error: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to delete paper: {e}")
+
+    if result["status"] == "not_found":
+        raise HTTPException(status_code=404, detail="Paper not found")
+    if result["status"] == "forbidden":
+        raise HTTPException(status_code=403, detail="Not authorized to delete this paper")
+    if result["status"] == "failed":
+        raise HTTPException(status_code=500, detail=f"Failed to delete paper: {'; '.join(result['errors'])}")
+
+    if result["status"] == "partial":
         return {
             "success": True,
-            "message": "Paper deleted successfully",
-            "document_id": document_id
+            "message": f"Paper deleted; {'; '.join(result['errors'])}",
+            "document_id": document_id,
+            "status": "partial",
         }
-        
-    except HTTPException:
-        raise
+
+    return {
+        "success": True,
+        "message": "Paper deleted successfully",
+        "document_id": document_id
+    }
+
+
+class DeleteRequest(BaseModel):
+    document_ids: List[str] = Field(default_factory=list, max_length=DELETE_MAX_PAPERS)
+    all: bool = Field(False, description="Delete every paper of the user (document_ids is ignored)")
+
+
+@app.post("/library/delete")
+async def delete_papers(request: DeleteRequest, user_id: Optional[str] = "default_user"):
+    """
+    Bulk delete: each paper's PDF, extracted text, vectors (in every index
+    generation) and metadata, with one report entry per paper.
+    """
+
+    if not _available(s3_client) or not _available(table):
+        raise HTTPException(status_code=500, detail="AWS services not initialized.")
+    if not request.all and not request.document_ids:
+        raise HTTPException(status_code=400, detail="Pass document_ids, or all=true to delete the whole library.")
+
+    try:
+        results = await paper_deleter.delete(user_id, None if request.all else request.document_ids)
+        for result in results:
+            metadata_cache.invalidate(result["document_id"])
+        metadata_cache.invalidate(user_id=user_id)
     except Exception as e:
-        print(f"Delete error: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to delete paper: {e}")
+        print(f"Bulk delete error: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to delete papers: {e}")
+
+    counts = {status: sum(r["status"] == status for r in results) for status in ("deleted", "partial", "not_found", "forbidden", "failed")}
+    return {"results": results, **counts}
 
 # ----------------------------------------------------
 # HELPER: Search User's Library (DynamoDB)
 # ----------------------------------------------------
 
-def search_user_library(query: str, user_id: str, limit: int) -> List[Dict]:
-    """Search papers uploaded by user in DynamoDB."""
-    try:
-        # Simple scan with contains filter (basic search for MVP)
-        # For production, use DynamoDB + OpenSearch or implement better search
-        response = table.scan(
-            FilterExpression='user_id = :uid AND (contains(#title, :query) OR contains(abstract_snippet, :query))',
-            ExpressionAttributeNames={'#title': 'title'},  # 'title' is a reserved word
-            ExpressionAttributeValues={
-                ':uid': user_id,
-                ':query': query.lower()
-            }
-        )
-        
-        results = []
-        for item in response.get('Items', [])[:limit]:
-            results.append({
-                "source": "Your Library (S3)",
-                "id": item['document_id'],
-                "title": item['title'],
-                "authors": [item.get('author', 'Unknown')],
-                "published": item.get('uploaded_at', '')[:10],
-                "url": f"s3://{item['s3_bucket']}/{item['s3_key']}",
-                "abstract_snippet": item.get('abstract_snippet', '')[:200] + "...",
-                "in_library": True,
-                "page_count": item.get('page_count', 0)
-            })
-        
-        return results
-        
-    except Exception as e:
-        print(f"Library search error: {e}")
-        return []
+def search_user_library(query: str, user_id: str, limit: Optional[int] = None) -> List[Dict]:
+    """Search papers uploaded by user in DynamoDB (all matches when `limit` is None)."""
+    # Simple scan with contains filter (basic search for MVP)
+    # For production, use DynamoDB + OpenSearch or implement better search
+    response = table.scan(
+        FilterExpression='user_id = :uid AND (contains(#title, :query) OR contains(abstract_snippet, :query))',
+        ExpressionAttributeNames={'#title': 'title'},  # 'title' is a reserved word
+        ExpressionAttributeValues={
+            ':uid': user_id,
+            ':query': query.lower()
+        }
+    )
+    
+    results = []
+    for item in response.get('Items', [])[:limit]:
+        results.append({
+            "source": "Your Library (S3)",
+            "id": item['document_id'],
+            "title": item['title'],
+            "authors": [item.get('author', 'Unknown')],
+            "published": item.get('uploaded_at', '')[:10],
+            "url": f"s3://{item['s3_bucket']}/{item['s3_key']}",
+            "abstract_snippet": item.get('abstract_snippet', '')[:200] + "...",
+            "in_library": True,
+            "page_count": item.get('page_count', 0)
+        })
+    
+    return results
 
 # ----------------------------------------------------
 # HELPER: Semantic Scholar Search
@@ -373,14 +1147,15 @@ def search_semantic_scholar_impl(query: str, limit: int) -> List[Dict]:
     results = ss_client.search_paper(
         query=query,
         limit=limit,
-        fields=['paperId', 'title', 'authors', 'publicationDate', 'url', 'abstract']
+        fields=['paperId', 'title', 'authors', 'publicationDate', 'url', 'abstract', 'externalIds']
     )
 
-    # Newer versions return a PaginatedResults object with an `items` attribute.
-    if hasattr(results, "items"):
-        data = results.items
+    # Newer versions return a PaginatedResults object with an `items` attribute
+    # (check for dict first: a dict also has an `items` attribute).
+    if isinstance(results, dict):
+        data = results.get('data', [])
     else:
-        data = results.get('data', []) if isinstance(results, dict) else []
+        data = getattr(results, 'items', [])
 
     formatted_results = []
     for paper in data:
@@ -389,6 +1164,8 @@ def search_semantic_scholar_impl(query: str, limit: int) -> List[Dict]:
             # Author objects may expose `.name`; coerce to list
             authors_raw = list(authors_raw)
 
+        # DOI / arXiv id let the merge stage match this paper across sources.
+        external_ids = _paper_get(paper, 'externalIds') or {}
         formatted_results.append({
             "source": "Semantic Scholar",
             "id": _paper_get(paper, 'paperId'),
@@ -402,7 +1179,9 @@ def search_semantic_scholar_impl(query: str, limit: int) -> List[Dict]:
             "abstract_snippet": (
                 (_paper_get(paper, 'abstract') or '')[:200] + "..."
             ) if _paper_get(paper, 'abstract') else "No abstract available",
-            "in_library": False
+            "in_library": False,
+            **({"doi": external_ids["DOI"]} if external_ids.get("DOI") else {}),
+            **({"arxiv_id": external_ids["ArXiv"]} if external_ids.get("ArXiv") else {}),
         })
 
     return formatted_results
@@ -411,17 +1190,19 @@ def search_semantic_scholar_impl(query: str, limit: int) -> List[Dict]:
 # HELPER: arXiv Search
 # ----------------------------------------------------
 
-def search_arxiv_impl(query: str, limit: int) -> List[Dict]:
-    """Search arXiv API."""
+def search_arxiv_impl(query: str, limit: int, offset: int = 0) -> List[Dict]:
+    """Search arXiv API (results `offset` .. `offset + limit`)."""
+    import arxiv
+
     search = arxiv.Search(
         query=query,
-        max_results=limit,
+        max_results=offset + limit,
         sort_by=arxiv.SortCriterion.SubmittedDate,
         sort_order=arxiv.SortOrder.Descending,
     )
     
     results = []
-    for r in arxiv_client.results(search):
+    for r in arxiv_client.results(search, offset=offset):
         results.append({
             "source": "arXiv",
             "id": r.entry_id.split('/')[-1],
@@ -430,11 +1211,67 @@ def search_arxiv_impl(query: str, limit: int) -> List[Dict]:
             "published": r.published.strftime("%Y-%m-%d"),
             "url": r.pdf_url,
             "abstract_snippet": r.summary[:200] + "...",
-            "in_library": False
+            "in_library": False,
+            **({"doi": r.doi} if getattr(r, "doi", None) else {}),
         })
         
     return results
 
+# ----------------------------------------------------
+# SEARCH SOURCES (fetchers for search.Paginator)
+# ----------------------------------------------------
+
+# The Semantic Scholar API returns at most this many results per query.
+SEMANTIC_SCHOLAR_MAX_RESULTS = 100
+
+
+def _ensure_event_loop():
+    # The sync Semantic Scholar client drives an event loop internally, and
+    # worker threads have none by default.
+    try:
+        asyncio.get_event_loop()
+    except RuntimeError:
+        asyncio.set_event_loop(asyncio.new_event_loop())
+
+
+def _fetch_semantic_scholar(query: str, user_id: str, offset: int, count: int):
+    _ensure_event_loop()
+    # The client has no offset parameter: fetch the first offset + count
+    # results and keep the tail (the paginator buffers everything fetched).
+    want = min(offset + count, SEMANTIC_SCHOLAR_MAX_RESULTS)
+    results = search_semantic_scholar_impl(query, want)[offset:]
+    return results, len(results) < want - offset or want == SEMANTIC_SCHOLAR_MAX_RESULTS
+
+
+def _fetch_arxiv(query: str, user_id: str, offset: int, count: int):
+    results = search_arxiv_impl(query, count, offset=offset)
+    return results, len(results) < count
+
+
+def _fetch_library(query: str, user_id: str, offset: int, count: int):
+    # One scan returns every match, so the source is exhausted after it.
+    return search_user_library(query, user_id)[offset:], True
+
+
+metadata_mirror = (
+    mirror.MetadataMirror(METADATA_MIRROR_PATH, ttl_seconds=METADATA_MIRROR_TTL, offline=METADATA_MIRROR_OFFLINE)
+    if METADATA_MIRROR_PATH else None
+)
+
+
+def _mirrored(source: str, fetcher):
+    return metadata_mirror.wrap(source, fetcher) if metadata_mirror else fetcher
+
+
+paginator = search.Paginator(
+    {
+        "semantic_scholar": _mirrored("semantic_scholar", _limited_call("semantic_scholar", _fetch_semantic_scholar)),
+        "arxiv": _mirrored("arxiv", _limited_call("arxiv", _fetch_arxiv)),
+        "library": _fetch_library,
+    },
+    search.SearchBuffer(ttl_seconds=SEARCH_BUFFER_TTL, max_sessions=SEARCH_BUFFER_MAX_SESSIONS),
+)
+
 # ----------------------------------------------------
 # HEALTH CHECK
 # ----------------------------------------------------
@@ -445,24 +1282,76 @@ def health():
     return {
         "status": "ok",
         "services": {
-            "s3": s3_client is not None,
-            "dynamodb": table is not None,
+            "s3": _available(s3_client),
+            "dynamodb": _available(table),
             "semantic_scholar": SS_API_KEY is not None
         },
-        "table_name": DYNAMODB_TABLE if table else None
+        "table_name": DYNAMODB_TABLE if _available(table) else None,
+        "jobs": job_queue.stats() if job_queue else None,
+        "upstream_limits": {name: limit.stats() for name, limit in upstream_limits.items()},
     }
 
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    """Latency histograms, error counters and payload sizes in Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 # ----------------------------------------------------
 # STARTUP MESSAGE
 # ----------------------------------------------------
 
+def warm_up():
+    """Build every client and import the lazily loaded libraries."""
+    start = time.perf_counter()
+    try:
+        import PyPDF2  # noqa: F401
+        clients.warm_up(
+            *(c.client if isinstance(c, limits.LimitedClient) else c for c in (s3_client, table, dynamodb)),
+            ss_client, arxiv_client, bedrock if SEARCH_RERANK else None,
+        )
+        print(f"Clients warmed up in {(time.perf_counter() - start) * 1000:.0f} ms")
+    except Exception as e:
+        print(f"Client warm-up failed (will retry on first use): {e}")
+
+
+async def _requeue_stale_jobs() -> None:
+    try:
+        stale = await asyncio.to_thread(claim_stale_jobs, table, JOB_LEASE_SECONDS)
+    except Exception as e:
+        print(f"Re-queueing stale indexing jobs failed: {e}")
+        return
+    for item in stale:
+        job_queue.submit(item["document_id"], item["user_id"], item["s3_bucket"], item["s3_key"],
+                         priority=Priority.BULK)
+    if stale:
+        print(f"Re-queued {len(stale)} indexing jobs left unfinished by an earlier worker")
+
+
 @app.on_event("startup")
 async def startup_event():
-    """Print startup information."""
+    """Start the indexing workers, schedule the warm-up and print startup information."""
+    global job_queue
+    if job_queue is None:
+        job_queue = await asyncio.to_thread(_build_job_queue)
+    if job_queue is not None:
+        job_queue.start()
+        if JOB_LEASE_SECONDS > 0:
+            app.state.requeue_task = asyncio.create_task(_requeue_stale_jobs())
+    if WARM_UP_CLIENTS:
+        app.state.warm_up_task = asyncio.create_task(asyncio.to_thread(warm_up))
+
     print("\n" + "="*50)
     print("Research Paper API Started!")
     print("="*50)
     print(f"S3 Bucket: {S3_BUCKET_NAME}")
     print(f"DynamoDB Table: {DYNAMODB_TABLE}")
     print(f"Semantic Scholar API: {'Configured' if SS_API_KEY else 'Not configured'}")
-    print("="*50 + "\n")
\ No newline at end of file
+    print(f"Indexing jobs: {JOB_RUNNER} (concurrency={JOB_CONCURRENCY if job_queue else 0})")
+    print("="*50 + "\n")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if job_queue is not None:
+        await job_queue.stop()
\ No newline at end of file
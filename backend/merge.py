@@ -0,0 +1,259 @@
+"""
+Merging search results from several sources into one ranked list.
+
+The same paper often comes back from the library, Semantic Scholar and
+arXiv. ``Merger`` collapses those rows into one record that lists every
+source it came from, and scores it.
+
+Two results are the same paper when they share an arXiv id, a DOI or a
+normalized title, or when their titles are near-identical (token Jaccard
+>= ``TITLE_JACCARD``). Rather than comparing every pair, each result is
+indexed by its identifiers and by the prefix of its title tokens
+("prefix filtering"): two titles that reach the threshold always share a
+prefix token, so only results in the same blocks are compared. Matches are
+joined with union-find, so A~B and B~C end up in one record.
+
+The score is reciprocal rank fusion over the sources (``1 / (RRF_K + rank)``
+per source the paper was found in), plus a small bonus for query terms in
+the title and abstract. A paper found by several sources outranks one
+found by a single source at the same rank.
+"""
+import math
+import re
+import unicodedata
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+RRF_K = 60
+TITLE_JACCARD = 0.85
+# Shorter titles ("Introduction", "Deep Learning") only match exactly.
+MIN_FUZZY_TOKENS = 4
+# Whose fields win when records are merged (the library copy is the user's own).
+SOURCE_PREFERENCE = ("library", "semantic_scholar", "arxiv")
+
+_ARXIV_ID = re.compile(r"^(?:arxiv:)?(\d{4}\.\d{4,5}|[a-z\-]+(?:\.[a-z]{2})?/\d{7})(?:v\d+)?$", re.I)
+_ARXIV_IN_TEXT = re.compile(r"arxiv(?:\.org/(?:abs|pdf)/|:\s*)(\d{4}\.\d{4,5}|[a-z\-]+(?:\.[a-z]{2})?/\d{7})", re.I)
+_DOI_IN_TEXT = re.compile(r"\b(10\.\d{4,9}/[^\s\"'<>]+)", re.I)
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+_NO_ABSTRACT = {"", "...", "No abstract available"}
+
+
+def title_tokens(title: Optional[str]) -> Tuple[str, ...]:
+    """Lowercase, accent-free, punctuation-free title words."""
+    text = unicodedata.normalize("NFKD", title or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    return tuple(_NON_ALNUM.sub(" ", text).split())
+
+
+def normalize_arxiv_id(value: Optional[str]) -> Optional[str]:
+    match = _ARXIV_ID.match((value or "").strip())
+    return match.group(1).lower() if match else None
+
+
+def normalize_doi(value: Optional[str]) -> Optional[str]:
+    match = _DOI_IN_TEXT.search(value or "")
+    return match.group(1).rstrip(".,;)]").lower() if match else None
+
+
+def identifiers(result: Dict, source: str) -> Tuple[Optional[str], Optional[str]]:
+    """(arXiv id, DOI) of a result, from explicit fields or its URL / first-page text."""
+    arxiv_id = normalize_arxiv_id(result.get("arxiv_id"))
+    if arxiv_id is None and source == "arxiv":
+        arxiv_id = normalize_arxiv_id(result.get("id"))
+    doi = normalize_doi(result.get("doi"))
+    # Library rows only have the PDF's first-page text, which usually
+    # carries the arXiv stamp and/or the DOI.
+    for text in (result.get("url"), result.get("abstract_snippet") if source == "library" else None):
+        if not text:
+            continue
+        if arxiv_id is None:
+            match = _ARXIV_IN_TEXT.search(text)
+            arxiv_id = match.group(1).lower() if match else None
+        if doi is None:
+            doi = normalize_doi(text)
+    return arxiv_id, doi
+
+
+def _token_order(token: str):
+    # Any fixed order keeps prefix filtering exact; long words first keeps
+    # the blocks small, since they are the rare ones.
+    return (-len(token), token)
+
+
+def _prefix(tokens: FrozenSet[str]) -> List[str]:
+    size = len(tokens) - math.ceil(TITLE_JACCARD * len(tokens)) + 1
+    return sorted(tokens, key=_token_order)[:size]
+
+
+@dataclass
+class Entry:
+    result: Dict
+    source: str                         # source key, e.g. "arxiv"
+    rank: int                           # position in that source's results
+    tokens: FrozenSet[str]
+    arxiv_id: Optional[str]
+    doi: Optional[str]
+
+
+class Merger:
+    """
+    Incremental dedup of one search's results. ``add`` every result as it
+    is consumed; ``record(i)`` builds the merged, scored record of the
+    paper that entry ``i`` belongs to.
+    """
+
+    def __init__(self, query: str):
+        self.entries: List[Entry] = []
+        self._query_tokens = frozenset(title_tokens(query))
+        self._parent: List[int] = []
+        self._members: Dict[int, List[int]] = {}              # root -> entry ids
+        self._ids: Dict[int, Tuple[Set[str], Set[str]]] = {}  # root -> (arXiv ids, DOIs)
+        self._by_key: Dict[str, int] = {}                     # "arxiv:..", "doi:..", "title:.." -> entry id
+        self._blocks: Dict[str, List[int]] = defaultdict(list)  # title prefix token -> entry ids
+        self._positions: Dict[Tuple[str, int], int] = {}      # (source, rank) -> entry id
+        self._dropped: Set[int] = set()                       # entries forgotten by drop_source
+
+    def find(self, i: int) -> int:
+        while self._parent[i] != i:
+            self._parent[i] = self._parent[self._parent[i]]
+            i = self._parent[i]
+        return i
+
+    def _union(self, a: int, b: int) -> None:
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        if len(self._members[a]) < len(self._members[b]):
+            a, b = b, a
+        self._parent[b] = a
+        self._members[a].extend(self._members.pop(b))
+        arxiv_ids, dois = self._ids.pop(b)
+        self._ids[a][0].update(arxiv_ids)
+        self._ids[a][1].update(dois)
+
+    def _conflict(self, a: int, b: int) -> bool:
+        # Similar titles but different papers (e.g. a workshop and a journal
+        # version): both sides have arXiv ids (or DOIs) and none in common.
+        ids_a, ids_b = self._ids[self.find(a)], self._ids[self.find(b)]
+        return any(x and y and not x & y for x, y in zip(ids_a, ids_b))
+
+    def add(self, result: Dict, source: str, rank: int) -> int:
+        """Index a result; returns its entry id. Adding the same (source, rank) twice is a no-op."""
+        known = self._positions.get((source, rank))
+        if known is not None:
+            return known
+        tokens = frozenset(title_tokens(result.get("title")))
+        arxiv_id, doi = identifiers(result, source)
+        i = len(self.entries)
+        self.entries.append(Entry(result, source, rank, tokens, arxiv_id, doi))
+        self._parent.append(i)
+        self._link(i)
+        return i
+
+    def drop_source(self, source: str) -> None:
+        """
+        Forget every row of ``source`` (its results are being refetched):
+        the other entries are re-linked without them. Entry ids stay valid;
+        the dropped entries are left on their own and are not matched again.
+        """
+        self._members, self._ids, self._by_key, self._positions = {}, {}, {}, {}
+        self._blocks = defaultdict(list)
+        self._dropped.update(i for i, entry in enumerate(self.entries) if entry.source == source)
+        for i in range(len(self.entries)):
+            self._parent[i] = i
+            if i in self._dropped:
+                self._members[i] = [i]
+                self._ids[i] = (set(), set())
+            else:
+                self._link(i)
+
+    def _link(self, i: int) -> None:
+        """Merge entry ``i`` into the records it matches."""
+        entry = self.entries[i]
+        tokens, arxiv_id, doi = entry.tokens, entry.arxiv_id, entry.doi
+        self._members[i] = [i]
+        self._ids[i] = ({arxiv_id} if arxiv_id else set(), {doi} if doi else set())
+        self._positions[(entry.source, entry.rank)] = i
+
+        for key in (f"arxiv:{arxiv_id}" if arxiv_id else None, f"doi:{doi}" if doi else None):
+            if key is None:
+                continue
+            if key in self._by_key:
+                self._union(i, self._by_key[key])
+            else:
+                self._by_key[key] = i
+
+        if tokens:
+            key = "title:" + " ".join(sorted(tokens))
+            other = self._by_key.get(key)
+            if other is None:
+                self._by_key[key] = i
+            elif not self._conflict(i, other):
+                self._union(i, other)
+
+        if len(tokens) >= MIN_FUZZY_TOKENS:
+            prefix = _prefix(tokens)
+            candidates: Set[int] = set()
+            for token in prefix:
+                candidates.update(self._blocks[token])
+            for j in candidates:
+                other = self.entries[j]
+                if self.find(j) == self.find(i) or self._conflict(i, j):
+                    continue
+                smaller, larger = sorted((len(tokens), len(other.tokens)))
+                if smaller < TITLE_JACCARD * larger:
+                    continue
+                if len(tokens & other.tokens) >= TITLE_JACCARD * len(tokens | other.tokens):
+                    self._union(i, j)
+            for token in prefix:
+                self._blocks[token].append(i)
+
+    def members(self, i: int) -> List[Entry]:
+        return [self.entries[j] for j in self._members[self.find(i)]]
+
+    def seen_before(self, i: int, offsets: Dict[str, int]) -> bool:
+        """True if the record was already returned on an earlier page (one of its rows precedes ``offsets``)."""
+        return any(m.rank < offsets.get(m.source, 0) for m in self.members(i))
+
+    def score(self, i: int) -> float:
+        members = self.members(i)
+        best: Dict[str, int] = {}
+        for m in members:
+            best[m.source] = min(best.get(m.source, m.rank), m.rank)
+        score = sum(1.0 / (RRF_K + rank + 1) for rank in best.values())
+        if self._query_tokens:
+            words: Set[str] = set()
+            for m in members:
+                words.update(m.tokens)
+                words.update(title_tokens(m.result.get("abstract_snippet")))
+            score += len(self._query_tokens & words) / len(self._query_tokens) / (RRF_K + 1)
+        return score
+
+    def record(self, i: int) -> Dict:
+        """The merged result: the preferred source's fields, gaps filled from the others."""
+        members = sorted(
+            self.members(i),
+            key=lambda m: (SOURCE_PREFERENCE.index(m.source) if m.source in SOURCE_PREFERENCE else len(SOURCE_PREFERENCE), m.rank),
+        )
+        merged = dict(members[0].result)
+        for m in members[1:]:
+            for key, value in m.result.items():
+                if value and (not merged.get(key) or (key == "abstract_snippet" and merged[key] in _NO_ABSTRACT)):
+                    merged[key] = value
+        merged["in_library"] = any(m.result.get("in_library") for m in members)
+        arxiv_id = next((m.arxiv_id for m in members if m.arxiv_id), None)
+        doi = next((m.doi for m in members if m.doi), None)
+        if arxiv_id:
+            merged["arxiv_id"] = arxiv_id
+        if doi:
+            merged["doi"] = doi
+        provenance, seen = [], set()
+        for m in members:
+            key = (m.result.get("source"), m.result.get("id"))
+            if key not in seen:
+                seen.add(key)
+                provenance.append({"source": key[0], "id": key[1], "url": m.result.get("url")})
+        merged["sources"] = provenance
+        merged["score"] = round(self.score(i), 6)
+        return merged
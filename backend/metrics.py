@@ -0,0 +1,205 @@
+"""
+In-process metrics for the API, exposed in Prometheus text format at /metrics.
+
+These families cover the hot paths:
+
+* ``paper_api_operation_seconds{operation, source}`` - latency histogram of
+  every upstream call (search sources, PDF parse, S3, DynamoDB, ...);
+* ``paper_api_operation_errors_total{operation, source, error}``;
+* ``paper_api_payload_bytes{operation}`` / ``paper_api_result_count{operation, source}``
+  - request/response sizes;
+* ``paper_api_cache_lookups_total{cache, source, outcome}`` - local caches;
+* ``paper_api_rate_limited_total{rule}`` - requests rejected with 429;
+* ``paper_api_upstream_concurrency_limit{upstream}`` /
+  ``paper_api_upstream_rejected_total{upstream}`` - adaptive concurrency
+  limits per upstream and the calls shed because a limit was reached.
+
+plus ``paper_api_http_request_seconds{method, route, status}`` recorded by
+the HTTP middleware. Usage:
+
+    with metrics.timed("s3_put_object", payload_bytes=len(body)):
+        s3_client.put_object(...)
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 1e6, 5e6, 1e7, 5e7, 1e8)
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {_fmt(value)}")
+        return "\n".join(lines)
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {_fmt(value)}")
+        return "\n".join(lines)
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # label values -> [bucket counts..., sum, count]
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                cumulative = 0
+                for i, bound in enumerate(self.buckets):
+                    cumulative += state[i]
+                    le = 'le="' + _fmt(bound) + '"'
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_fmt(state[-2])}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {state[-1]}")
+        return "\n".join(lines)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(m.render() for m in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+OPERATION_SECONDS = REGISTRY.register(Histogram(
+    "paper_api_operation_seconds", "Latency of upstream calls made by the API.", ("operation", "source"),
+))
+OPERATION_ERRORS = REGISTRY.register(Counter(
+    "paper_api_operation_errors_total", "Failed upstream calls made by the API.", ("operation", "source", "error"),
+))
+PAYLOAD_BYTES = REGISTRY.register(Histogram(
+    "paper_api_payload_bytes", "Size of payloads read or written.", ("operation",), buckets=BYTES_BUCKETS,
+))
+RESULT_COUNT = REGISTRY.register(Histogram(
+    "paper_api_result_count", "Rows returned by a query.", ("operation", "source"), buckets=COUNT_BUCKETS,
+))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "paper_api_cache_lookups_total", "Cache lookups by outcome (hit, stale, miss, ...).", ("cache", "source", "outcome"),
+))
+RATE_LIMITED = REGISTRY.register(Counter(
+    "paper_api_rate_limited_total", "Requests rejected by the per-user rate limiter.", ("rule",),
+))
+UPSTREAM_LIMIT = REGISTRY.register(Gauge(
+    "paper_api_upstream_concurrency_limit", "Current adaptive concurrency limit per upstream.", ("upstream",),
+))
+UPSTREAM_REJECTED = REGISTRY.register(Counter(
+    "paper_api_upstream_rejected_total", "Upstream calls shed because the concurrency limit was reached.",
+    ("upstream",),
+))
+HTTP_SECONDS = REGISTRY.register(Histogram(
+    "paper_api_http_request_seconds", "HTTP request latency.", ("method", "route", "status"),
+))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@contextmanager
+def timed(operation: str, source: str = "", payload_bytes: Optional[int] = None):
+    """Time a block as ``operation``; exceptions are counted and re-raised."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        OPERATION_ERRORS.inc(operation=operation, source=source, error=type(e).__name__)
+        raise
+    finally:
+        OPERATION_SECONDS.observe(time.perf_counter() - start, operation=operation, source=source)
+        if payload_bytes is not None:
+            PAYLOAD_BYTES.observe(payload_bytes, operation=operation)
+
+
+def observe_results(operation: str, count: int, source: str = "") -> None:
+    RESULT_COUNT.observe(count, operation=operation, source=source)
+
+
+def observe_payload(operation: str, size: int) -> None:
+    PAYLOAD_BYTES.observe(size, operation=operation)
+
+
+def count_cache(cache: str, outcome: str, source: str = "", count: int = 1) -> None:
+    if count:
+        CACHE_LOOKUPS.inc(count, cache=cache, source=source, outcome=outcome)
+
+
+def render() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,375 @@
+"""
+Local mirror of external paper metadata (arXiv, Semantic Scholar) in SQLite.
+
+Every result the search fetchers get from upstream is stored here, along
+with the ordered result list of each (source, query). ``MetadataMirror.wrap``
+turns a search fetcher (see ``search.Fetcher``) into one that answers from
+the mirror first:
+
+* query seen within ``ttl_seconds`` -> served from SQLite, no external call;
+* query seen earlier than that -> still served from SQLite, and re-fetched
+  from upstream in the background (stale-while-revalidate);
+* query not seen -> upstream, and the results are stored;
+* upstream failing (or ``offline=True``) -> full-text search (FTS5) over
+  everything mirrored, so search keeps working without the live APIs.
+
+The mirror can be pre-filled from bulk metadata dumps - the arXiv OAI
+snapshot (``arxiv-metadata-oai-snapshot.json``) or Semantic Scholar
+``papers`` dataset files, optionally gzipped:
+
+    python mirror.py import arxiv-metadata-oai-snapshot.json --format arxiv
+    python mirror.py import papers-part0.jsonl.gz --format s2
+    python mirror.py stats
+"""
+import argparse
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import merge
+import metrics
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "metadata_mirror.sqlite3")
+# Source key (as used by the search paginator) -> "source" field of its results.
+SOURCE_LABELS = {"arxiv": "arXiv", "semantic_scholar": "Semantic Scholar"}
+# Results fetched per background refresh, at least.
+REFRESH_BATCH = 20
+IMPORT_BATCH = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS papers (
+    rowid INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,           -- "<source>:<id>"
+    source TEXT NOT NULL,
+    result TEXT NOT NULL,               -- the search result, JSON
+    updated_at REAL NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS papers_fts USING fts5(
+    title, abstract, authors, tokenize = 'unicode61 remove_diacritics 2'
+);
+CREATE TABLE IF NOT EXISTS queries (
+    source TEXT NOT NULL,
+    query TEXT NOT NULL,
+    keys TEXT NOT NULL,                 -- JSON list of paper keys, in upstream order
+    exhausted INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (source, query)
+);
+"""
+
+
+def _normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def _paper_key(source: str, result: Dict) -> str:
+    return f"{source}:{result['id']}"
+
+
+class MetadataMirror:
+    def __init__(self, path: str = DEFAULT_PATH, ttl_seconds: float = 86400.0, offline: bool = False,
+                 refresh_workers: int = 2):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.offline = offline
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+        self._refreshing = set()
+        self._refresh_lock = threading.Lock()
+        self._refresh_workers = refresh_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    # ---- storage ----
+
+    def _conn(self) -> sqlite3.Connection:
+        """One connection per thread (the fetchers run in worker threads)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with self._schema_lock:
+                if not self._schema_ready:
+                    conn.executescript(SCHEMA)
+                    self._schema_ready = True
+            self._local.conn = conn
+        return conn
+
+    def _upsert(self, conn: sqlite3.Connection, source: str, result: Dict, abstract: Optional[str] = None) -> str:
+        key = _paper_key(source, result)
+        data = json.dumps(result, separators=(",", ":"), default=str)
+        now = time.time()
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO papers (key, source, result, updated_at) VALUES (?, ?, ?, ?)",
+            (key, source, data, now),
+        )
+        if cursor.rowcount:
+            rowid = cursor.lastrowid
+        else:
+            conn.execute("UPDATE papers SET result = ?, updated_at = ? WHERE key = ?", (data, now, key))
+            rowid = conn.execute("SELECT rowid FROM papers WHERE key = ?", (key,)).fetchone()[0]
+            conn.execute("DELETE FROM papers_fts WHERE rowid = ?", (rowid,))
+        conn.execute(
+            "INSERT INTO papers_fts (rowid, title, abstract, authors) VALUES (?, ?, ?, ?)",
+            (rowid, result.get("title") or "", abstract or result.get("abstract_snippet") or "",
+             " ".join(result.get("authors") or [])),
+        )
+        return key
+
+    def store(self, source: str, query: str, offset: int, results: List[Dict], exhausted: bool) -> None:
+        """Mirror ``results`` (upstream positions ``offset``...) of ``query``."""
+        query = _normalize_query(query)
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            keys = [self._upsert(conn, source, r) for r in results if r.get("id")]
+            row = conn.execute(
+                "SELECT keys, fetched_at FROM queries WHERE source = ? AND query = ?", (source, query),
+            ).fetchone()
+            known = json.loads(row[0]) if row else []
+            # Only a contiguous list can be served later; a page fetched past
+            # the end of what we have (a resumed cursor) is not recorded.
+            if offset <= len(known):
+                fetched_at = time.time() if offset == 0 or row is None else row[1]
+                conn.execute(
+                    "INSERT OR REPLACE INTO queries (source, query, keys, exhausted, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                    (source, query, json.dumps(known[:offset] + keys), int(exhausted), fetched_at),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def lookup(self, source: str, query: str) -> Optional[Tuple[List[Dict], bool, float]]:
+        """(results, exhausted, fetched_at) of a mirrored query, or None."""
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT keys, exhausted, fetched_at FROM queries WHERE source = ? AND query = ?",
+            (source, _normalize_query(query)),
+        ).fetchone()
+        if row is None:
+            return None
+        keys = json.loads(row[0])
+        if not keys:
+            return [], bool(row[1]), row[2]
+        placeholders = ",".join("?" * len(keys))
+        found = dict(conn.execute(f"SELECT key, result FROM papers WHERE key IN ({placeholders})", keys).fetchall())
+        if len(found) != len(keys):
+            return None
+        return [json.loads(found[k]) for k in keys], bool(row[1]), row[2]
+
+    def search(self, query: str, source: Optional[str] = None, limit: int = 20) -> List[Dict]:
+        """Full-text search over every mirrored paper (title weighted highest)."""
+        tokens = merge.title_tokens(query)
+        if not tokens:
+            return []
+        conn = self._conn()
+        sql = (
+            "SELECT p.result FROM papers_fts JOIN papers p ON p.rowid = papers_fts.rowid "
+            "WHERE papers_fts MATCH ?" + (" AND p.source = ?" if source else "")
+            + " ORDER BY bm25(papers_fts, 10.0, 1.0, 2.0) LIMIT ?"
+        )
+        # All terms first; if nothing has all of them, any term.
+        for joiner in (" ", " OR "):
+            match = joiner.join(f'"{t}"' for t in tokens)
+            params = (match, source, limit) if source else (match, limit)
+            rows = conn.execute(sql, params).fetchall()
+            if rows:
+                return [json.loads(r[0]) for r in rows]
+        return []
+
+    def stats(self) -> Dict:
+        conn = self._conn()
+        papers = dict(conn.execute("SELECT source, COUNT(*) FROM papers GROUP BY source").fetchall())
+        queries = conn.execute("SELECT COUNT(*) FROM queries").fetchone()[0]
+        return {"path": self.path, "papers": papers, "queries": queries}
+
+    # ---- search fetchers ----
+
+    def wrap(self, source: str, fetcher):
+        """A ``search.Fetcher`` for ``source`` that reads through the mirror."""
+
+        def fetch(query: str, user_id: str, offset: int, count: int):
+            with metrics.timed("metadata_mirror_lookup", source=source):
+                cached = self.lookup(source, query)
+            if cached is not None:
+                results, exhausted, fetched_at = cached
+                if exhausted or len(results) >= offset + count:
+                    stale = time.time() - fetched_at > self.ttl_seconds
+                    if stale and not self.offline:
+                        self._refresh(source, query, fetcher, max(len(results), REFRESH_BATCH))
+                    metrics.count_cache("metadata_mirror", "stale" if stale else "hit", source)
+                    return results[offset:], exhausted
+            if self.offline:
+                metrics.count_cache("metadata_mirror", "offline", source)
+                return self._fallback(source, query, cached, offset, count)
+
+            metrics.count_cache("metadata_mirror", "miss", source)
+            try:
+                results, exhausted = fetcher(query, user_id, offset, count)
+            except Exception as e:
+                fallback = self._fallback(source, query, cached, offset, count)
+                if not fallback[0]:
+                    raise
+                print(f"Search source {source} failed ({e}); serving {len(fallback[0])} mirrored results")
+                metrics.count_cache("metadata_mirror", "fallback", source)
+                return fallback
+            self._store_quietly(source, query, offset, results, exhausted)
+            return results, exhausted
+
+        return fetch
+
+    def _fallback(self, source, query, cached, offset, count) -> Tuple[List[Dict], bool]:
+        if cached is not None and len(cached[0]) > offset:
+            return cached[0][offset:], True
+        results = self.search(query, source=source, limit=offset + count)[offset:]
+        return results, True
+
+    def _store_quietly(self, source, query, offset, results, exhausted) -> None:
+        # The mirror is an optimization; never fail a search because of it.
+        try:
+            self.store(source, query, offset, results, exhausted)
+        except sqlite3.Error as e:
+            print(f"Metadata mirror write failed: {e}")
+
+    def _refresh(self, source: str, query: str, fetcher, count: int) -> None:
+        key = (source, _normalize_query(query))
+        with self._refresh_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self._refresh_workers, thread_name_prefix="mirror-refresh")
+
+        def run():
+            try:
+                with metrics.timed("metadata_mirror_refresh", source=source):
+                    results, exhausted = fetcher(query, "", 0, count)
+                self._store_quietly(source, query, 0, results, exhausted)
+            except Exception as e:
+                print(f"Metadata mirror refresh of {source} {query!r} failed: {e}")
+            finally:
+                with self._refresh_lock:
+                    self._refreshing.discard(key)
+
+        self._executor.submit(run)
+
+    # ---- bulk dumps ----
+
+    def import_records(self, records: Iterable[Tuple[str, Dict, Optional[str]]]) -> int:
+        """Mirror (source, result, full abstract) tuples in large transactions."""
+        conn = self._conn()
+        count = 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for source, result, abstract in records:
+                self._upsert(conn, source, result, abstract)
+                count += 1
+                if count % IMPORT_BATCH == 0:
+                    conn.execute("COMMIT")
+                    print(f"  {count} papers imported")
+                    conn.execute("BEGIN IMMEDIATE")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return count
+
+
+def _snippet(abstract: Optional[str]) -> str:
+    abstract = " ".join((abstract or "").split())
+    return abstract[:200] + "..." if abstract else "No abstract available"
+
+
+def _read_lines(path: str) -> Iterator[Dict]:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def arxiv_records(path: str) -> Iterator[Tuple[str, Dict, Optional[str]]]:
+    """Records of the arXiv OAI metadata snapshot (one JSON object per line)."""
+    for paper in _read_lines(path):
+        versions = paper.get("versions") or [{"version": "v1"}]
+        entry_id = f"{paper['id']}{versions[-1]['version']}"
+        published = ""
+        if versions[0].get("created"):
+            published = datetime.strptime(versions[0]["created"], "%a, %d %b %Y %H:%M:%S %Z").strftime("%Y-%m-%d")
+        authors = [
+            " ".join(part for part in (a[1], a[0]) if part) for a in paper.get("authors_parsed") or []
+        ] or [a.strip() for a in (paper.get("authors") or "").split(",") if a.strip()]
+        result = {
+            "source": SOURCE_LABELS["arxiv"],
+            "id": entry_id,
+            "title": " ".join((paper.get("title") or "").split()),
+            "authors": authors,
+            "published": published,
+            "url": f"http://arxiv.org/pdf/{entry_id}",
+            "abstract_snippet": _snippet(paper.get("abstract")),
+            "in_library": False,
+        }
+        if paper.get("doi"):
+            result["doi"] = paper["doi"]
+        yield "arxiv", result, paper.get("abstract")
+
+
+def semantic_scholar_records(path: str) -> Iterator[Tuple[str, Dict, Optional[str]]]:
+    """Records of a Semantic Scholar ``papers`` dataset file (JSON lines)."""
+    for paper in _read_lines(path):
+        url = paper.get("url") or ""
+        paper_id = paper.get("paperId") or url.rstrip("/").rsplit("/", 1)[-1]
+        if not paper_id:
+            continue
+        external_ids = paper.get("externalids") or paper.get("externalIds") or {}
+        result = {
+            "source": SOURCE_LABELS["semantic_scholar"],
+            "id": paper_id,
+            "title": paper.get("title") or "",
+            "authors": [a.get("name") for a in paper.get("authors") or [] if a.get("name")],
+            "published": paper.get("publicationdate") or paper.get("publicationDate") or "",
+            "url": url or f"https://www.semanticscholar.org/paper/{paper_id}",
+            "abstract_snippet": _snippet(paper.get("abstract")),
+            "in_library": False,
+        }
+        if external_ids.get("DOI"):
+            result["doi"] = external_ids["DOI"]
+        if external_ids.get("ArXiv"):
+            result["arxiv_id"] = external_ids["ArXiv"]
+        yield "semantic_scholar", result, paper.get("abstract")
+
+
+DUMP_FORMATS = {"arxiv": arxiv_records, "s2": semantic_scholar_records}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the local paper metadata mirror.")
+    parser.add_argument("--db", default=os.environ.get("METADATA_MIRROR_PATH") or DEFAULT_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    importer = commands.add_parser("import", help="Import a bulk metadata dump")
+    importer.add_argument("path")
+    importer.add_argument("--format", choices=sorted(DUMP_FORMATS), required=True)
+    commands.add_parser("stats", help="Show what is mirrored")
+    args = parser.parse_args(argv)
+
+    mirror = MetadataMirror(args.db)
+    if args.command == "import":
+        start = time.time()
+        count = mirror.import_records(DUMP_FORMATS[args.format](args.path))
+        print(f"Imported {count} papers into {args.db} in {time.time() - start:.1f}s")
+    print(json.dumps(mirror.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
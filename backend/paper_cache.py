@@ -0,0 +1,195 @@
+"""
+Read-through cache of paper metadata, and HTTP validators for it.
+
+``/paper/{id}``, ``/papers`` and ``/library`` are read far more often than
+papers change (the frontend re-fetches a paper's details while its user
+reads or chats about it), so items and per-user libraries are kept in an
+in-process LRU for ``ttl_seconds``. The API drops an entry whenever it
+changes the paper itself (upload, import, delete), when an indexing job it
+queued finishes, and when a status read shows a newer status than the
+cached copy. Changes made elsewhere (the Lambdas, another API worker)
+surface within the TTL.
+
+Every response carries an ``ETag`` (hash of the JSON body) and a
+``Last-Modified`` (newest ``status_updated_at`` / ``updated_at`` /
+``uploaded_at``; metadata rewrites set ``updated_at``), so a
+client revalidating with ``If-None-Match`` / ``If-Modified-Since`` gets an
+empty 304 - from the cache, without touching DynamoDB.
+
+A read that races an invalidation must not store what it read: callers take
+a ``token()`` before reading DynamoDB and pass it to ``put``, which skips
+the write if anything was invalidated in between.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, List, Optional
+
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+from paper_common.retry import backoff_delay
+
+import metrics
+
+BATCH_GET_LIMIT = 100           # keys per BatchGetItem call
+
+
+@dataclass
+class Cached:
+    payload: object                 # JSON-ready body
+    etag: str
+    last_modified: Optional[datetime]
+    stored_at: float
+
+
+def _parse_time(value) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    # uploaded_at is naive UTC (datetime.utcnow().isoformat()).
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def last_modified_of(items: List[Dict]) -> Optional[datetime]:
+    times = [
+        t for item in items
+        for t in (_parse_time(item.get(f)) for f in ("status_updated_at", "updated_at", "uploaded_at")) if t
+    ]
+    return max(times).replace(microsecond=0) if times else None
+
+
+def validators(payload, items: List[Dict]) -> Cached:
+    body = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    etag = '"' + hashlib.sha1(body.encode("utf-8")).hexdigest()[:20] + '"'
+    return Cached(payload, etag, last_modified_of(items), time.monotonic())
+
+
+def respond(request: Request, cached: Cached) -> Response:
+    """200 with the body, or 304 without it if the client's copy is current."""
+    headers = {"ETag": cached.etag, "Cache-Control": "private, no-cache"}
+    if cached.last_modified is not None:
+        headers["Last-Modified"] = format_datetime(cached.last_modified, usegmt=True)
+    if _not_modified(request, cached):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(cached.payload, headers=headers)
+
+
+def _not_modified(request: Request, cached: Cached) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match wins over If-Modified-Since (RFC 9110 13.2.2).
+        tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+        return "*" in tags or cached.etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and cached.last_modified is not None:
+        try:
+            return cached.last_modified <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+class PaperCache:
+    def __init__(self, ttl_seconds: float = 30.0, max_items: int = 10000, max_libraries: int = 1000):
+        self.ttl_seconds = ttl_seconds
+        self.max_items = max_items
+        self.max_libraries = max_libraries
+        self._items: "OrderedDict[str, Cached]" = OrderedDict()       # document_id -> item
+        self._libraries: "OrderedDict[str, Cached]" = OrderedDict()   # user_id -> {"count", "papers"}
+        self._epoch = 0                                                # bumped by every invalidation
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    def _get(self, entries: OrderedDict, key: str, cache: str) -> Optional[Cached]:
+        with self._lock:
+            cached = entries.get(key)
+            if cached is not None and time.monotonic() - cached.stored_at > self.ttl_seconds:
+                del entries[key]
+                cached = None
+            if cached is not None:
+                entries.move_to_end(key)
+        metrics.count_cache(cache, "hit" if cached is not None else "miss")
+        return cached
+
+    def token(self) -> int:
+        return self._epoch
+
+    def _put(self, entries: OrderedDict, key: str, cached: Cached, limit: int, token: Optional[int]) -> Cached:
+        if self.enabled:
+            with self._lock:
+                if token is not None and token != self._epoch:
+                    return cached
+                entries[key] = cached
+                entries.move_to_end(key)
+                while len(entries) > limit:
+                    entries.popitem(last=False)
+        return cached
+
+    def get(self, document_id: str) -> Optional[Cached]:
+        return self._get(self._items, document_id, "paper_metadata")
+
+    def put(self, item: Dict, token: Optional[int] = None) -> Cached:
+        payload = jsonable_encoder(item)
+        return self._put(self._items, item["document_id"], validators(payload, [item]), self.max_items, token)
+
+    def get_library(self, user_id: str) -> Optional[Cached]:
+        return self._get(self._libraries, user_id, "library")
+
+    def put_library(self, user_id: str, items: List[Dict], token: Optional[int] = None) -> Cached:
+        payload = jsonable_encoder({"count": len(items), "papers": items})
+        return self._put(self._libraries, user_id, validators(payload, items), self.max_libraries, token)
+
+    def invalidate(self, document_id: Optional[str] = None, user_id: Optional[str] = None) -> None:
+        """Drop a paper and/or a user's library (the owner's library goes with the paper)."""
+        with self._lock:
+            self._epoch += 1
+            if document_id is not None:
+                cached = self._items.pop(document_id, None)
+                if cached is not None and user_id is None:
+                    user_id = cached.payload.get("user_id")
+            if user_id is not None:
+                self._libraries.pop(user_id, None)
+
+    def observe_status(self, document_id: str, state: Dict) -> None:
+        """Invalidate a paper whose freshly read status is newer than the cached one."""
+        with self._lock:
+            cached = self._items.get(document_id)
+        if cached is not None and (
+            cached.payload.get("status") != state.get("status")
+            or cached.payload.get("status_updated_at") != state.get("status_updated_at")
+        ):
+            self.invalidate(document_id)
+
+
+def batch_get_items(dynamodb, table_name: str, document_ids: List[str], attempts: int = 5) -> List[Dict]:
+    """
+    Items for ``document_ids`` (missing ones are skipped) via BatchGetItem on
+    the DynamoDB service resource, retrying unprocessed keys with backoff.
+    """
+    items: List[Dict] = []
+    for i in range(0, len(document_ids), BATCH_GET_LIMIT):
+        request = {table_name: {"Keys": [{"document_id": d} for d in document_ids[i:i + BATCH_GET_LIMIT]]}}
+        for attempt in range(attempts):
+            with metrics.timed("dynamodb_batch_get_item", source="papers"):
+                response = dynamodb.batch_get_item(RequestItems=request)
+            items.extend(response.get("Responses", {}).get(table_name, []))
+            request = response.get("UnprocessedKeys") or {}
+            if not request:
+                break
+            time.sleep(backoff_delay(attempt, base=0.05, cap=1.0))
+        else:
+            unprocessed = len(request.get(table_name, {}).get("Keys", []))
+            raise RuntimeError(f"BatchGetItem left {unprocessed} keys unprocessed after {attempts} attempts")
+    return items
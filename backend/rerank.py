@@ -0,0 +1,144 @@
+"""
+Optional semantic re-ranking of search results with Titan embeddings.
+
+The query and every result's title + abstract snippet are embedded with the
+same Titan model the indexing pipeline uses (paper_common.embeddings), and
+results are ordered by cosine similarity to the query. Titan v2 embeds one
+text per call, so a page's misses are embedded concurrently (``concurrency``
+calls in flight, retried and paced on throttling like the Lambdas do).
+Paper embeddings are kept in an in-process LRU keyed by model, dimensions
+and text, so a paper seen by any earlier search costs nothing.
+
+Scoring is one matrix-vector product when numpy is installed (Titan
+vectors are normalized, so the dot product is the cosine); without numpy
+it falls back to plain Python.
+"""
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+from paper_common import embeddings
+from paper_common.retry import AdaptivePacer, call_with_retry
+
+import metrics
+
+_NO_ABSTRACT = ("", "...", "No abstract available")
+_numpy = None
+
+
+def _np():
+    """numpy if it is installed (imported on first use), else None."""
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
+
+def paper_text(result: Dict) -> str:
+    text = result.get("title") or ""
+    abstract = (result.get("abstract_snippet") or "").strip()
+    if abstract not in _NO_ABSTRACT:
+        text += "\n" + abstract
+    return text
+
+
+def cosine_scores(query: Sequence[float], vectors: List[Sequence[float]]) -> List[float]:
+    """Dot products of ``query`` with each vector (cosines, for normalized vectors)."""
+    np = _np()
+    if np is not None:
+        matrix = np.asarray([list(v) for v in vectors], dtype=np.float32)
+        return (matrix @ np.asarray(query, dtype=np.float32)).tolist()
+    return [sum(a * b for a, b in zip(query, v)) for v in vectors]
+
+
+class EmbeddingCache:
+    """LRU of embeddings (float32 arrays, ~1 KB each at 256 dims)."""
+
+    def __init__(self, max_items: int = 20000):
+        self.max_items = max_items
+        self._items: "OrderedDict[str, array]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[array]:
+        with self._lock:
+            vector = self._items.get(key)
+            if vector is not None:
+                self._items.move_to_end(key)
+            return vector
+
+    def put(self, key: str, vector: Sequence[float]) -> None:
+        with self._lock:
+            self._items[key] = array("f", vector)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class Reranker:
+    def __init__(self, bedrock, model_id: str = embeddings.DEFAULT_MODEL_ID, dims: int = embeddings.DEFAULT_DIMS,
+                 cache: Optional[EmbeddingCache] = None, concurrency: int = 8):
+        self.bedrock = bedrock
+        self.model_id = model_id
+        self.dims = dims
+        self.cache = cache if cache is not None else EmbeddingCache()
+        self.concurrency = concurrency
+        self._pacer = AdaptivePacer()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _key(self, text: str) -> str:
+        return f"{self.model_id}:{self.dims}:" + hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _embed_one(self, text: str) -> List[float]:
+        with metrics.timed("rerank_embed"):
+            return call_with_retry(
+                embeddings.embed_text, self.bedrock, text, model_id=self.model_id, dims=self.dims,
+                attempts=3, pacer=self._pacer,
+            )
+
+    def embed(self, texts: List[str]) -> List[Sequence[float]]:
+        """Embeddings of ``texts``, from the cache or embedded concurrently."""
+        keys = [self._key(t) for t in texts]
+        vectors: List[Optional[Sequence[float]]] = [self.cache.get(k) for k in keys]
+        missing: Dict[str, List[int]] = {}      # key -> positions (a text may repeat)
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(keys[i], []).append(i)
+        misses = sum(len(positions) for positions in missing.values())
+        metrics.count_cache("embeddings", "hit", "titan", count=len(texts) - misses)
+        metrics.count_cache("embeddings", "miss", "titan", count=misses)
+        if missing:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix="rerank-embed")
+            todo = list(missing)
+            embedded = self._executor.map(self._embed_one, [texts[missing[key][0]] for key in todo])
+            for key, vector in zip(todo, embedded):
+                self.cache.put(key, vector)
+                for i in missing[key]:
+                    vectors[i] = vector
+        return vectors
+
+    def rerank(self, query: str, results: List[Dict]) -> List[Dict]:
+        """
+        ``results`` ordered by cosine similarity to ``query`` (added to each
+        result as ``similarity``). The input list is not modified.
+        """
+        if not results:
+            return results
+        with metrics.timed("rerank"):
+            vectors = self.embed([query] + [paper_text(r) for r in results])
+            scores = cosine_scores(vectors[0], vectors[1:])
+        reranked = [dict(r, similarity=round(s, 6)) for r, s in zip(results, scores)]
+        reranked.sort(key=lambda r: r["similarity"], reverse=True)
+        return reranked
@@ -0,0 +1,301 @@
+"""
+Cursor pagination over several search sources, with a server-side buffer.
+
+Each source is a fetcher ``fetch(query, user_id, offset, count) ->
+(results, exhausted)`` that returns results from upstream position
+``offset`` on (at least ``count`` of them unless exhausted; more is fine).
+A page interleaves the sources round-robin, so no source can crowd out
+another - the user's library is never dropped because Semantic Scholar and
+arXiv filled the quota. Rows for the same paper are merged into one record
+(see ``merge``), ranked by its score, and a paper already returned on an
+earlier page is not returned again.
+
+Everything fetched from upstream is kept in a ``SearchBuffer`` session for
+``SEARCH_BUFFER_TTL`` seconds, so the next page is usually served without
+any upstream call. The cursor handed to the client is opaque but
+self-contained: besides the session id it encodes each source's offset, so
+a cursor still works (by re-fetching from those offsets) after its session
+has expired or on another API worker.
+"""
+import asyncio
+import base64
+import binascii
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+import merge
+import metrics
+
+Fetcher = Callable[[str, str, int, int], Tuple[List[Dict], bool]]
+
+# Upstream fetches ask for at least this many results, so a few pages can
+# be served from one call.
+UPSTREAM_BATCH = 20
+CURSOR_VERSION = 1
+
+
+class InvalidCursor(ValueError):
+    """The cursor is malformed or does not belong to this query."""
+
+
+@dataclass
+class SourceState:
+    start: int = 0                      # upstream position of results[0]
+    results: List[Dict] = field(default_factory=list)
+    exhausted: bool = False
+
+    def available(self, offset: int) -> int:
+        return self.start + len(self.results) - offset
+
+    def take(self, offset: int, count: int) -> List[Dict]:
+        begin = offset - self.start
+        if begin < 0:
+            return []                   # not buffered; ``rewind`` first
+        return self.results[begin:begin + count]
+
+    def rewind(self, offset: int) -> None:
+        """Drop the buffer so it is refetched from ``offset`` (before ``start``)."""
+        self.start = offset
+        self.results = []
+        self.exhausted = False
+
+
+@dataclass
+class SearchSession:
+    session_id: str
+    query: str
+    user_id: str
+    include_library: bool
+    sources: Dict[str, SourceState] = field(default_factory=dict)
+    touched_at: float = field(default_factory=time.monotonic)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    merger: merge.Merger = field(init=False)
+
+    def __post_init__(self):
+        self.merger = merge.Merger(self.query)
+
+
+class SearchBuffer:
+    """Short-lived LRU of search sessions (per API worker)."""
+
+    def __init__(self, ttl_seconds: float = 300.0, max_sessions: int = 512):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, SearchSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Optional[SearchSession]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if time.monotonic() - session.touched_at > self.ttl_seconds:
+                del self._sessions[session_id]
+                return None
+            session.touched_at = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def put(self, session: SearchSession) -> None:
+        with self._lock:
+            self._sessions[session.session_id] = session
+            self._sessions.move_to_end(session.session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+def encode_cursor(session: SearchSession, offsets: Dict[str, int]) -> str:
+    payload = {
+        "v": CURSOR_VERSION,
+        "sid": session.session_id,
+        "q": session.query,
+        "u": session.user_id,
+        "lib": session.include_library,
+        "o": offsets,
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Dict:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+    except (binascii.Error, ValueError) as e:
+        raise InvalidCursor(f"malformed cursor: {e}")
+    if not isinstance(payload, dict) or payload.get("v") != CURSOR_VERSION:
+        raise InvalidCursor("unsupported cursor version")
+    return payload
+
+
+class Paginator:
+    def __init__(self, fetchers: Dict[str, Fetcher], buffer: SearchBuffer):
+        self.fetchers = fetchers
+        self.buffer = buffer
+
+    def open(self, query: Optional[str], user_id: str, include_library: bool, sources: List[str],
+             cursor: Optional[str] = None) -> Tuple[SearchSession, Dict[str, int]]:
+        """
+        The session and per-source offsets to continue from. Without a cursor
+        this starts a new search; with one, it resumes the buffered session
+        (or rebuilds it from the cursor's offsets if it has expired).
+        """
+        if cursor is None:
+            if not query:
+                raise InvalidCursor("query is required without a cursor")
+            session = SearchSession(uuid4().hex, query, user_id, include_library)
+            offsets = {name: 0 for name in sources}
+        else:
+            payload = decode_cursor(cursor)
+            if query and query != payload["q"]:
+                raise InvalidCursor("cursor belongs to a different query")
+            if payload["u"] != user_id:
+                raise InvalidCursor("cursor belongs to a different user")
+            offsets = {name: int(payload["o"][name]) for name in sources if name in payload["o"]}
+            session = self.buffer.get(payload["sid"])
+            if session is None:
+                session = SearchSession(payload["sid"], payload["q"], payload["u"], payload["lib"])
+        for name, offset in offsets.items():
+            session.sources.setdefault(name, SourceState(start=offset))
+        self.buffer.put(session)
+        return session, offsets
+
+    async def fill(self, session: SearchSession, name: str, offset: int, count: int) -> Optional[str]:
+        """
+        Make sure ``count`` results from ``offset`` are buffered for source
+        ``name`` (unless it is exhausted). Returns an error message if the
+        upstream call failed; failures are not cached, the next page retries.
+        """
+        state = session.sources[name]
+        if offset < state.start:
+            # An older cursor of a session rebuilt from a later one.
+            state.rewind(offset)
+            session.merger.drop_source(name)
+        if state.exhausted or state.available(offset) >= count:
+            return None
+        upstream_offset = state.start + len(state.results)
+        want = max(count - state.available(offset), UPSTREAM_BATCH)
+        try:
+            with metrics.timed("search", source=name):
+                results, exhausted = await asyncio.to_thread(
+                    self.fetchers[name], session.query, session.user_id, upstream_offset, want,
+                )
+        except Exception as e:
+            print(f"Search source {name} failed: {e}")
+            return f"{type(e).__name__}: {e}"
+        metrics.observe_results("search", len(results), source=name)
+        state.results.extend(results)
+        state.exhausted = exhausted or not results
+        return None
+
+    async def page(self, session: SearchSession, offsets: Dict[str, int], limit: int) -> Dict:
+        """
+        One page of up to ``limit`` papers. Rows are consumed round-robin
+        across sources; duplicates fold into the paper they match and do not
+        use up the page.
+        """
+        async with session.lock:
+            names = list(offsets)
+            errors = await asyncio.gather(*(self.fill(session, n, offsets[n], limit) for n in names))
+            errors = {n: e for n, e in zip(names, errors) if e}
+
+            merger = session.merger
+            entries: List[int] = []
+            positions = dict(offsets)
+            while len(self._papers(merger, entries, offsets)) < limit:
+                progressed = False
+                for name in names:
+                    item = session.sources[name].take(positions[name], 1)
+                    if item:
+                        entries.append(merger.add(item[0], name, positions[name]))
+                        positions[name] += 1
+                        progressed = True
+                        if len(self._papers(merger, entries, offsets)) >= limit:
+                            break
+                if not progressed:
+                    break
+            results = [merger.record(i) for i in self._papers(merger, entries, offsets)]
+            results.sort(key=lambda r: r["score"], reverse=True)
+            return self._response(session, positions, results, errors)
+
+    async def stream(self, session: SearchSession, offsets: Dict[str, int], limit: int):
+        """
+        Yields ``{"source", "results"}`` for each source as soon as its
+        upstream call returns (up to ``limit`` rows per source), then a final
+        ``{"done": true, "next_cursor", ...}``. Papers already sent by an
+        earlier source come back under ``"updated"`` (with the new source in
+        their provenance) instead of as new results.
+        """
+        async with session.lock:
+            merger = session.merger
+            positions = dict(offsets)
+            errors: Dict[str, str] = {}
+            sent: List[int] = []
+
+            async def one(name):
+                return name, await self.fill(session, name, offsets[name], limit)
+
+            for next_done in asyncio.as_completed([one(n) for n in offsets]):
+                name, error = await next_done
+                if error:
+                    errors[name] = error
+                    yield {"source": name, "results": [], "error": error}
+                    continue
+                batch = session.sources[name].take(positions[name], limit)
+                entries = [merger.add(item, name, positions[name] + k) for k, item in enumerate(batch)]
+                positions[name] += len(batch)
+                sent_roots = {merger.find(i) for i in sent}
+                new, updated = [], []
+                for i in self._papers(merger, entries, offsets):
+                    (updated if merger.find(i) in sent_roots else new).append(i)
+                sent.extend(new)
+                chunk = {"source": name, "results": [merger.record(i) for i in new]}
+                if updated:
+                    chunk["updated"] = [merger.record(i) for i in updated]
+                yield chunk
+
+            final = self._response(session, positions, [], errors)
+            del final["results"]
+            yield {"done": True, **final}
+
+    @staticmethod
+    def _papers(merger: merge.Merger, entries: List[int], offsets: Dict[str, int]) -> List[int]:
+        """One entry per distinct paper among ``entries``, skipping papers returned on earlier pages."""
+        papers, roots = [], set()
+        for i in entries:
+            root = merger.find(i)
+            if root not in roots and not merger.seen_before(root, offsets):
+                roots.add(root)
+                papers.append(root)
+        return papers
+
+    def _response(self, session: SearchSession, positions: Dict[str, int], results: List[Dict],
+                  errors: Dict[str, str]) -> Dict:
+        # A failed source is retried on the next page, but only while some
+        # healthy source still has results - otherwise a client walking the
+        # pages would loop on empty pages while that source is down.
+        more = any(
+            not state.exhausted or state.available(positions[name]) > 0
+            for name, state in session.sources.items() if name in positions and name not in errors
+        )
+        return {
+            "results": results,
+            "next_cursor": encode_cursor(session, positions) if more else None,
+            "sources": {
+                name: {
+                    "offset": positions[name],
+                    "exhausted": session.sources[name].exhausted
+                    and session.sources[name].available(positions[name]) <= 0,
+                    **({"error": errors[name]} if name in errors else {}),
+                }
+                for name in positions
+            },
+        }
@@ -0,0 +1,407 @@
+"""
+Direct-to-S3 PDF uploads with presigned URLs.
+
+``/upload`` streams every PDF through the API worker. Here the client
+uploads straight to S3 and the API only signs and registers:
+
+1. ``presign`` checks the declared size and content type and returns either
+   a presigned POST (PDFs up to ``part_size``) whose policy pins
+   ``Content-Type`` and ``content-length-range`` to exactly the declared
+   size, or a multipart upload created on the server with one presigned
+   ``UploadPart`` URL per part. The declared size and filename are stored
+   as object metadata (``x-amz-meta-*``), fixed by the policy or by
+   ``CreateMultipartUpload``, so the client cannot change them.
+2. ``complete`` finishes the multipart upload, checks the stored object
+   against what was declared (HeadObject and its first bytes), deletes it
+   if it does not match, and writes the metadata row with placeholder
+   metadata (``metadata_status: pending``). The caller queues indexing.
+3. Title, author, page count and first-page text are then extracted in the
+   background through a ``RangedS3File``: PyPDF2 only seeks to the trailer,
+   the cross-reference table, the page tree and the first page's objects,
+   and only those blocks are fetched with ranged GETs - typically a few
+   hundred KB whatever the size of the PDF.
+
+Uploads that are presigned but never completed leave nothing behind but an
+incomplete multipart upload; the bucket's ``AbortIncompleteMultipartUpload``
+lifecycle rule cleans those up.
+"""
+import asyncio
+import io
+import math
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote, unquote
+from uuid import UUID, uuid4
+
+from botocore.exceptions import ClientError
+from paper_common import jobs as job_states
+from paper_common import keys, retry
+
+import metrics
+
+PART_SIZE = 16 * 1024 * 1024            # presigned POST up to this size, multipart parts above (min 5 MiB)
+MAX_PARTS = 10000                       # S3 limit per multipart upload
+PDF_MAGIC = b"%PDF-"
+CONTENT_TYPE = "application/pdf"
+NOT_FOUND_CODES = ("404", "NoSuchKey", "NotFound")
+
+
+class UploadError(Exception):
+    """The upload cannot be presigned or completed; answered with ``status_code``."""
+
+    def __init__(self, detail: str, status_code: int = 400):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+def page_count(pdf_reader) -> int:
+    """
+    Pages of a PyPDF2 ``PdfReader`` from the page tree's ``/Count``:
+    ``pdf_reader.pages`` loads the dictionary of every page, which in a
+    ranged read touches most of the file (and parses all of an untrusted
+    PDF's page tree). Falls back to that when the trailer is unusable.
+    """
+    try:
+        return int(pdf_reader.trailer["/Root"]["/Pages"]["/Count"])
+    except (KeyError, TypeError, ValueError):
+        return len(pdf_reader.pages)
+
+
+class RangedS3File(io.RawIOBase):
+    """
+    Read-only, seekable view of an S3 object. Reads fetch the
+    ``block_size`` blocks they touch with ranged GETs (adjacent missing
+    blocks in one request) and keep the last ``max_blocks`` for re-reads.
+    """
+
+    def __init__(self, s3, bucket: str, key: str, size: Optional[int] = None,
+                 block_size: int = 64 * 1024, max_blocks: int = 64):
+        super().__init__()
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        if size is None:
+            with metrics.timed("s3_head_object", source="ranged"):
+                size = s3.head_object(Bucket=bucket, Key=key)["ContentLength"]
+        self.size = size
+        self.requests = 0
+        self.bytes_fetched = 0
+        self._pos = 0
+        self._blocks: "OrderedDict[int, bytes]" = OrderedDict()
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._pos + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"invalid whence ({whence})")
+        if position < 0:
+            raise ValueError(f"negative seek position {position}")
+        self._pos = position
+        return position
+
+    def readinto(self, buffer) -> int:
+        n = max(0, min(len(buffer), self.size - self._pos))
+        if n:
+            buffer[:n] = self._read(self._pos, n)
+            self._pos += n
+        return n
+
+    def _read(self, start: int, n: int) -> bytes:
+        first, last = start // self.block_size, (start + n - 1) // self.block_size
+        blocks: Dict[int, bytes] = {}
+        for i in range(first, last + 1):
+            if i in self._blocks:
+                self._blocks.move_to_end(i)
+                blocks[i] = self._blocks[i]
+        runs: List[List[int]] = []              # [first, last] of adjacent missing blocks
+        for i in range(first, last + 1):
+            if i in blocks:
+                continue
+            if runs and runs[-1][1] == i - 1:
+                runs[-1][1] = i
+            else:
+                runs.append([i, i])
+        for run_first, run_last in runs:
+            blocks.update(self._fetch(run_first, run_last))
+        offset = start - first * self.block_size
+        return b"".join(blocks[i] for i in range(first, last + 1))[offset:offset + n]
+
+    def _fetch(self, first: int, last: int) -> Dict[int, bytes]:
+        start, end = first * self.block_size, min(self.size, (last + 1) * self.block_size) - 1
+        with metrics.timed("s3_get_object", source="ranged"):
+            data = self.s3.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={start}-{end}")["Body"].read()
+        self.requests += 1
+        self.bytes_fetched += len(data)
+        fetched = {
+            i: data[(i - first) * self.block_size:(i - first + 1) * self.block_size] for i in range(first, last + 1)
+        }
+        for i, block in fetched.items():
+            self._blocks[i] = block
+            self._blocks.move_to_end(i)
+        while len(self._blocks) > self.max_blocks:
+            self._blocks.popitem(last=False)
+        return fetched
+
+
+class DirectUploads:
+    def __init__(self, s3, table, bucket: str, extract: Callable[[io.RawIOBase], Dict],
+                 max_bytes: int = 100 * 1024 * 1024, part_size: int = PART_SIZE, expires_in: int = 900,
+                 concurrency: int = 4):
+        self.s3 = s3
+        self.table = table
+        self.bucket = bucket
+        self.extract = extract                  # PDF file object -> title, author, page_count, abstract_snippet
+        self.max_bytes = max_bytes
+        self.part_size = part_size
+        self.expires_in = expires_in
+        self.concurrency = concurrency
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix="upload-metadata")
+            return self._executor
+
+    # ---- presign ----
+
+    def _presign(self, user_id: str, filename: str, size: int, content_type: str) -> Dict:
+        if not filename or not filename.lower().endswith(".pdf"):
+            raise UploadError("Only PDF files are allowed.")
+        if content_type != CONTENT_TYPE:
+            raise UploadError(f"Content type must be {CONTENT_TYPE}.")
+        if size <= 0:
+            raise UploadError("size must be positive.")
+        if size > self.max_bytes:
+            raise UploadError(f"PDF is larger than {self.max_bytes} bytes.", 413)
+
+        # Same key layout as /upload, so IndexPdfLambda derives user_id/paper_id from it.
+        document_id = str(uuid4())
+        key = keys.pdf_key(user_id, document_id)
+        # User metadata must be ASCII.
+        metadata = {"declared-size": str(size), "filename": quote(filename)}
+        response = {"document_id": document_id, "bucket": self.bucket, "key": key, "expires_in": self.expires_in}
+
+        if size <= self.part_size:
+            fields = {"Content-Type": CONTENT_TYPE, **{f"x-amz-meta-{k}": v for k, v in metadata.items()}}
+            conditions = [{k: v} for k, v in fields.items()] + [["content-length-range", size, size]]
+            post = self.s3.generate_presigned_post(
+                Bucket=self.bucket, Key=key, Fields=fields, Conditions=conditions, ExpiresIn=self.expires_in,
+            )
+            return {**response, "method": "POST", "url": post["url"], "fields": post["fields"]}
+
+        part_size = max(self.part_size, math.ceil(size / MAX_PARTS))
+        with metrics.timed("s3_create_multipart_upload", source="direct_upload"):
+            upload_id = self.s3.create_multipart_upload(
+                Bucket=self.bucket, Key=key, ContentType=CONTENT_TYPE, Metadata=metadata,
+            )["UploadId"]
+        parts = []
+        for number in range(1, math.ceil(size / part_size) + 1):
+            url = self.s3.generate_presigned_url(
+                "upload_part",
+                Params={"Bucket": self.bucket, "Key": key, "UploadId": upload_id, "PartNumber": number},
+                ExpiresIn=self.expires_in, HttpMethod="PUT",
+            )
+            parts.append({"part_number": number, "size": min(part_size, size - (number - 1) * part_size), "url": url})
+        return {**response, "method": "PUT", "upload_id": upload_id, "part_size": part_size, "parts": parts}
+
+    # ---- complete ----
+
+    def _head(self, key: str) -> Optional[Dict]:
+        try:
+            with metrics.timed("s3_head_object", source="direct_upload"):
+                return self.s3.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if retry.error_code(e) in NOT_FOUND_CODES:
+                return None
+            raise
+
+    def _problem(self, key: str, head: Dict) -> Optional[str]:
+        """Why the stored object does not match what was presigned (None if it does)."""
+        size = head["ContentLength"]
+        if size > self.max_bytes:
+            return f"PDF is larger than {self.max_bytes} bytes."
+        if head.get("Metadata", {}).get("declared-size") != str(size):
+            return "Uploaded size does not match the declared size."
+        if head.get("ContentType") != CONTENT_TYPE:
+            return f"Content type must be {CONTENT_TYPE}."
+        with metrics.timed("s3_get_object", source="direct_upload"):
+            magic = self.s3.get_object(
+                Bucket=self.bucket, Key=key, Range=f"bytes=0-{len(PDF_MAGIC) - 1}",
+            )["Body"].read()
+        if magic != PDF_MAGIC:
+            return "Uploaded file is not a PDF."
+        return None
+
+    def _registered(self, document_id: str, user_id: str) -> Optional[Dict]:
+        with metrics.timed("dynamodb_get_item", source="direct_upload"):
+            item = self.table.get_item(Key={"document_id": document_id}).get("Item")
+        if item is not None and item.get("user_id") != user_id:
+            raise UploadError("Not authorized to complete this upload.", 403)
+        return item
+
+    def _complete(self, user_id: str, document_id: str, upload_id: Optional[str],
+                  parts: Optional[List[Dict]]) -> Tuple[Dict, bool]:
+        try:
+            document_id = str(UUID(document_id))
+        except ValueError:
+            raise UploadError("Invalid document_id.")
+        # A retried completion returns the paper registered by the first one.
+        item = self._registered(document_id, user_id)
+        if item is not None:
+            return item, False
+
+        key = keys.pdf_key(user_id, document_id)
+        if upload_id:
+            if not parts:
+                raise UploadError("parts are required to complete a multipart upload.")
+            try:
+                with metrics.timed("s3_complete_multipart_upload", source="direct_upload"):
+                    self.s3.complete_multipart_upload(
+                        Bucket=self.bucket, Key=key, UploadId=upload_id,
+                        MultipartUpload={"Parts": sorted(
+                            ({"ETag": p["etag"], "PartNumber": p["part_number"]} for p in parts),
+                            key=lambda p: p["PartNumber"],
+                        )},
+                    )
+            except ClientError as e:
+                code = retry.error_code(e)
+                if code == "NoSuchUpload":
+                    raise UploadError("Upload not found (expired, aborted or already completed).", 404)
+                if code in ("InvalidPart", "InvalidPartOrder", "EntityTooSmall"):
+                    raise UploadError(f"Cannot complete the upload: {code}.")
+                raise
+
+        head = self._head(key)
+        if head is None:
+            raise UploadError("Nothing was uploaded for this document_id.", 404)
+        problem = self._problem(key, head)
+        if problem is not None:
+            with metrics.timed("s3_delete_object", source="direct_upload"):
+                self.s3.delete_object(Bucket=self.bucket, Key=key)
+            raise UploadError(problem, 413 if head["ContentLength"] > self.max_bytes else 400)
+
+        filename = unquote(head.get("Metadata", {}).get("filename", "")) or f"{document_id}.pdf"
+        item = {
+            "document_id": document_id,
+            "user_id": user_id,
+            # Placeholders until the background extraction fills them in.
+            "title": "Untitled Document",
+            "author": "Unknown",
+            "filename": os.path.basename(filename),
+            "s3_key": key,
+            "s3_bucket": self.bucket,
+            "source": "user_upload",
+            "page_count": 0,
+            "abstract_snippet": "",
+            "size_bytes": head["ContentLength"],
+            "metadata_status": "pending",
+            "uploaded_at": datetime.utcnow().isoformat(),
+            "status": job_states.UPLOADED,
+            "status_updated_at": job_states.utc_now(),
+            "stage_timings": {},
+        }
+        try:
+            with metrics.timed("dynamodb_put_item", source="direct_upload"):
+                self.table.put_item(Item=item, ConditionExpression="attribute_not_exists(document_id)")
+        except ClientError as e:
+            if retry.error_code(e) != "ConditionalCheckFailedException":
+                raise
+            # A concurrent completion won the race.
+            return self._registered(document_id, user_id), False
+        return item, True
+
+    def _abort(self, user_id: str, document_id: str, upload_id: str) -> None:
+        try:
+            key = keys.pdf_key(user_id, str(UUID(document_id)))
+        except ValueError:
+            raise UploadError("Invalid document_id.")
+        try:
+            with metrics.timed("s3_abort_multipart_upload", source="direct_upload"):
+                self.s3.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+        except ClientError as e:
+            if retry.error_code(e) != "NoSuchUpload":
+                raise
+
+    # ---- metadata extraction ----
+
+    def _extract_metadata(self, item: Dict, on_extracted: Optional[Callable[[str, str], None]]) -> Dict:
+        pdf = RangedS3File(self.s3, self.bucket, item["s3_key"], size=item.get("size_bytes"))
+        pdf_metadata = self.extract(pdf)
+        metrics.observe_payload("pdf_ranged_read", pdf.bytes_fetched)
+        try:
+            with metrics.timed("dynamodb_update_item", source="direct_upload"):
+                self.table.update_item(
+                    Key={"document_id": item["document_id"]},
+                    UpdateExpression=(
+                        "SET title = :title, author = :author, page_count = :pages, "
+                        "abstract_snippet = :snippet, metadata_status = :status, updated_at = :now"
+                    ),
+                    ConditionExpression="attribute_exists(document_id)",
+                    ExpressionAttributeValues={
+                        ":title": pdf_metadata["title"],
+                        ":author": pdf_metadata["author"],
+                        ":pages": pdf_metadata["page_count"],
+                        ":snippet": pdf_metadata["abstract_snippet"],
+                        # extract() returns 0 pages when the PDF could not be parsed.
+                        ":status": "extracted" if pdf_metadata["page_count"] else "failed",
+                        # Last-Modified must move even though the status does not.
+                        ":now": job_states.utc_now(),
+                    },
+                )
+        except ClientError as e:
+            if retry.error_code(e) != "ConditionalCheckFailedException":
+                raise
+            return pdf_metadata                 # deleted in the meantime
+        if on_extracted is not None:
+            on_extracted(item["document_id"], item["user_id"])
+        return pdf_metadata
+
+    def _extract_in_background(self, item: Dict, on_extracted) -> None:
+        try:
+            self._extract_metadata(item, on_extracted)
+        except Exception as e:
+            print(f"Metadata extraction of {item['document_id']} failed: {e}")
+
+    # ---- entry points ----
+
+    async def presign(self, user_id: str, filename: str, size: int, content_type: str = CONTENT_TYPE) -> Dict:
+        """Where and how to upload one PDF (presigned POST, or presigned multipart part URLs)."""
+        return await asyncio.to_thread(self._presign, user_id, filename, size, content_type)
+
+    async def complete(self, user_id: str, document_id: str, upload_id: Optional[str] = None,
+                       parts: Optional[List[Dict]] = None,
+                       on_extracted: Optional[Callable[[str, str], None]] = None) -> Tuple[Dict, bool]:
+        """
+        Registers an uploaded PDF: (metadata row, whether this call created
+        it). Metadata extraction is scheduled in the background and
+        ``on_extracted(document_id, user_id)`` runs once it is stored.
+        """
+        item, created = await asyncio.to_thread(self._complete, user_id, document_id, upload_id, parts)
+        if created:
+            self._pool().submit(self._extract_in_background, item, on_extracted)
+        return item, created
+
+    async def abort(self, user_id: str, document_id: str, upload_id: str) -> None:
+        await asyncio.to_thread(self._abort, user_id, document_id, upload_id)
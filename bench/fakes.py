@@ -0,0 +1,733 @@
+"""
+In-memory stand-ins for the services the API and the Lambdas call.
+
+Each fake implements just the calls this repo makes, with the same
+request/response shapes as boto3 (or the Semantic Scholar / arXiv / Gemini
+clients), and routes every call through a shared ``Faults`` object that
+adds latency and injects errors:
+
+    faults = Faults(profile="aws", error_rate=0.01, throttle_rate=0.05, seed=1)
+    s3 = FakeS3(faults)
+    s3.put_object(Bucket="b", Key="k", Body=b"...")   # sleeps ~15 ms, may raise SlowDown
+
+Injected errors are real ``botocore.exceptions.ClientError``s with the codes
+the services use, so paper_common.retry classifies them exactly like
+production errors. Draws come from a seeded RNG, so a run is reproducible.
+"""
+import copy
+import hashlib
+import io
+import json
+import math
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from urllib.parse import parse_qsl, urlencode
+
+from botocore.exceptions import ClientError
+
+# Typical in-region latencies (ms) per service, used by profile="aws".
+LATENCY_PROFILES = {
+    "none": {},
+    "aws": {
+        "s3": 15.0,
+        "dynamodb": 5.0,
+        "bedrock": 40.0,
+        "s3vectors": 30.0,
+        "lambda": 10.0,
+        "secretsmanager": 10.0,
+        "gemini": 600.0,
+        "semantic_scholar": 300.0,
+        "arxiv": 500.0,
+        "pdf": 250.0,
+    },
+}
+
+THROTTLE_CODES = {
+    "s3": "SlowDown",
+    "dynamodb": "ProvisionedThroughputExceededException",
+    "bedrock": "ThrottlingException",
+    "s3vectors": "TooManyRequestsException",
+    "lambda": "TooManyRequestsException",
+    "secretsmanager": "ThrottlingException",
+}
+
+
+class InjectedError(Exception):
+    """A failure injected into a non-AWS client (Gemini, Semantic Scholar, arXiv)."""
+
+
+def client_error(code: str, operation: str, status: int = 400) -> ClientError:
+    return ClientError(
+        {"Error": {"Code": code, "Message": "injected by bench"},
+         "ResponseMetadata": {"HTTPStatusCode": status}},
+        operation,
+    )
+
+
+class Faults:
+    """
+    Latency + error injection shared by all fakes of one run.
+
+    ``latency_ms`` overrides the profile for every service; ``jitter`` is the
+    +/- fraction applied to each sleep. Rates are per call.
+    """
+
+    def __init__(self, profile: str = "none", latency_ms: float | None = None, jitter: float = 0.2,
+                 error_rate: float = 0.0, throttle_rate: float = 0.0, seed: int = 0):
+        self.latencies = dict(LATENCY_PROFILES[profile])
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.calls = Counter()
+        self.injected = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __call__(self, service: str, operation: str) -> None:
+        base = self.latency_ms if self.latency_ms is not None else self.latencies.get(service, 0.0)
+        with self._lock:
+            self.calls[f"{service}.{operation}"] += 1
+            delay = base * (1 + self._rng.uniform(-self.jitter, self.jitter)) / 1000.0 if base else 0.0
+            roll = self._rng.random()
+        if delay:
+            time.sleep(delay)
+        if roll < self.throttle_rate:
+            self._inject(service, operation, "throttle")
+            if service in THROTTLE_CODES:
+                raise client_error(THROTTLE_CODES[service], operation, 429 if service != "s3" else 503)
+            raise InjectedError(f"{service} {operation}: 429 Too Many Requests")
+        if roll < self.throttle_rate + self.error_rate:
+            self._inject(service, operation, "error")
+            if service in THROTTLE_CODES:
+                raise client_error("InternalError" if service == "s3" else "InternalServerException", operation, 500)
+            raise InjectedError(f"{service} {operation}: 503 Service Unavailable")
+
+    def _inject(self, service: str, operation: str, kind: str) -> None:
+        with self._lock:
+            self.injected[f"{service}.{operation}.{kind}"] += 1
+
+
+# ---- AWS ----
+
+class _S3Exceptions:
+    class NoSuchKey(ClientError):
+        pass
+
+
+class FakeS3:
+    exceptions = _S3Exceptions
+
+    def __init__(self, faults: Faults):
+        self.faults = faults
+        self.objects: dict[tuple[str, str], dict] = {}
+        self.uploads: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body, ContentType=None, IfMatch=None, IfNoneMatch=None, Metadata=None,
+                   **kwargs):
+        self.faults("s3", "PutObject")
+        data = Body if isinstance(Body, bytes) else Body.read()
+        with self._lock:
+            current = self.objects.get((Bucket, Key))
+            if IfNoneMatch == "*" and current is not None:
+                raise client_error("PreconditionFailed", "PutObject", 412)
+            if IfMatch is not None and (current is None or current["ETag"] != IfMatch):
+                raise client_error("PreconditionFailed", "PutObject", 412)
+            etag = '"' + hashlib.md5(data).hexdigest() + '"'
+            self.objects[(Bucket, Key)] = {
+                "Body": data, "ETag": etag, "ContentType": ContentType, "LastModified": datetime.utcnow(),
+                "Metadata": dict(Metadata or {}),
+            }
+        return {"ETag": etag}
+
+    def _object(self, Bucket, Key, operation):
+        obj = self.objects.get((Bucket, Key))
+        if obj is None:
+            raise self.exceptions.NoSuchKey(
+                {"Error": {"Code": "NoSuchKey", "Message": Key}, "ResponseMetadata": {"HTTPStatusCode": 404}},
+                operation,
+            )
+        return obj
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        self.faults("s3", "GetObject")
+        obj = self._object(Bucket, Key, "GetObject")
+        data = obj["Body"]
+        response = {}
+        if Range is not None:
+            # "bytes=a-b", "bytes=a-" or the suffix form "bytes=-n"
+            first, last = Range[len("bytes="):].split("-")
+            if first:
+                start, end = int(first), min(int(last) if last else len(data) - 1, len(data) - 1)
+            else:
+                start, end = max(len(data) - int(last), 0), len(data) - 1
+            response["ContentRange"] = f"bytes {start}-{end}/{len(data)}"
+            data = data[start:end + 1]
+        return {
+            "Body": io.BytesIO(data), "ETag": obj["ETag"],
+            "ContentLength": len(data), "ContentType": obj["ContentType"],
+            "LastModified": obj["LastModified"], "Metadata": obj.get("Metadata", {}),
+            **response,
+        }
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self.faults("s3", "HeadObject")
+        if (Bucket, Key) not in self.objects:
+            raise client_error("404", "HeadObject", 404)
+        obj = self.objects[(Bucket, Key)]
+        return {
+            "ETag": obj["ETag"], "ContentLength": len(obj["Body"]), "ContentType": obj["ContentType"],
+            "LastModified": obj["LastModified"], "Metadata": obj.get("Metadata", {}),
+        }
+
+    # Presigning is local (no call, no faults). The URLs can be "used" with
+    # post_presigned / put_presigned, which stand in for the client's upload.
+
+    def generate_presigned_post(self, Bucket, Key, Fields=None, Conditions=None, ExpiresIn=3600):
+        policy = json.dumps({"conditions": [{"bucket": Bucket}, {"key": Key}] + list(Conditions or [])})
+        return {"url": f"https://{Bucket}.s3.amazonaws.com/", "fields": {**(Fields or {}), "key": Key, "policy": policy}}
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600, HttpMethod=None):
+        return f"https://s3.amazonaws.com/{ClientMethod}?" + urlencode(Params or {})
+
+    def post_presigned(self, url, fields, body: bytes) -> None:
+        """A browser's form POST to a presigned POST: the policy's conditions are enforced."""
+        self.faults("s3", "PostObject")
+        bucket = url.split("//", 1)[1].split(".", 1)[0]
+        for condition in json.loads(fields["policy"])["conditions"]:
+            if isinstance(condition, list):
+                _, low, high = condition
+                if not low <= len(body) <= high:
+                    raise client_error("EntityTooLarge" if len(body) > high else "EntityTooSmall", "PostObject")
+            elif not all(k == "bucket" and v == bucket or fields.get(k) == v for k, v in condition.items()):
+                raise client_error("AccessDenied", "PostObject", 403)
+        metadata = {k[len("x-amz-meta-"):]: v for k, v in fields.items() if k.startswith("x-amz-meta-")}
+        self.put_object(bucket, fields["key"], body, ContentType=fields.get("Content-Type"), Metadata=metadata)
+
+    def put_presigned(self, url, body: bytes) -> dict:
+        """PUT to a presigned ``upload_part`` URL; returns the response headers."""
+        params = dict(parse_qsl(url.split("?", 1)[1]))
+        response = self.upload_part(params["Bucket"], params["Key"], params["UploadId"], int(params["PartNumber"]), body)
+        return {"ETag": response["ETag"]}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.faults("s3", "DeleteObject")
+        with self._lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        self.faults("s3", "DeleteObjects")
+        with self._lock:
+            for obj in Delete["Objects"]:
+                self.objects.pop((Bucket, obj["Key"]), None)
+        if Delete.get("Quiet"):
+            return {}
+        return {"Deleted": [{"Key": obj["Key"]} for obj in Delete["Objects"]]}
+
+    def create_multipart_upload(self, Bucket, Key, ContentType=None, Metadata=None, **kwargs):
+        self.faults("s3", "CreateMultipartUpload")
+        upload_id = hashlib.sha1(f"{Bucket}/{Key}/{time.monotonic_ns()}".encode()).hexdigest()
+        with self._lock:
+            self.uploads[upload_id] = {
+                "Bucket": Bucket, "Key": Key, "ContentType": ContentType, "Metadata": dict(Metadata or {}), "Parts": {},
+            }
+        return {"Bucket": Bucket, "Key": Key, "UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        self.faults("s3", "UploadPart")
+        data = Body if isinstance(Body, bytes) else Body.read()
+        etag = '"' + hashlib.md5(data).hexdigest() + '"'
+        with self._lock:
+            self.uploads[UploadId]["Parts"][PartNumber] = (etag, data)
+        return {"ETag": etag}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        self.faults("s3", "CompleteMultipartUpload")
+        with self._lock:
+            upload = self.uploads.pop(UploadId, None)
+            if upload is None:
+                raise client_error("NoSuchUpload", "CompleteMultipartUpload", 404)
+            parts = upload["Parts"]
+            for part in MultipartUpload["Parts"]:
+                if parts.get(part["PartNumber"], (None,))[0] != part["ETag"]:
+                    raise client_error("InvalidPart", "CompleteMultipartUpload")
+            data = b"".join(parts[part["PartNumber"]][1] for part in MultipartUpload["Parts"])
+            etag = '"%s-%d"' % (hashlib.md5(data).hexdigest(), len(MultipartUpload["Parts"]))
+            self.objects[(Bucket, Key)] = {
+                "Body": data, "ETag": etag, "ContentType": upload["ContentType"], "LastModified": datetime.utcnow(),
+                "Metadata": upload["Metadata"],
+            }
+        return {"Bucket": Bucket, "Key": Key, "ETag": etag}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        self.faults("s3", "AbortMultipartUpload")
+        with self._lock:
+            self.uploads.pop(UploadId, None)
+        return {}
+
+
+class FakeTable:
+    """A DynamoDB Table resource keyed on ``key`` (``document_id`` by default)."""
+
+    def __init__(self, faults: Faults, key: str = "document_id"):
+        self.faults = faults
+        self.key = key
+        self.items: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def put_item(self, Item, **kwargs):
+        self.faults("dynamodb", "PutItem")
+        with self._lock:
+            self.items[Item[self.key]] = copy.deepcopy(Item)
+        return {}
+
+    def get_item(self, Key, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        self.faults("dynamodb", "GetItem")
+        item = self.items.get(Key[self.key])
+        if item is None:
+            return {}
+        item = copy.deepcopy(item)
+        if ProjectionExpression:
+            names = ExpressionAttributeNames or {}
+            wanted = {names.get(p.strip(), p.strip()) for p in ProjectionExpression.split(",")}
+            item = {k: v for k, v in item.items() if k in wanted}
+        return {"Item": item}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ConditionExpression=None, **kwargs):
+        """Supports the ``SET a = :v, b.c = :w, d = if_not_exists(d, :x)`` updates this repo issues."""
+        self.faults("dynamodb", "UpdateItem")
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        with self._lock:
+            item = self.items.get(Key[self.key])
+            if item is None:
+                if ConditionExpression and "attribute_exists" in ConditionExpression:
+                    raise client_error("ConditionalCheckFailedException", "UpdateItem")
+                item = self.items[Key[self.key]] = dict(Key)
+            assignments = UpdateExpression.strip()[len("SET"):]
+            for part in _split_top_level(assignments):
+                lhs, rhs = (s.strip() for s in part.split("=", 1))
+                path = [names.get(p, p) for p in lhs.split(".")]
+                if rhs.startswith("if_not_exists("):
+                    attr, placeholder = (s.strip() for s in rhs[len("if_not_exists("):-1].split(","))
+                    value = item.get(names.get(attr, attr), values[placeholder])
+                elif "+" in rhs:
+                    attr, placeholder = (s.strip() for s in rhs.split("+"))
+                    value = item.get(names.get(attr, attr), 0) + values[placeholder]
+                else:
+                    value = values[rhs]
+                target = item
+                for p in path[:-1]:
+                    target = target.setdefault(p, {})
+                target[path[-1]] = copy.deepcopy(value)
+        return {}
+
+    def delete_item(self, Key, **kwargs):
+        self.faults("dynamodb", "DeleteItem")
+        with self._lock:
+            self.items.pop(Key[self.key], None)
+        return {}
+
+    @contextmanager
+    def batch_writer(self):
+        """Buffers puts/deletes and flushes them 25 at a time, like boto3's BatchWriter."""
+        table, pending = self, []
+
+        def flush():
+            table.faults("dynamodb", "BatchWriteItem")
+            with table._lock:
+                for op, value in pending:
+                    if op == "put":
+                        table.items[value[table.key]] = copy.deepcopy(value)
+                    else:
+                        table.items.pop(value[table.key], None)
+            pending.clear()
+
+        class Writer:
+            def put_item(self, Item):
+                pending.append(("put", Item))
+                if len(pending) >= 25:
+                    flush()
+
+            def delete_item(self, Key):
+                pending.append(("delete", Key))
+                if len(pending) >= 25:
+                    flush()
+
+        yield Writer()
+        if pending:
+            flush()
+
+    def scan(self, FilterExpression=None, ExpressionAttributeValues=None, **kwargs):
+        """Approximates the two scans the API issues: by ``:uid`` and ``contains(..., :query)``."""
+        self.faults("dynamodb", "Scan")
+        values = ExpressionAttributeValues or {}
+        items = list(self.items.values())
+        if ":uid" in values:
+            items = [i for i in items if i.get("user_id") == values[":uid"]]
+        if ":query" in values:
+            q = values[":query"]
+            items = [i for i in items if q in i.get("title", "") or q in i.get("abstract_snippet", "")]
+        if ":s" in values:
+            items = [i for i in items if i.get("status") == values[":s"]]
+        return {"Items": copy.deepcopy(items), "Count": len(items)}
+
+
+class FakeDynamoDB:
+    """The DynamoDB service resource, for ``batch_get_item`` over ``FakeTable``s."""
+
+    def __init__(self, faults: Faults, tables: dict):
+        self.faults = faults
+        self.tables = tables
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        self.faults("dynamodb", "BatchGetItem")
+        responses = {}
+        for name, request in RequestItems.items():
+            table = self.tables[name]
+            responses[name] = [
+                copy.deepcopy(table.items[key["document_id"]])
+                for key in request["Keys"] if key["document_id"] in table.items
+            ]
+        return {"Responses": responses, "UnprocessedKeys": {}}
+
+
+def _split_top_level(expr: str) -> list[str]:
+    parts, depth, current = [], 0, ""
+    for ch in expr:
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0:
+            parts.append(current)
+            current = ""
+        else:
+            current += ch
+    if current.strip():
+        parts.append(current)
+    return parts
+
+
+def fake_embedding(text: str, dims: int) -> list[float]:
+    """Deterministic unit vector for ``text``; similar texts do not get similar vectors."""
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+    vec = [rng.gauss(0.0, 1.0) for _ in range(dims)]
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+
+class FakeBedrock:
+    def __init__(self, faults: Faults):
+        self.faults = faults
+
+    def invoke_model(self, modelId, body, contentType=None, accept=None, **kwargs):
+        self.faults("bedrock", "InvokeModel")
+        request = json.loads(body)
+        vector = fake_embedding(request["inputText"], int(request.get("dimensions", 256)))
+        return {"body": io.BytesIO(json.dumps({"embedding": vector}).encode("utf-8"))}
+
+
+class _S3VectorsExceptions:
+    class NotFoundException(ClientError):
+        pass
+
+
+class FakeS3Vectors:
+    """Brute-force cosine search over in-memory indexes."""
+
+    exceptions = _S3VectorsExceptions
+
+    def __init__(self, faults: Faults):
+        self.faults = faults
+        self.indexes: dict[str, dict[str, dict]] = {}
+        self._lock = threading.Lock()
+
+    def _index(self, name: str) -> dict:
+        with self._lock:
+            return self.indexes.setdefault(name, {})
+
+    def create_index(self, vectorBucketName, indexName, **kwargs):
+        self.faults("s3vectors", "CreateIndex")
+        self._index(indexName)
+        return {}
+
+    def put_vectors(self, vectorBucketName, indexName, vectors):
+        self.faults("s3vectors", "PutVectors")
+        index = self._index(indexName)
+        with self._lock:
+            for v in vectors:
+                index[v["key"]] = copy.deepcopy(v)
+        return {}
+
+    def get_vectors(self, vectorBucketName, indexName, keys, returnData=False, returnMetadata=False):
+        self.faults("s3vectors", "GetVectors")
+        index = self._index(indexName)
+        found = []
+        for key in keys:
+            v = index.get(key)
+            if v is None:
+                continue
+            out = {"key": key}
+            if returnData:
+                out["data"] = v["data"]
+            if returnMetadata:
+                out["metadata"] = v.get("metadata", {})
+            found.append(out)
+        return {"vectors": found}
+
+    def delete_vectors(self, vectorBucketName, indexName, keys):
+        self.faults("s3vectors", "DeleteVectors")
+        index = self._index(indexName)
+        with self._lock:
+            for key in keys:
+                index.pop(key, None)
+        return {}
+
+    def query_vectors(self, vectorBucketName, indexName, queryVector, topK, filter=None,
+                      returnMetadata=False, returnDistance=False):
+        self.faults("s3vectors", "QueryVectors")
+        q = queryVector["float32"]
+        scored = []
+        for v in list(self._index(indexName).values()):
+            md = v.get("metadata", {})
+            if filter and not _matches(md, filter):
+                continue
+            distance = 1.0 - sum(a * b for a, b in zip(q, v["data"]["float32"]))
+            scored.append((distance, v))
+        scored.sort(key=lambda s: s[0])
+        out = []
+        for distance, v in scored[:topK]:
+            hit = {"key": v["key"]}
+            if returnMetadata:
+                hit["metadata"] = v.get("metadata", {})
+            if returnDistance:
+                hit["distance"] = distance
+            out.append(hit)
+        return {"vectors": out}
+
+
+def _matches(metadata: dict, flt: dict) -> bool:
+    for field, cond in flt.items():
+        if field == "$and":
+            if not all(_matches(metadata, c) for c in cond):
+                return False
+        elif "$eq" in cond and metadata.get(field) != cond["$eq"]:
+            return False
+        elif "$in" in cond and metadata.get(field) not in cond["$in"]:
+            return False
+    return True
+
+
+class FakeContext:
+    def __init__(self, function_name: str, timeout_s: float = 900.0):
+        self.invoked_function_arn = function_name
+        self.function_name = function_name
+        self._deadline = time.monotonic() + timeout_s
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
+
+
+class FakeLambda:
+    """
+    Runs Lambda handlers in-process. ``Event`` invocations also run inline,
+    so a benchmark op includes all the work it triggers.
+    """
+
+    def __init__(self, faults: Faults, handlers: dict | None = None):
+        self.faults = faults
+        self.handlers = dict(handlers or {})
+
+    def register(self, function_name: str, handler) -> None:
+        self.handlers[function_name] = handler
+
+    def invoke(self, FunctionName, Payload=b"{}", InvocationType="RequestResponse", **kwargs):
+        self.faults("lambda", "Invoke")
+        handler = self.handlers[FunctionName]
+        event = json.loads(Payload)
+        response = {"StatusCode": 202 if InvocationType == "Event" else 200}
+        try:
+            result = handler(event, FakeContext(FunctionName))
+        except Exception as e:
+            result = {"errorMessage": str(e), "errorType": type(e).__name__}
+            response["FunctionError"] = "Unhandled"
+        response["Payload"] = io.BytesIO(json.dumps(result, default=str).encode("utf-8"))
+        return response
+
+
+class FakeSecretsManager:
+    def __init__(self, faults: Faults, secrets: dict | None = None):
+        self.faults = faults
+        self.secrets = secrets or {}
+
+    def get_secret_value(self, SecretId):
+        self.faults("secretsmanager", "GetSecretValue")
+        return {"SecretString": self.secrets.get(SecretId, json.dumps({"GEMINI_API_KEY": "bench-key"}))}
+
+
+# ---- third-party APIs ----
+
+class _HttpResponse(io.BytesIO):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FakeGemini:
+    """Drop-in for ``urllib.request.urlopen`` against the generateContent API."""
+
+    def __init__(self, faults: Faults, answer_words: int = 80):
+        self.faults = faults
+        self.answer = " ".join(["lorem"] * answer_words)
+
+    def urlopen(self, request, timeout=None):
+        self.faults("gemini", "generateContent")
+        body = {"candidates": [{"content": {"parts": [{"text": self.answer}]}}]}
+        return _HttpResponse(json.dumps(body).encode("utf-8"))
+
+
+class FakeSemanticScholar:
+    def __init__(self, faults: Faults, results: int = 100):
+        self.faults = faults
+        self.results = results
+
+    def search_paper(self, query, limit=10, fields=None, **kwargs):
+        self.faults("semantic_scholar", "search_paper")
+        # Every third paper is also on arXiv (FakeArxivClient paper i): half of
+        # those carry the arXiv id, the rest only match by (re-cased) title.
+        return {"data": [
+            {
+                "paperId": hashlib.sha1(f"{query}:{i}".encode()).hexdigest(),
+                "title": f"{query.upper()} on arXiv {i}." if i % 3 == 0 else f"{query.title()} study {i}",
+                "externalIds": {"ArXiv": f"2401.{i:05d}"} if i % 6 == 0 else {},
+                "authors": [{"name": f"Author {i}"}, {"name": f"Author {i + 1}"}],
+                "publicationDate": (datetime(2024, 1, 1) + timedelta(days=i)).strftime("%Y-%m-%d"),
+                "url": f"https://www.semanticscholar.org/paper/{i}",
+                "abstract": f"We study {query} in setting {i}. " * 10,
+            }
+            for i in range(min(limit, self.results))
+        ]}
+
+    def get_papers(self, paper_ids, fields=None, **kwargs):
+        self.faults("semantic_scholar", "get_papers")
+        return [
+            {
+                "paperId": paper_id,
+                "title": f"Semantic Scholar paper {paper_id[:8]}",
+                "externalIds": {},
+                "authors": [{"name": "Author S"}],
+                "publicationDate": "2024-01-01",
+                "abstract": f"A paper with id {paper_id}. " * 10,
+                "openAccessPdf": {"url": f"https://pdfs.example.org/{paper_id}.pdf"},
+            }
+            for paper_id in paper_ids
+        ]
+
+
+class FakeArxivClient:
+    def __init__(self, faults: Faults, results: int = 100):
+        self.faults = faults
+        self.results_per_query = results
+
+    def results(self, search, offset=0):
+        self.faults("arxiv", "query")
+        if getattr(search, "id_list", None):
+            for arxiv_id in search.id_list:
+                version = arxiv_id if "v" in arxiv_id else arxiv_id + "v1"
+                yield SimpleNamespace(
+                    entry_id=f"http://arxiv.org/abs/{version}",
+                    title=f"arXiv paper {arxiv_id}",
+                    authors=[SimpleNamespace(name="Author A")],
+                    published=datetime(2024, 1, 1),
+                    pdf_url=f"http://arxiv.org/pdf/{version}",
+                    summary=f"The arXiv paper {arxiv_id}. " * 10,
+                )
+            return
+        for i in range(offset, min(search.max_results or self.results_per_query, self.results_per_query)):
+            yield SimpleNamespace(
+                entry_id=f"http://arxiv.org/abs/2401.{i:05d}v1",
+                title=f"{search.query.title()} on arXiv {i}",
+                authors=[SimpleNamespace(name=f"Author {i}")],
+                published=datetime(2024, 1, 1) + timedelta(days=i),
+                pdf_url=f"http://arxiv.org/pdf/2401.{i:05d}v1",
+                summary=f"An arXiv paper about {search.query}. " * 10,
+            )
+
+
+class FakePdfFetcher:
+    """importer fetcher serving the same PDF for every URL (``faults("pdf", "GET")`` per download)."""
+
+    def __init__(self, faults: Faults, pdf: bytes, chunk_size: int = 64 * 1024):
+        self.faults = faults
+        self.pdf = pdf
+        self.chunk_size = chunk_size
+
+    @contextmanager
+    def open(self, url):
+        self.faults("pdf", "GET")
+        yield (self.pdf[i:i + self.chunk_size] for i in range(0, len(self.pdf), self.chunk_size))
+
+
+# ---- fixtures ----
+
+_WORDS = (
+    "model training data neural network attention layer gradient loss optimization "
+    "retrieval embedding vector index query document corpus evaluation benchmark "
+    "latency throughput memory cache partition shard replica consistency"
+).split()
+
+
+def make_pdf(pages: int = 5, words_per_page: int = 400, title: str = "Benchmark Paper", seed: int = 0) -> bytes:
+    """A small valid PDF with extractable text on every page."""
+    rng = random.Random(seed)
+    objects = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(b"")   # filled in below
+    pages_obj = add(b"")
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    info = add(b"<< /Title (" + title.encode("latin-1") + b") /Author (Bench Author) >>")
+    kids = []
+    for _ in range(pages):
+        words = [rng.choice(_WORDS) for _ in range(words_per_page)]
+        lines = [" ".join(words[i:i + 12]) for i in range(0, len(words), 12)]
+        ops = ["BT", "/F1 10 Tf", "12 TL", "50 780 Td"]
+        ops += [f"({line}) Tj T*" for line in lines]
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1")
+        content = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        kids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 %d 0 R >> >> >>" % (pages_obj, content, font)
+        ))
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_obj
+    objects[pages_obj - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % k for k in kids), len(kids))
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, catalog, info, xref))
+    return out.getvalue()
@@ -0,0 +1,148 @@
+"""
+Measurement and comparison for bench scenarios.
+
+``measure`` drives one scenario op from a thread pool and reports
+throughput, latency percentiles and errors; peak memory is measured in a
+separate, shorter pass under tracemalloc so its overhead does not skew the
+latencies. ``compare`` diffs two result files.
+"""
+import contextlib
+import gc
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+MEMORY_PASS_OPS = 20
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def _timed_call(op, i: int):
+    start = time.perf_counter()
+    try:
+        op(i)
+        error = None
+    except Exception as e:
+        error = type(e).__name__
+    return (time.perf_counter() - start) * 1000.0, error
+
+
+def _drive(op, start: int, count: int, concurrency: int) -> tuple[list, float]:
+    began = time.perf_counter()
+    if concurrency <= 1:
+        samples = [_timed_call(op, i) for i in range(start, start + count)]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = list(pool.map(lambda i: _timed_call(op, i), range(start, start + count)))
+    return samples, time.perf_counter() - began
+
+
+def measure(op, iterations: int, concurrency: int = 1, warmup: int = 3, quiet: bool = True) -> dict:
+    """
+    Run ``op(i)`` ``iterations`` times (after ``warmup`` untimed calls) with
+    ``concurrency`` threads. ``op`` raising counts as an error, not a crash.
+    """
+    sink = open(os.devnull, "w") if quiet else None
+    redirect = contextlib.redirect_stdout(sink) if quiet else contextlib.nullcontext()
+    try:
+        with redirect:
+            _drive(op, 0, warmup, 1)
+            gc.collect()
+            samples, wall = _drive(op, warmup, iterations, concurrency)
+
+            gc.collect()
+            tracemalloc.start()
+            _drive(op, warmup + iterations, min(iterations, MEMORY_PASS_OPS), concurrency)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+    finally:
+        if sink:
+            sink.close()
+
+    latencies = sorted(ms for ms, _ in samples)
+    errors: dict[str, int] = {}
+    for _, error in samples:
+        if error:
+            errors[error] = errors.get(error, 0) + 1
+    return {
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "throughput_ops": round(iterations / wall, 2) if wall else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(latencies[-1], 3) if latencies else 0.0,
+        "errors": errors,
+        "error_rate": round(sum(errors.values()) / iterations, 4) if iterations else 0.0,
+        "peak_mem_mb": round(peak / (1024 * 1024), 3),
+    }
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+# Metrics where a lower value is better; the rest (throughput) are higher-is-better.
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "mean_ms", "peak_mem_mb", "error_rate")
+COMPARED = ("throughput_ops",) + LOWER_IS_BETTER
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.10) -> tuple[list[str], list[str]]:
+    """
+    Returns (report lines, regressions). A regression is a metric that got
+    worse by more than ``threshold`` (relative) in a scenario both runs have.
+    """
+    lines, regressions = [], []
+    for name, cur in current["scenarios"].items():
+        base = baseline["scenarios"].get(name)
+        if base is None:
+            lines.append(f"{name}: not in baseline")
+            continue
+        parts = []
+        for metric in COMPARED:
+            old, new = base.get(metric), cur.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else (0.0 if new == old else float("inf"))
+            worse = change > threshold if metric in LOWER_IS_BETTER else change < -threshold
+            flag = " !" if worse else ""
+            parts.append(f"{metric} {old:g} -> {new:g} ({change:+.1%}){flag}")
+            if worse:
+                regressions.append(f"{name}.{metric}: {old:g} -> {new:g} ({change:+.1%})")
+        lines.append(f"{name}:\n    " + "\n    ".join(parts))
+    return lines, regressions
+
+
+def format_table(scenarios: dict) -> str:
+    header = f"{'scenario':<14}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}{'peak MB':>10}"
+    rows = [header, "-" * len(header)]
+    for name, r in scenarios.items():
+        rows.append(
+            f"{name:<14}{r['throughput_ops']:>10.1f}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}"
+            f"{r['p99_ms']:>10.2f}{sum(r['errors'].values()):>8}{r['peak_mem_mb']:>10.2f}"
+        )
+    return "\n".join(rows)
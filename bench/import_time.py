@@ -0,0 +1,114 @@
+"""
+Cold-start profile: how long each entrypoint takes to import, measured in
+fresh interpreters (what a new uvicorn worker or Lambda container pays).
+
+    python bench/import_time.py                       # all entrypoints, median of 5 runs
+    python bench/import_time.py --target api --top 15
+    python bench/import_time.py --out bench/baselines/import_time.json
+
+For every target it reports the median import time, the time to then build
+all of the module's lazy clients (paper_common.clients), and the slowest
+modules from ``python -X importtime`` so a new heavy top-level import is easy
+to spot. Building clients needs no network or credentials.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # noqa: E402
+from scenarios import BACKEND_DIR, LAMBDA_ENV, LAMBDAS_DIR, LAYER_DIR  # noqa: E402
+
+TARGETS = {
+    "api": ("main", BACKEND_DIR),
+    "index_pdf": ("lambda_function", os.path.join(LAMBDAS_DIR, "1_index_pdf")),
+    "chunk_embed": ("lambda_function", os.path.join(LAMBDAS_DIR, "2_chunk_embed")),
+    "query_rag": ("lambda_function", os.path.join(LAMBDAS_DIR, "3_query_rag")),
+    "gemini_llm": ("lambda_function", os.path.join(LAMBDAS_DIR, "4_gemini_llm")),
+}
+
+CHILD = """
+import json, sys, time
+sys.path[:0] = {paths!r}
+start = time.perf_counter()
+import {module} as target
+imported = time.perf_counter()
+from paper_common import clients
+clients.warm_up(*vars(target).values())
+built = time.perf_counter()
+print(json.dumps({{"import_ms": (imported - start) * 1000, "clients_ms": (built - imported) * 1000}}))
+"""
+
+
+def _env() -> dict:
+    env = dict(os.environ, **LAMBDA_ENV, JOB_RUNNER="none", INDEX_PDF_LAMBDA_ARN="", WARM_UP_CLIENTS="0")
+    env.pop("VECTOR_MANIFEST_BUCKET", None)
+    return env
+
+
+def run_once(module: str, directory: str) -> dict:
+    code = CHILD.format(paths=[directory, LAYER_DIR], module=module)
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=directory, env=_env(), capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def slowest_imports(module: str, directory: str, top: int) -> list[tuple[str, float]]:
+    """Top-level dependencies of ``module`` by cumulative import time (ms)."""
+    code = f"import sys; sys.path[:0] = {[directory, LAYER_DIR]!r}; import {module}"
+    err = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], cwd=directory, env=_env(),
+        capture_output=True, text=True, check=True,
+    ).stderr
+    # -X importtime prints children before their parent, indented by depth.
+    rows, group = [], []
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        name = name[1:]
+        if not name.startswith(" "):
+            if name.strip() == module:
+                rows = group
+            group = []
+        elif not name.startswith("   "):
+            group.append((name.strip(), int(cumulative) / 1000.0))
+    return sorted(rows, key=lambda r: r[1], reverse=True)[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure cold-start import time of the API and the Lambdas.")
+    parser.add_argument("--target", action="append", choices=sorted(TARGETS), help="Entrypoint (repeatable; default: all)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8, help="Slowest direct imports to list per target")
+    parser.add_argument("--out", help="Write results JSON here")
+    args = parser.parse_args(argv)
+
+    results = {"environment": harness.environment(), "params": {"runs": args.runs}, "targets": {}}
+    for name in args.target or list(TARGETS):
+        module, directory = TARGETS[name]
+        samples = [run_once(module, directory) for _ in range(args.runs)]
+        result = {
+            "import_ms": round(statistics.median(s["import_ms"] for s in samples), 2),
+            "clients_ms": round(statistics.median(s["clients_ms"] for s in samples), 2),
+            "slowest_imports": [[mod, round(ms, 2)] for mod, ms in slowest_imports(module, directory, args.top)],
+        }
+        results["targets"][name] = result
+        print(f"{name:<12} import {result['import_ms']:>8.1f} ms   clients {result['clients_ms']:>8.1f} ms")
+        for mod, ms in result["slowest_imports"]:
+            print(f"    {ms:>8.1f} ms  {mod}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nWrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Run the benchmark scenarios against local fakes and record the results.
+
+    python bench/run.py                                  # all scenarios, no injected latency
+    python bench/run.py --scenario search --scenario rag --profile aws --concurrency 8
+    python bench/run.py --throttle-rate 0.05 --error-rate 0.01 --seed 7
+    python bench/run.py --out bench/baselines/my-branch.json --compare bench/baselines/baseline.json
+
+``--profile none`` (the default) measures the CPU cost of our own code
+path; ``--profile aws`` adds typical per-service latencies (see
+fakes.LATENCY_PROFILES). With ``--compare``, metrics that got worse than
+``--threshold`` are flagged and the exit status is 1, so the command can
+gate a CI job.
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakes  # noqa: E402
+import harness  # noqa: E402
+import scenarios  # noqa: E402
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the API and Lambda hot paths against local fakes.")
+    parser.add_argument("--scenario", action="append", choices=sorted(scenarios.SCENARIOS),
+                        help="Scenario to run (repeatable; default: all)")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--profile", choices=sorted(fakes.LATENCY_PROFILES), default="none")
+    parser.add_argument("--latency-ms", type=float, help="Same latency for every service (overrides --profile)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Per-call probability of a 5xx")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Per-call probability of a throttle")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pdf-pages", type=int, default=5)
+    parser.add_argument("--library-size", type=int, default=200)
+    parser.add_argument("--out", help="Write results JSON here")
+    parser.add_argument("--compare", help="Baseline results JSON to diff against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change counted as a regression")
+    parser.add_argument("--verbose", action="store_true", help="Do not silence the code under test's prints")
+    args = parser.parse_args(argv)
+
+    params = {
+        "iterations": args.iterations, "concurrency": args.concurrency, "profile": args.profile,
+        "latency_ms": args.latency_ms, "error_rate": args.error_rate, "throttle_rate": args.throttle_rate,
+        "seed": args.seed, "pdf_pages": args.pdf_pages, "library_size": args.library_size,
+    }
+    results = {"environment": harness.environment(), "params": params, "scenarios": {}}
+
+    for name in args.scenario or list(scenarios.SCENARIOS):
+        # Fresh fakes and RNG per scenario, so adding one does not shift another's fault draws.
+        faults = fakes.Faults(
+            profile=args.profile, latency_ms=args.latency_ms, error_rate=args.error_rate,
+            throttle_rate=args.throttle_rate, seed=args.seed,
+        )
+        env = scenarios.BenchEnv(faults, pdf_pages=args.pdf_pages, library_size=args.library_size)
+        print(f"Running {name} ...", flush=True)
+        with scenarios.SCENARIOS[name](env) as op:
+            result = harness.measure(op, args.iterations, args.concurrency, args.warmup, quiet=not args.verbose)
+        result["service_calls"] = dict(sorted(faults.calls.items()))
+        result["injected"] = dict(sorted(faults.injected.items()))
+        results["scenarios"][name] = result
+
+    print()
+    print(harness.format_table(results["scenarios"]))
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nWrote {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("params") != params:
+            print(f"\nNOTE: baseline was recorded with different params: {baseline.get('params')}")
+        lines, regressions = harness.compare(baseline, results, args.threshold)
+        print(f"\nCompared with {args.compare} ({baseline['environment'].get('commit')}):")
+        print("\n".join(lines))
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}:")
+            print("\n".join(f"  {r}" for r in regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
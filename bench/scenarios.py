@@ -0,0 +1,503 @@
+"""
+Benchmark scenarios: the API endpoints and the Lambda pipeline wired to
+the fakes in ``fakes.py``.
+
+Each scenario is a context manager that swaps the module-level clients of
+the code under test (``main.s3_client``, ``lambda_function.s3``, ...) for
+fakes, seeds whatever data the scenario needs, and yields ``op(i)`` - one
+request / invocation. The real modules are imported unchanged, so the
+numbers include everything the production code path does (PDF parsing,
+chunking, retries, metrics) except the network.
+"""
+import importlib.util
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+from unittest import mock
+
+import fakes
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+BACKEND_DIR = os.path.join(ROOT, "backend")
+LAMBDAS_DIR = os.path.join(ROOT, "AWS", "lambdas")
+LAYER_DIR = os.path.join(ROOT, "AWS", "layers", "paper_common", "python")
+
+for path in (LAYER_DIR, BACKEND_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+BENCH_USER = "bench-user"
+TEXT_BUCKET = "bench-texts"
+PDF_BUCKET = "bench-papers"
+VECTOR_BUCKET = "bench-vectors"
+VECTOR_INDEX = "bench-chunks"
+CHUNK_EMBED_FN = "ChunkAndEmbedLambda"
+GEMINI_FN = "GeminiLambda"
+
+# Env the Lambda modules read at import time.
+LAMBDA_ENV = {
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "TEXT_BUCKET": TEXT_BUCKET,
+    "VECTOR_BUCKET": VECTOR_BUCKET,
+    "VECTOR_INDEX": VECTOR_INDEX,
+    "METADATA_TABLE": "bench-metadata",
+    "CHUNK_EMBED_LAMBDA_ARN": CHUNK_EMBED_FN,
+    "GEMINI_LAMBDA_ARN": GEMINI_FN,
+}
+
+_modules = {}
+
+
+def load_lambda(folder: str):
+    """Import ``AWS/lambdas/<folder>/lambda_function.py`` once per process."""
+    if folder not in _modules:
+        path = os.path.join(LAMBDAS_DIR, folder, "lambda_function.py")
+        spec = importlib.util.spec_from_file_location(f"bench_{folder}", path)
+        module = importlib.util.module_from_spec(spec)
+        # patch.dict restores the whole environment on exit, including the pop.
+        with mock.patch.dict(os.environ, LAMBDA_ENV):
+            os.environ.pop("VECTOR_MANIFEST_BUCKET", None)
+            spec.loader.exec_module(module)
+        _modules[folder] = module
+    return _modules[folder]
+
+
+def load_api():
+    if "main" not in _modules:
+        # No metadata mirror: the search scenarios measure the upstream path.
+        env = {"AWS_DEFAULT_REGION": "us-east-1", "JOB_RUNNER": "none", "INDEX_PDF_LAMBDA_ARN": "", "METADATA_MIRROR_PATH": ""}
+        with mock.patch.dict(os.environ, env):
+            import main
+        _modules["main"] = main
+    return _modules["main"]
+
+
+class BenchEnv:
+    """One set of fakes sharing a ``Faults`` injector."""
+
+    def __init__(self, faults: fakes.Faults, pdf_pages: int = 5, library_size: int = 200, corpus_papers: int = 20):
+        self.faults = faults
+        self.pdf_pages = pdf_pages
+        self.library_size = library_size
+        self.corpus_papers = corpus_papers
+        self.s3 = fakes.FakeS3(faults)
+        self.table = fakes.FakeTable(faults)
+        self.bedrock = fakes.FakeBedrock(faults)
+        self.s3v = fakes.FakeS3Vectors(faults)
+        self.lambda_client = fakes.FakeLambda(faults)
+        self.secrets = fakes.FakeSecretsManager(faults)
+        self.gemini = fakes.FakeGemini(faults)
+        self.semantic_scholar = fakes.FakeSemanticScholar(faults)
+        self.arxiv = fakes.FakeArxivClient(faults)
+        self.pdf = fakes.make_pdf(pages=pdf_pages)
+
+    # Seeding bypasses fault injection so setup is never throttled.
+
+    def seed_library(self, user_id: str = BENCH_USER) -> None:
+        for i in range(self.library_size):
+            document_id = f"lib-{i}"
+            self.table.items[document_id] = {
+                "document_id": document_id,
+                "user_id": user_id,
+                "title": f"neural network paper {i}" if i % 4 == 0 else f"paper {i}",
+                "author": "Bench Author",
+                "filename": f"paper-{i}.pdf",
+                "s3_key": f"user/{user_id}/papers/{document_id}.pdf",
+                "s3_bucket": PDF_BUCKET,
+                "source": "user_upload",
+                "page_count": self.pdf_pages,
+                # Some library papers are arXiv preprints the search also finds.
+                "abstract_snippet": "a benchmark abstract about neural network retrieval"
+                + (f" arXiv:2401.{i:05d}v1" if i % 8 == 0 else ""),
+                "uploaded_at": f"2024-01-{1 + i % 28:02d}T00:00:00",
+                "status": "indexed",
+            }
+
+    def seed_vectors(self, chunks_per_paper: int = 25, dims: int = 256, user_id: str = BENCH_USER,
+                     index_name: str = VECTOR_INDEX) -> None:
+        index = self.s3v.indexes.setdefault(index_name, {})
+        for p in range(self.corpus_papers):
+            for c in range(chunks_per_paper):
+                key = f"{user_id}:paper-{p}:{c}"
+                text = f"chunk {c} of paper {p} " * 40
+                index[key] = {
+                    "key": key,
+                    "data": {"float32": fakes.fake_embedding(text, dims)},
+                    "metadata": {"source_text": text, "user_id": user_id, "paper_id": f"paper-{p}", "chunk_index": c},
+                }
+
+    def seed_artifacts(self, chunks_per_paper: int = 25, user_id: str = BENCH_USER) -> None:
+        """Text artifacts for the ``seed_vectors`` corpus: one equal-length page per chunk, chunked page by page."""
+        from paper_common import artifacts, keys
+
+        for p in range(self.corpus_papers):
+            pages = [(f"chunk {c:02d} of paper {p:02d} " * 40).strip() for c in range(chunks_per_paper)]
+            self.s3.objects[(TEXT_BUCKET, keys.artifact_key(user_id, f"paper-{p}"))] = {
+                "Body": artifacts.write_artifact(pages, max_chars=len(pages[0])), "ETag": '"a"', "ContentType": artifacts.CONTENT_TYPE,
+                "LastModified": None,
+            }
+
+
+def _patch(stack: ExitStack, module, **attrs) -> None:
+    for name, value in attrs.items():
+        if hasattr(module, name):
+            stack.enter_context(mock.patch.object(module, name, value))
+
+
+def _per_thread(factory):
+    local = threading.local()
+
+    def get():
+        if not hasattr(local, "value"):
+            local.value = factory()
+        return local.value
+    return get
+
+
+def _check(response) -> None:
+    if response.status_code >= 400:
+        raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+
+
+@contextmanager
+def api(env: BenchEnv):
+    from fastapi.testclient import TestClient
+
+    main = load_api()
+    with ExitStack() as stack:
+        _patch(
+            stack, main,
+            s3_client=main._limited_client("s3", env.s3), table=main._limited_client("dynamodb", env.table),
+            dynamodb=main._limited_client("dynamodb", fakes.FakeDynamoDB(env.faults, {main.DYNAMODB_TABLE: env.table})),
+            metadata_cache=main.paper_cache.PaperCache(ttl_seconds=main.PAPER_CACHE_TTL),
+            ss_client=env.semantic_scholar, arxiv_client=env.arxiv, reranker=main.rerank.Reranker(env.bedrock),
+            # One bench user drives every request: per-user rate limits would reject most of them.
+            rate_limiter=main.limits.RateLimiter(main.limits.MemoryBucketStore(), {}),
+            SS_API_KEY="bench", S3_BUCKET_NAME=PDF_BUCKET, job_queue=None,
+        )
+        yield _per_thread(lambda: TestClient(main.app))
+
+
+@contextmanager
+def upload(env: BenchEnv):
+    """POST /upload of a ``pdf_pages``-page PDF (metadata parse, S3 put, DynamoDB put)."""
+    with api(env) as client:
+        def op(i):
+            _check(client().post(
+                "/upload",
+                params={"user_id": BENCH_USER},
+                files={"file": (f"paper-{i}.pdf", env.pdf, "application/pdf")},
+            ))
+        yield op
+
+
+@contextmanager
+def direct_upload(env: BenchEnv):
+    """
+    POST /upload/presign, the browser's POST to S3, POST /upload/complete, and
+    the background metadata extraction of a 100-page PDF (ranged GETs only).
+    """
+    main = load_api()
+    pdf = fakes.make_pdf(pages=100)
+    with ExitStack() as stack:
+        _patch(stack, main, direct_uploads=main.uploads.DirectUploads(
+            main._limited_client("s3", env.s3), main._limited_client("dynamodb", env.table), PDF_BUCKET,
+            extract=main.extract_pdf_metadata,
+        ))
+        with api(env) as client:
+            def op(i):
+                response = client().post(
+                    "/upload/presign", params={"user_id": BENCH_USER}, json={"filename": f"paper-{i}.pdf", "size": len(pdf)},
+                )
+                _check(response)
+                upload = response.json()
+                env.s3.post_presigned(upload["url"], upload["fields"], pdf)
+                _check(client().post(
+                    "/upload/complete", params={"user_id": BENCH_USER}, json={"document_id": upload["document_id"]},
+                ))
+                item = env.table.items[upload["document_id"]]
+                deadline = time.monotonic() + 30
+                while item["metadata_status"] == "pending" and time.monotonic() < deadline:
+                    time.sleep(0.001)
+                if item["metadata_status"] != "extracted" or item["page_count"] != 100:
+                    raise RuntimeError(f"metadata not extracted: {item['metadata_status']}")
+            yield op
+
+
+@contextmanager
+def search(env: BenchEnv):
+    """GET /search across Semantic Scholar, arXiv and a ``library_size``-paper library."""
+    env.seed_library()
+    with api(env) as client:
+        def op(i):
+            _check(client().get("/search", params={"query": "neural network", "limit": 10, "user_id": BENCH_USER}))
+        yield op
+
+
+@contextmanager
+def paged_search(env: BenchEnv):
+    """GET /search/page, then two more pages with the returned cursor (later pages come from the buffer)."""
+    env.seed_library()
+    with api(env) as client:
+        def op(i):
+            params = {"query": "neural network", "limit": 10, "user_id": BENCH_USER}
+            for _ in range(3):
+                response = client().get("/search/page", params=params)
+                _check(response)
+                params = {"cursor": response.json()["next_cursor"], "limit": 10, "user_id": BENCH_USER}
+        yield op
+
+
+@contextmanager
+def search_rerank(env: BenchEnv):
+    """GET /search with Titan re-ranking; paper embeddings are cached after the first iteration."""
+    env.seed_library()
+    with api(env) as client:
+        def op(i):
+            _check(client().get(
+                "/search", params={"query": "neural network", "limit": 10, "user_id": BENCH_USER, "rerank": "true"},
+            ))
+        yield op
+
+
+@contextmanager
+def import_papers(env: BenchEnv):
+    """POST /import of 4 new arXiv papers (parallel PDF downloads streamed to S3) plus one already in the library."""
+    env.seed_library()
+    main = load_api()
+    with ExitStack() as stack:
+        _patch(stack, main, paper_importer=main.importer.Importer(
+            main._limited_client("s3", env.s3), main._limited_client("dynamodb", env.table), PDF_BUCKET, fakes.FakePdfFetcher(env.faults, env.pdf),
+        ))
+        with api(env) as client:
+            def op(i):
+                papers = [{"source": "arXiv", "id": f"2401.{50000 + 4 * i + k:05d}"} for k in range(4)]
+                papers.append({"source": "arXiv", "id": "2401.00008v1"})   # lib-8
+                response = client().post("/import", params={"user_id": BENCH_USER}, json={"papers": papers})
+                _check(response)
+                if response.json()["imported"] != 4:
+                    raise RuntimeError(f"unexpected import report: {response.text[:200]}")
+            yield op
+
+
+@contextmanager
+def bulk_delete(env: BenchEnv):
+    """POST /library/delete of 20 indexed papers (PDF, text, 25 vectors and metadata each); seeding is in the timing."""
+    from paper_common import generations, keys
+
+    main = load_api()
+    index = env.s3v.indexes.setdefault(VECTOR_INDEX, {})
+    with ExitStack() as stack:
+        _patch(stack, main, paper_deleter=main.deletion.PaperDeleter(
+            main._limited_client("s3", env.s3), main._limited_client("dynamodb", env.table),
+            text_bucket=TEXT_BUCKET, s3v=env.s3v, vector_bucket=VECTOR_BUCKET,
+            generation_source=generations.StaticGenerations(VECTOR_INDEX),
+        ))
+        with api(env) as client:
+            def op(i):
+                document_ids = [f"del-{i}-{k}" for k in range(20)]
+                for document_id in document_ids:
+                    pdf_key = keys.pdf_key(BENCH_USER, document_id)
+                    env.table.items[document_id] = {
+                        "document_id": document_id, "user_id": BENCH_USER, "s3_bucket": PDF_BUCKET,
+                        "s3_key": pdf_key, "status": "indexed", "num_chunks": 25,
+                    }
+                    env.s3.objects[(PDF_BUCKET, pdf_key)] = {"Body": env.pdf, "ETag": '"x"', "ContentType": None,
+                                                             "LastModified": None}
+                    env.s3.objects[(TEXT_BUCKET, keys.text_key(BENCH_USER, document_id))] = {
+                        "Body": b"text", "ETag": '"y"', "ContentType": None, "LastModified": None}
+                    for c in range(25):
+                        key = keys.vector_key(BENCH_USER, document_id, c)
+                        index[key] = {"key": key, "data": {"float32": [0.0]}, "metadata": {}}
+                response = client().post(
+                    "/library/delete", params={"user_id": BENCH_USER}, json={"document_ids": document_ids},
+                )
+                _check(response)
+                if response.json()["deleted"] != 20 or any(k.startswith(f"{BENCH_USER}:del-{i}-") for k in index):
+                    raise RuntimeError(f"incomplete delete: {response.text[:200]}")
+            yield op
+
+
+@contextmanager
+def library(env: BenchEnv):
+    """GET /library for a user with ``library_size`` papers."""
+    env.seed_library()
+    with api(env) as client:
+        def op(i):
+            _check(client().get("/library", params={"user_id": BENCH_USER}))
+        yield op
+
+
+@contextmanager
+def paper_details(env: BenchEnv):
+    """GET /papers?ids= for 20 papers, then GET /paper/{id} revalidated with If-None-Match (304 from the cache)."""
+    env.seed_library()
+    with api(env) as client:
+        def op(i):
+            ids = [f"lib-{(i * 20 + k) % env.library_size}" for k in range(20)]
+            _check(client().get("/papers", params={"ids": ",".join(ids)}))
+            response = client().get(f"/paper/{ids[0]}")
+            _check(response)
+            response = client().get(f"/paper/{ids[0]}", headers={"If-None-Match": response.headers["etag"]})
+            if response.status_code != 304:
+                raise RuntimeError(f"expected 304, got {response.status_code}")
+        yield op
+
+
+@contextmanager
+def pipeline(env: BenchEnv):
+    """IndexPdfLambda -> ChunkAndEmbedLambda for one paper, end to end (wait=True)."""
+    from paper_common import generations
+
+    index_pdf = load_lambda("1_index_pdf")
+    chunk_embed = load_lambda("2_chunk_embed")
+    env.lambda_client.register(CHUNK_EMBED_FN, chunk_embed.lambda_handler)
+    with ExitStack() as stack:
+        _patch(stack, index_pdf, s3=env.s3, lambda_client=env.lambda_client, metadata_table=env.table)
+        _patch(
+            stack, chunk_embed,
+            s3=env.s3, s3v=env.s3v, bedrock=env.bedrock, lambda_client=env.lambda_client,
+            metadata_table=env.table,
+            generation_source=generations.StaticGenerations(VECTOR_INDEX, chunk_embed.BEDROCK_MODEL_ID,
+                                                            chunk_embed.EMBED_DIMS),
+        )
+
+        def op(i):
+            document_id = str(uuid.uuid4())
+            key = f"user/{BENCH_USER}/papers/{document_id}.pdf"
+            env.s3.objects[(PDF_BUCKET, key)] = {
+                "Body": env.pdf, "ETag": '"bench"', "ContentType": "application/pdf", "LastModified": None,
+            }
+            env.table.items[document_id] = {"document_id": document_id, "user_id": BENCH_USER, "status": "uploaded"}
+            result = index_pdf.lambda_handler(
+                {"document_id": document_id, "user_id": BENCH_USER, "pdf_s3_bucket": PDF_BUCKET,
+                 "pdf_s3_key": key, "wait": True},
+                fakes.FakeContext("IndexPdfLambda"),
+            )
+            embed_result = result.get("chunk_embed_result") or {}
+            if result.get("statusCode") != 200 or embed_result.get("statusCode") != 200:
+                raise RuntimeError(f"pipeline failed: {result.get('status') or embed_result.get('status')}")
+        yield op
+
+
+class _Routing:
+    def __init__(self, routing: dict):
+        self.routing = routing
+
+    def get(self) -> dict:
+        return self.routing
+
+
+@contextmanager
+def rag(env: BenchEnv, context_window: int = 0, other_tenants: int = 0):
+    """QueryRagLambda over ``corpus_papers`` x 25 chunks, with the GeminiLambda answer."""
+    from paper_common import generations, partitions
+
+    query_rag = load_lambda("3_query_rag")
+    gemini = load_lambda("4_gemini_llm")
+    routing = partitions.empty_routing()
+    if other_tenants:
+        # The bench user has a dedicated partition; everyone else shares the generation's index.
+        routing["current"]["dedicated"][BENCH_USER] = "u-bench"
+        for t in range(other_tenants):
+            env.seed_vectors(dims=query_rag.EMBED_DIMS, user_id=f"tenant-{t}")
+    env.seed_vectors(
+        dims=query_rag.EMBED_DIMS,
+        index_name=partitions.index_name(VECTOR_INDEX, partitions.read_partition(routing, BENCH_USER)),
+    )
+    if context_window:
+        env.seed_artifacts()
+    env.lambda_client.register(GEMINI_FN, gemini.lambda_handler)
+    with ExitStack() as stack:
+        _patch(
+            stack, query_rag,
+            s3=env.s3, s3v=env.s3v, bedrock=env.bedrock, lambda_client=env.lambda_client,
+            generation_source=generations.StaticGenerations(VECTOR_INDEX, query_rag.BEDROCK_MODEL_ID,
+                                                            query_rag.EMBED_DIMS),
+            routing_source=_Routing(routing),
+        )
+        _patch(stack, gemini, secrets_client=env.secrets)
+        stack.enter_context(mock.patch.object(gemini.urllib.request, "urlopen", env.gemini.urlopen))
+
+        def op(i):
+            result = query_rag.lambda_handler(
+                {"user_id": BENCH_USER, "question": f"what does paper {i % 20} say about chunk {i}?",
+                 "top_k": 5, "invoke_gemini": True, "context_window": context_window},
+                fakes.FakeContext("QueryRagLambda"),
+            )
+            if not result.get("answer"):
+                raise RuntimeError("no answer")
+            if context_window and not all(c.get("context") for c in result["top_k_chunks"]):
+                raise RuntimeError("missing context")
+        yield op
+
+
+def rag_context(env: BenchEnv):
+    """``rag`` with context_window=1: neighbouring chunks read from the text artifacts with ranged GETs."""
+    return rag(env, context_window=1)
+
+
+def rag_partitioned(env: BenchEnv):
+    """``rag`` with 20 other tenants' 10000 vectors in the shared index and the user in a dedicated partition."""
+    return rag(env, other_tenants=20)
+
+
+@contextmanager
+def rag_followup(env: BenchEnv):
+    """
+    Chats of 6 questions that walk through a paper (each asks about the next
+    chunk), with conversation_id: follow-ups are scored against the working
+    set, and the vector store is queried only when it has no good match.
+    """
+    from paper_common import generations, partitions, sessions
+
+    query_rag = load_lambda("3_query_rag")
+    gemini = load_lambda("4_gemini_llm")
+    env.seed_vectors(dims=query_rag.EMBED_DIMS)
+    env.lambda_client.register(GEMINI_FN, gemini.lambda_handler)
+    with ExitStack() as stack:
+        _patch(
+            stack, query_rag,
+            s3=env.s3, s3v=env.s3v, bedrock=env.bedrock, lambda_client=env.lambda_client,
+            generation_source=generations.StaticGenerations(VECTOR_INDEX, query_rag.BEDROCK_MODEL_ID,
+                                                            query_rag.EMBED_DIMS),
+            routing_source=_Routing(partitions.empty_routing()),
+            session_store=sessions.SessionStore(fakes.FakeTable(env.faults, key="conversation_id")),
+            SESSION_NEIGHBOURS=2,
+        )
+        _patch(stack, gemini, secrets_client=env.secrets)
+        stack.enter_context(mock.patch.object(gemini.urllib.request, "urlopen", env.gemini.urlopen))
+
+        def op(i):
+            chat, turn = divmod(i, 6)
+            paper, chunk = chat % env.corpus_papers, 3 + turn
+            # The fake embeddings only match identical text: ask with the chunk's own text.
+            result = query_rag.lambda_handler(
+                {"user_id": BENCH_USER, "question": f"chunk {chunk} of paper {paper} " * 40, "top_k": 1,
+                 "invoke_gemini": True, "conversation_id": f"chat-{chat}"},
+                fakes.FakeContext("QueryRagLambda"),
+            )
+            if not result.get("answer") or result["top_k_chunks"][0]["chunk_index"] != chunk:
+                raise RuntimeError(f"wrong chunk: {result['top_k_chunks'][:1]}")
+        yield op
+
+
+SCENARIOS = {
+    "upload": upload,
+    "direct_upload": direct_upload,
+    "search": search,
+    "paged_search": paged_search,
+    "search_rerank": search_rerank,
+    "import": import_papers,
+    "bulk_delete": bulk_delete,
+    "library": library,
+    "paper_details": paper_details,
+    "pipeline": pipeline,
+    "rag": rag,
+    "rag_context": rag_context,
+    "rag_partitioned": rag_partitioned,
+    "rag_followup": rag_followup,
+}
@@ -14,6 +14,12 @@ export interface Paper {
   abstract_snippet: string;
   in_library: boolean;
   page_count?: number;
+  doi?: string;
+  arxiv_id?: string;
+  // Every source that returned this paper (duplicates are merged server-side)
+  sources?: Array<{ source: string; id: string; url: string | null }>;
+  score?: number;
+  similarity?: number;  // with ?rerank=true
 }
 
 export interface UploadResponse {
@@ -27,6 +33,19 @@ export interface UploadResponse {
   message: string;
 }
 
+export interface ImportResponse {
+  results: Array<{
+    source: string;
+    id: string;
+    status: 'imported' | 'duplicate' | 'failed';
+    document_id?: string;
+    error?: string;
+  }>;
+  imported: number;
+  duplicates: number;
+  failed: number;
+}
+
 export interface LibraryResponse {
   count: number;
   papers: Array<{
@@ -97,6 +116,103 @@ export async function uploadPDF(file: File, userId: string = 'default_user'): Pr
   }
 }
 
+export interface PresignedUpload {
+  document_id: string;
+  bucket: string;
+  key: string;
+  expires_in: number;
+  method: 'POST' | 'PUT';
+  url?: string;                           // POST
+  fields?: Record<string, string>;        // POST
+  upload_id?: string;                     // PUT (multipart)
+  part_size?: number;
+  parts?: Array<{ part_number: number; size: number; url: string }>;
+}
+
+/**
+ * Upload a PDF straight to S3 with presigned URLs, then register it.
+ * Title/author/page count arrive later (metadata_status: pending -> extracted).
+ */
+export async function uploadPDFDirect(file: File, userId: string = 'default_user') {
+  try {
+    const presignResponse = await fetch(`${API_BASE_URL}/upload/presign?user_id=${userId}`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ filename: file.name, size: file.size, content_type: 'application/pdf' }),
+    });
+    if (!presignResponse.ok) {
+      const error = await presignResponse.json();
+      throw new Error(error.detail || 'Upload failed');
+    }
+    const upload: PresignedUpload = await presignResponse.json();
+
+    const complete: Record<string, unknown> = { document_id: upload.document_id };
+    if (upload.method === 'POST') {
+      const form = new FormData();
+      Object.entries(upload.fields!).forEach(([name, value]) => form.append(name, value));
+      form.append('file', file);
+      const s3Response = await fetch(upload.url!, { method: 'POST', body: form });
+      if (!s3Response.ok) throw new Error(`S3 upload failed: ${s3Response.status}`);
+    } else {
+      const parts = [];
+      try {
+        for (const part of upload.parts!) {
+          const start = (part.part_number - 1) * upload.part_size!;
+          const s3Response = await fetch(part.url, { method: 'PUT', body: file.slice(start, start + part.size) });
+          if (!s3Response.ok) throw new Error(`S3 upload of part ${part.part_number} failed: ${s3Response.status}`);
+          parts.push({ part_number: part.part_number, etag: s3Response.headers.get('ETag') });
+        }
+      } catch (error) {
+        await fetch(`${API_BASE_URL}/upload/abort?user_id=${userId}`, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({ document_id: upload.document_id, upload_id: upload.upload_id }),
+        });
+        throw error;
+      }
+      complete.upload_id = upload.upload_id;
+      complete.parts = parts;
+    }
+
+    const response = await fetch(`${API_BASE_URL}/upload/complete?user_id=${userId}`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(complete),
+    });
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.detail || 'Upload failed');
+    }
+    return await response.json();
+  } catch (error) {
+    console.error('Upload error:', error);
+    throw error;
+  }
+}
+
+/**
+ * Import search results (arXiv / Semantic Scholar) into the library; the server downloads the PDFs
+ */
+export async function importPapers(papers: Pick<Paper, 'source' | 'id'>[], userId: string = 'default_user'): Promise<ImportResponse> {
+  try {
+    const response = await fetch(`${API_BASE_URL}/import?user_id=${userId}`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ papers: papers.map(({ source, id }) => ({ source, id })) }),
+    });
+
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.detail || 'Import failed');
+    }
+
+    return await response.json();
+  } catch (error) {
+    console.error('Import error:', error);
+    throw error;
+  }
+}
+
 /**
  * Get all papers in user's library
  */
@@ -133,6 +249,24 @@ export async function getPaperDetails(documentId: string) {
   }
 }
 
+/**
+ * Get details of several papers in one request
+ */
+export async function getPapers(documentIds: string[]): Promise<{ papers: LibraryResponse['papers']; missing: string[] }> {
+  try {
+    const response = await fetch(`${API_BASE_URL}/papers?ids=${documentIds.map(encodeURIComponent).join(',')}`);
+
+    if (!response.ok) {
+      throw new Error(`Failed to get papers: ${response.statusText}`);
+    }
+
+    return await response.json();
+  } catch (error) {
+    console.error('Get papers error:', error);
+    throw error;
+  }
+}
+
 /**
  * Delete a paper from the library
  */
@@ -154,6 +288,33 @@ export async function deletePaper(documentId: string, userId: string = 'default_
   }
 }
 
+/**
+ * Delete many papers (or the whole library with `all`), including their extracted text and vectors
+ */
+export async function deletePapers(
+  documentIds: string[],
+  userId: string = 'default_user',
+  all: boolean = false
+): Promise<{ results: Array<{ document_id: string; status: string; errors?: string[] }>; deleted: number; failed: number }> {
+  try {
+    const response = await fetch(`${API_BASE_URL}/library/delete?user_id=${userId}`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ document_ids: documentIds, all }),
+    });
+
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.detail || 'Delete failed');
+    }
+
+    return await response.json();
+  } catch (error) {
+    console.error('Bulk delete error:', error);
+    throw error;
+  }
+}
+
 /**
  * Check backend health status
  */